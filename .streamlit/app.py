@@ -1,9 +1,9 @@
 import streamlit as st
 import requests
 import json
-import base64
 import datetime as dt
 import os
+import time
 from config import API_BASE_URL
 from dotenv import load_dotenv
 from typing import Any
@@ -22,38 +22,9 @@ except Exception:
     st_folium = None
     folium = None
 
-# 轻量地理编码
-try:
-    from geopy.geocoders import Nominatim  # type: ignore
-    from geopy.extra.rate_limiter import RateLimiter  # type: ignore
-except Exception:
-    Nominatim = None
-    RateLimiter = None
-
-# 使用 geonamescache 提供的国家/城市数据库
-try:
-    import geonamescache  # type: ignore
-    GC = geonamescache.GeonamesCache()
-    _countries = GC.get_countries()
-    HOT_COUNTRIES = {'CN': '中国', 'JP': '日本', 'KR': '韩国', 'US': '美国', 'GB': '英国', 'RU': '俄罗斯'}
-    COUNTRY_CODE_TO_NAME = {code: HOT_COUNTRIES.get(code, data['name']) for code, data in _countries.items() if code in HOT_COUNTRIES}
-    COUNTRY_CHOICES = [COUNTRY_CODE_TO_NAME[c] for c in COUNTRY_CODE_TO_NAME]
-    NAME_TO_CODE = {v: k for k, v in COUNTRY_CODE_TO_NAME.items()}
-    _cities = GC.get_cities()
-    CITIES_BY_COUNTRY = {}
-    for _, cdata in _cities.items():
-        cc = cdata.get('countrycode')
-        name = cdata.get('name')
-        if cc in COUNTRY_CODE_TO_NAME and name:
-            CITIES_BY_COUNTRY.setdefault(cc, set()).add(name)
-    for cc in list(CITIES_BY_COUNTRY.keys()):
-        CITIES_BY_COUNTRY[cc] = sorted(CITIES_BY_COUNTRY[cc])
-except Exception:
-    geonamescache = None
-    GC = None
-    COUNTRY_CHOICES = ["中国", "日本", "韩国", "美国", "英国", "俄罗斯"]
-    NAME_TO_CODE = {"中国":"CN","日本":"JP","韩国":"KR","美国":"US","英国":"GB","俄罗斯":"RU"}
-    CITIES_BY_COUNTRY = {k: [] for k in NAME_TO_CODE.values()}
+# 热门国家（城市列表由后端的预构建城市索引提供，见 fetch_cities）
+COUNTRY_CHOICES = ["中国", "日本", "韩国", "美国", "英国", "俄罗斯"]
+NAME_TO_CODE = {"中国":"CN","日本":"JP","韩国":"KR","美国":"US","英国":"GB","俄罗斯":"RU"}
 
 # 热门国家中文城市（离线），可扩展
 CHINESE_CITIES = {
@@ -65,6 +36,26 @@ CHINESE_CITIES = {
     "俄罗斯": ["莫斯科", "圣彼得堡", "海参崴"],
 }
 
+# 城市前缀补全（后端城市索引），同一国家与前缀的结果缓存一天。
+# 请求失败时抛出异常而不是返回空列表：st.cache_data 不缓存异常，后端恢复后下次重跑即可取到结果
+@st.cache_data(ttl=86400, show_spinner=False)
+def fetch_cities(country_code: str, prefix: str = "", limit: int = 50, api_base: str = API_BASE_URL) -> list[str]:
+    r = requests.get(f"{api_base}/api/v1/geo/cities", params={"country": country_code, "prefix": prefix, "limit": limit}, timeout=5)
+    r.raise_for_status()
+    names = [c.get("zh") or c["name"] for c in r.json().get("cities", [])]
+    return list(dict.fromkeys(names))
+
+# 非中国国家的城市选项：未输入时为热门中文城市，输入前缀后为索引补全结果；后端不可用时退回热门城市
+def city_options(country: str, prefix: str) -> list[str]:
+    code = NAME_TO_CODE.get(country, "")
+    hot = CHINESE_CITIES.get(country, [])
+    if not code or (hot and not prefix.strip()):
+        return hot
+    try:
+        return fetch_cities(code, prefix.strip())
+    except Exception:
+        return hot
+
 # 高德中国行政区层级（在线）
 @st.cache_data(ttl=86400)
 def fetch_amap_china_hierarchy(api_key: str) -> tuple[list[str], dict[str, list[str]]]:
@@ -261,18 +252,31 @@ with st.sidebar:
             pid = plans[idx]["id"]
             if st.button("查看版本"):
                 try:
-                    r = requests.get(f"{api_base}/api/v1/plans/{pid}/versions", headers={"Authorization": f"Bearer {st.session_state['auth_token']}"}, timeout=20)
+                    # 只拉取版本摘要（不含行程数据），选中后再按需获取单个版本
+                    r = requests.get(f"{api_base}/api/v1/plans/{pid}/versions/summary", headers={"Authorization": f"Bearer {st.session_state['auth_token']}"}, timeout=20)
                     st.session_state["_plan_versions"] = r.json()
                     st.session_state["_active_plan_id"] = pid
                 except Exception as e:
                     st.error(f"获取版本失败：{e}")
         vers = st.session_state.get("_plan_versions", [])
         if vers:
-            vidx = st.selectbox("选择版本", list(range(len(vers))), format_func=lambda i: f"v{vers[i]['version']}#{vers[i]['id']}")
+            def _version_label(i):
+                v = vers[i]
+                size_kb = f" · {v['size'] / 1024:.1f}KB" if v.get("size") else ""
+                stars = f" · {'★' * v['rating']}" if v.get("rating") else ""
+                return f"v{v['version']}#{v['id']}{stars}{size_kb}"
+            vidx = st.selectbox("选择版本", list(range(len(vers))), format_func=_version_label)
             if st.button("设为当前"):
-                v = vers[vidx]
-                st.session_state["plan_data"] = v["data"]
-                st.info("已加载所选版本为当前行程。")
+                try:
+                    v = vers[vidx]
+                    pid = st.session_state.get("_active_plan_id")
+                    r = requests.get(f"{api_base}/api/v1/plans/{pid}/versions/{v['version']}", headers={"Authorization": f"Bearer {st.session_state['auth_token']}"}, timeout=20)
+                    r.raise_for_status()
+                    st.session_state["plan_data"] = r.json()["data"]
+                    st.session_state["_saved_ref"] = (pid, v["version"])
+                    st.info("已加载所选版本为当前行程。")
+                except Exception as e:
+                    st.error(f"获取版本失败：{e}")
             if st.button("收藏/取消收藏"):
                 try:
                     pid = st.session_state.get("_active_plan_id")
@@ -288,9 +292,12 @@ with st.sidebar:
                 try:
                     v = vers[vidx]
                     payload = {"plan_id": st.session_state.get("_active_plan_id"), "version": v["id"], "feedback": f"评分: {score}; {fb}"}
-                    r = requests.post(f"{api_base}/api/v1/plans/replan", json=payload, headers={"Authorization": f"Bearer {st.session_state['auth_token']}"}, timeout=60)
+                    # 再规划会实际运行规划阶段（通常只重跑行程规划或受影响的日期），等待时间与后端规划超时一致
+                    r = requests.post(f"{api_base}/api/v1/plans/replan", json=payload, headers={"Authorization": f"Bearer {st.session_state['auth_token']}"}, timeout=300)
                     r.raise_for_status()
-                    st.success("已创建新版本，刷新我的计划查看。")
+                    res = r.json()
+                    scope = {"full": "完整重新规划", "guide": "重跑城市指南与行程", "plan": "只重跑行程规划", "days": f"只重写 {'、'.join(res.get('days', []))}"}.get(res.get("mode"), "")
+                    st.success(f"已创建新版本 v{res.get('version')}（{scope}），刷新我的计划查看。")
                 except Exception as e:
                     st.error(f"再规划失败：{e}")
 
@@ -332,8 +339,8 @@ with st.container():
             else:
                 city_o_sel = ""
         elif country_o_sel != "请选择":
-            zh_cities = CHINESE_CITIES.get(country_o_sel)
-            options = ["请选择", "手动输入"] + (zh_cities if zh_cities else CITIES_BY_COUNTRY.get(NAME_TO_CODE.get(country_o_sel, ""), []))
+            prefix_o = st.text_input("搜索城市（中文/英文/拼音）", key="city_o_prefix")
+            options = ["请选择", "手动输入"] + city_options(country_o_sel, prefix_o)
             city_o_sel = st.selectbox("城市", options, index=0, key="city_o_sel")
             if city_o_sel == "手动输入":
                 city_o_sel = st.text_input("城市_手动", key="city_o_sel_manual")
@@ -395,8 +402,8 @@ with st.container():
             else:
                 city_c_sel = ""
         elif country_c_sel != "请选择":
-            zh_cities_c = CHINESE_CITIES.get(country_c_sel)
-            options_c = ["请选择", "手动输入"] + (zh_cities_c if zh_cities_c else CITIES_BY_COUNTRY.get(NAME_TO_CODE.get(country_c_sel, ""), []))
+            prefix_c = st.text_input("搜索城市_候选（中文/英文/拼音）", key="city_c_prefix")
+            options_c = ["请选择", "手动输入"] + city_options(country_c_sel, prefix_c)
             city_c_sel = st.selectbox("城市_候选", options_c, index=0, key="city_c_sel_generic")
             if city_c_sel == "手动输入":
                 city_c_sel = st.text_input("城市_候选_手动", key="city_c_manual")
@@ -469,6 +476,66 @@ with st.container():
     except Exception:
         st.empty()
 
+# 解析 SSE 事件流：逐个产出 (event, data)
+def iter_sse(resp):
+    event, data_lines = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].lstrip())
+
+
+STAGE_LABELS = {"identify": "甄选目的地", "gather": "收集城市指南", "plan": "生成完整行程"}
+
+
+# 流式规划：实时展示阶段进度、工具调用与正在生成的行程文本，返回最终结构化结果
+def stream_plan(api_base: str, payload: dict) -> dict:
+    status = st.status("规划进行中…", expanded=True)
+    md_box = st.empty()
+    md_text = ""
+    last_render = 0.0
+    with requests.get(f"{api_base}/api/v1/plan/stream", params=payload, stream=True, timeout=(10, 300)) as resp:
+        resp.raise_for_status()
+        resp.encoding = "utf-8"
+        for event, data in iter_sse(resp):
+            stage = STAGE_LABELS.get(data.get("stage", ""), data.get("stage", ""))
+            if event == "task_started":
+                status.update(label=f"正在{stage}…")
+                status.write(f"▶ 开始：{stage}")
+            elif event == "task_finished":
+                status.write(f"✔ 完成：{stage}")
+            elif event == "tool_started":
+                status.write(f"🔧 {stage} 调用工具：{data.get('tool', '')}")
+            elif event == "token":
+                md_text += data.get("delta", "")
+                # 节流重绘，避免每个 token 都刷新页面
+                now = dt.datetime.now().timestamp()
+                if now - last_render > 0.3:
+                    md_box.markdown(md_text)
+                    last_render = now
+            elif event == "day":
+                status.write(f"📅 {data.get('date', '')} 行程已生成")
+            elif event == "cached":
+                status.write("⚡ 命中缓存，直接返回历史结果")
+            elif event == "result":
+                md_box.empty()
+                status.update(label="规划完成", state="complete", expanded=False)
+                return data
+            elif event == "error":
+                status.update(label="规划失败", state="error")
+                raise RuntimeError(data.get("detail", "规划失败"))
+    raise RuntimeError("规划连接中断，请稍后重试")
+
+
 if 'submitted_generate' in locals() and submitted_generate:
     # 从会话状态读取最终值
     origin = st.session_state.get("origin_input", "")
@@ -481,9 +548,7 @@ if 'submitted_generate' in locals() and submitted_generate:
         with st.spinner("旅游行程正在规划中，请稍候..."):
             try:
                 payload = {"origin": origin, "cities": cities, "date_range": date_range, "interests": interests}
-                resp = requests.post(f"{api_base}/api/v1/plan", json=payload, timeout=300)
-                resp.raise_for_status()
-                data = resp.json()
+                data = stream_plan(api_base, payload)
                 st.success("行程已生成！")
                 st.markdown("### 结果（结构化）")
                 st.json(data)
@@ -492,6 +557,9 @@ if 'submitted_generate' in locals() and submitted_generate:
                 st.session_state["plan_data"] = data
                 st.session_state["_last_origin"] = origin
                 st.session_state["_last_cities"] = cities
+                st.session_state["_last_payload"] = payload
+                st.session_state["_saved_ref"] = None
+                st.session_state["_anon_ics"] = ""
 
                 # 若已登录则自动保存一个版本，便于后续收藏/版本管理
                 if st.session_state.get("auth_token"):
@@ -512,57 +580,136 @@ if 'submitted_generate' in locals() and submitted_generate:
                             timeout=30,
                         )
                         rsave.raise_for_status()
+                        st.session_state["_saved_ref"] = (rsave.json()["plan_id"], rsave.json()["version"])
                         st.toast("已自动保存当前行程为新版本")
                     except Exception:
                         st.info("已生成行程，登录后可手动保存为版本")
 
-                # JSON 导出
-                json_bytes = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
-                b64_json = base64.b64encode(json_bytes).decode()
-                st.markdown(f'<a href="data:application/json;base64,{b64_json}" download="trip_plan.json">📥 下载 JSON</a>', unsafe_allow_html=True)
-
-                # ICS 导出
-                resp_ics = requests.post(f"{api_base}/api/v1/plan/ics", json=payload, timeout=300)
-                resp_ics.raise_for_status()
-                ics_data = resp_ics.json().get("ics", "")
-                ics_b64 = base64.b64encode(ics_data.encode("utf-8")).decode()
-                st.markdown(f'<a href="data:text/calendar;base64,{ics_b64}" download="trip_plan.ics">📅 下载 ICS</a>', unsafe_allow_html=True)
             except Exception as e:
                 st.error(f"运行失败：{type(e).__name__}: {e}")
 
 
 
+# ===== 导出 =====
+EXPORT_FORMATS = {"pdf": ("PDF", "application/pdf"), "html": ("HTML", "text/html"), "ics": ("ICS 日历", "text/calendar"), "md": ("Markdown", "text/markdown")}
+
+
+# 从后端获取已保存版本的导出文件：渲染在后端后台进行，未完成时按 Retry-After 轮询；
+# 已下载过的文件带 If-None-Match 请求，未变化（304）时直接复用本地副本
+def fetch_export(api_base: str, ref: tuple, fmt: str, timeout: float = 120.0) -> bytes:
+    cache: dict = st.session_state.setdefault("_exports", {})
+    key = f"{ref[0]}:{ref[1]}:{fmt}"
+    headers = {"Authorization": f"Bearer {st.session_state['auth_token']}"}
+    if key in cache:
+        headers["If-None-Match"] = cache[key][0]
+    deadline = time.monotonic() + timeout
+    while True:
+        r = requests.get(f"{api_base}/api/v1/plans/{ref[0]}/versions/{ref[1]}/export/{fmt}", headers=headers, timeout=30)
+        if r.status_code == 304:
+            return cache[key][1]
+        if r.status_code == 202 and time.monotonic() < deadline:
+            time.sleep(float(r.headers.get("Retry-After", "2")))
+            continue
+        r.raise_for_status()
+        if r.status_code == 202:
+            raise TimeoutError("导出仍在生成中，请稍后重试")
+        cache[key] = (r.headers.get("ETag", ""), r.content)
+        return r.content
+
+
+plan = st.session_state.get("plan_data")
+if plan:
+    st.markdown("### 导出")
+    api_base = API_BASE_URL
+    st.download_button(
+        "📥 下载 JSON",
+        json.dumps(plan, ensure_ascii=False, indent=2).encode("utf-8"),
+        file_name="trip_plan.json",
+        mime="application/json",
+    )
+    ref = st.session_state.get("_saved_ref")
+    if ref and st.session_state.get("auth_token"):
+        # 已保存的版本：由后端渲染并缓存（PDF 渲染较慢，同一版本只渲染一次）
+        cole1, cole2 = st.columns([2, 4])
+        with cole1:
+            fmt = st.selectbox("导出格式", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0])
+        with cole2:
+            if st.button("生成导出文件"):
+                try:
+                    with st.spinner("正在生成导出文件…"):
+                        fetch_export(api_base, ref, fmt)
+                except Exception as e:
+                    st.error(f"导出失败：{e}")
+        for key, (_etag, content) in st.session_state.get("_exports", {}).items():
+            pid, ver, f = key.split(":")
+            if (int(pid), int(ver)) != tuple(ref):
+                continue
+            label, mime = EXPORT_FORMATS[f]
+            st.download_button(f"📄 下载 {label}（v{ver}）", content, file_name=f"trip_plan_v{ver}.{f}", mime=mime, key=f"_dl_{key}")
+    elif st.session_state.get("_last_payload"):
+        # 未保存（未登录）：按本次规划请求生成 ICS
+        if st.button("生成 ICS 日历"):
+            try:
+                resp_ics = requests.post(f"{api_base}/api/v1/plan/ics", json=st.session_state["_last_payload"], timeout=30)
+                resp_ics.raise_for_status()
+                st.session_state["_anon_ics"] = resp_ics.json().get("ics", "")
+            except Exception as e:
+                st.error(f"导出失败：{e}")
+        if st.session_state.get("_anon_ics"):
+            st.download_button("📅 下载 ICS", st.session_state["_anon_ics"].encode("utf-8"), file_name="trip_plan.ics", mime="text/calendar")
+
+
 # ===== 地图与路线可视化 =====
-def geocode_addresses(names: list[str], city_hint: str = "") -> list[dict[str, Any]]:
-    results: list[dict[str, Any]] = []
-    if Nominatim is None:
-        return results
-    geolocator = Nominatim(user_agent="trip_planner_app")
-    geocode_func = getattr(geolocator, "geocode", None)
-    if not callable(geocode_func):
-        return results
-    # RateLimiter 可能不存在；做兼容处理
-    if RateLimiter:
-        geocode = RateLimiter(geocode_func, min_delay_seconds=1.0)
-    else:
-        def geocode(q: str):
-            return geocode_func(q, timeout=10)
-    for name in names:
-        query = name
-        if city_hint:
-            query = f"{city_hint} {name}"
-        try:
-            loc = geocode(query)
-            lat = getattr(loc, "latitude", None) if loc is not None else None
-            lng = getattr(loc, "longitude", None) if loc is not None else None
-            if lat is not None and lng is not None:
-                results.append({"name": name, "lat": float(lat), "lng": float(lng)})
-        except Exception:
+# 地理编码交给后端批量接口（持久缓存 + 离线城市库 + 全局限速的上游队列），不在前端逐个请求；
+# 未在等待时间内解析完成的名称记入 _geocode_pending，稍后再次点击即可命中缓存
+def geocode_addresses(names: list[str], city_hint: str = "", api_base: str = API_BASE_URL) -> list[dict[str, Any]]:
+    r = requests.post(
+        f"{api_base}/api/v1/geocode/batch",
+        json={"names": names, "hint": city_hint},
+        timeout=15,
+    )
+    r.raise_for_status()
+    body = r.json()
+    st.session_state["_geocode_pending"] = body.get("pending", 0)
+    return [
+        {"name": item["label"] or item["name"], "lat": item["lat"], "lng": item["lng"]}
+        for item in body.get("items", [])
+        if item.get("status") == "ok"
+    ]
+
+
+def _valid_points(stops: list[dict]) -> list[dict]:
+    return [
+        {"lat": float(s["lat"]), "lng": float(s["lng"])}
+        for s in stops if s.get("lat") is not None and s.get("lng") is not None
+    ]
+
+
+# 一次请求计算所有日期的路线（/route/batch），结果按「站点+出行方式+是否优化」签名缓存在会话中
+def fetch_routes(stops_by_day: dict, mode_per_day: dict, optimize: bool, api_base: str) -> dict:
+    routes: dict = st.session_state["map_state"].setdefault("routes", {})
+    days = []
+    for day_key, stops in stops_by_day.items():
+        pts = _valid_points(stops)
+        if len(pts) < 2:
             continue
-    return results
+        mode = mode_per_day.get(day_key, "walking")
+        sig = json.dumps([pts, mode, optimize])
+        if routes.get(day_key, {}).get("_sig") != sig:
+            days.append({"date": day_key, "points": pts, "mode": mode, "optimize": optimize, "_sig": sig})
+    if days:
+        r = requests.post(
+            f"{api_base}/api/v1/route/batch",
+            json={"days": [{k: v for k, v in d.items() if k != "_sig"} for d in days]},
+            timeout=60,
+        )
+        r.raise_for_status()
+        for d, route in zip(days, r.json()["routes"]):
+            routes[d["date"]] = {**route, "_sig": d["_sig"]}
+    return routes
 
 
-def render_map_and_route(day_key: str, stops: list[dict], mode: str, api_base: str):
+def render_map_and_route(day_key: str, stops: list[dict], mode: str, route: dict | None):
     if not st_folium or not folium:
         st.info("地图组件未安装，已跳过可视化。")
         return None
@@ -570,27 +717,23 @@ def render_map_and_route(day_key: str, stops: list[dict], mode: str, api_base: s
         st.warning("请先设置至少两个站点。")
         return None
 
-    pts = [{"lat": float(s["lat"]), "lng": float(s["lng"])} for s in stops if "lat" in s and "lng" in s]
+    pts = _valid_points(stops)
     if len(pts) < 2:
         st.warning("至少需要两个有效坐标以计算路线。")
         return None
-
-    # 路线计算
-    try:
-        r = requests.post(f"{api_base}/api/v1/route", json={"points": pts, "mode": mode}, timeout=20)
-        r.raise_for_status()
-        route = r.json()
-    except Exception as e:
-        st.error(f"路线计算失败：{e}")
+    if not route:
+        st.info("路线尚未计算。")
         return None
 
-    # 地图
+    # 地图：站点编号按路线访问顺序
+    valid_stops = [s for s in stops if s.get("lat") is not None and s.get("lng") is not None]
+    order = route.get("order") or list(range(len(valid_stops)))
     avg_lat = sum(p["lat"] for p in pts) / len(pts)
     avg_lng = sum(p["lng"] for p in pts) / len(pts)
     fmap = folium.Map(location=[avg_lat, avg_lng], zoom_start=13, control_scale=True)
-    for i, s in enumerate(stops):
-        if "lat" in s and "lng" in s:
-            folium.Marker([s["lat"], s["lng"]], tooltip=f"{i+1}. {s.get('name','')}" ).add_to(fmap)
+    for rank, i in enumerate(order):
+        s = valid_stops[i]
+        folium.Marker([s["lat"], s["lng"]], tooltip=f"{rank+1}. {s.get('name','')}" ).add_to(fmap)
     # 折线
     line = [(p["lat"], p["lng"]) for p in route.get("path", [])]
     if line:
@@ -598,6 +741,19 @@ def render_map_and_route(day_key: str, stops: list[dict], mode: str, api_base: s
         folium.PolyLine(line, color=color, weight=5, opacity=0.8).add_to(fmap)
     out = st_folium(fmap, width=900, height=500)
     st.caption(f"估算：{route.get('distance_km', 0):.1f} km / {route.get('duration_min', 0):.0f} 分钟")
+    legs = route.get("legs") or []
+    if legs:
+        st.dataframe(
+            [
+                {
+                    "路段": f"{valid_stops[leg['start']].get('name', '')} → {valid_stops[leg['end']].get('name', '')}",
+                    "里程(km)": leg["distance_km"],
+                    "时长(分钟)": leg["duration_min"],
+                }
+                for leg in legs
+            ],
+            use_container_width=True,
+        )
     return out
 
 
@@ -621,12 +777,18 @@ if plan:
             st.write("将按行作为站点尝试解析（可手动清理后编辑）")
             if st.button("开始地理编码"):
                 city_hint = st.session_state.get("_last_cities", "").split(",")[0] if st.session_state.get("_last_cities") else ""
-                new_pts = geocode_addresses(raw_items[:10], city_hint=city_hint)
+                try:
+                    new_pts = geocode_addresses(raw_items[:30], city_hint=city_hint, api_base=api_base)
+                except Exception as e:
+                    st.error(f"地理编码失败：{e}")
+                    new_pts = []
                 if new_pts:
                     cur_stops = new_pts
                     stops_by_day[day_key] = cur_stops
-                else:
+                elif not st.session_state.get("_geocode_pending"):
                     st.warning("未解析到坐标，请手动添加。")
+                if st.session_state.get("_geocode_pending"):
+                    st.info(f"还有 {st.session_state['_geocode_pending']} 个地点正在后台解析，稍后再次点击「开始地理编码」即可补全。")
 
         st.markdown("**站点编辑（可增删/修改，序号即路线顺序）**")
         edited = st.data_editor(
@@ -648,6 +810,9 @@ if plan:
             mode = st.selectbox("出行模式", ["walking", "transit", "driving"], index=["walking","transit","driving"].index(mode))
             st.session_state["map_state"]["mode_per_day"][day_key] = mode
         with colm2:
+            st.session_state["map_state"]["optimize"] = st.checkbox(
+                "优化站点顺序（起点不变）", value=st.session_state["map_state"].get("optimize", False)
+            )
             if st.button("计算并绘制路线"):
                 st.session_state[f"_route_trigger_{day_key}"] = True
         with colm3:
@@ -655,22 +820,33 @@ if plan:
             title = st.text_input("保存标题", value=title_default, key=f"_save_title_{day_key}")
             if st.session_state.get("auth_token") and st.button("保存当前版本"):
                 try:
-                    # 将地图编辑数据合并回 plan
-                    plan_copy = dict(plan)
-                    plan_copy.setdefault("map", {})
-                    plan_copy["map"].setdefault(day_key, {})
-                    plan_copy["map"][day_key]["stops"] = stops_by_day.get(day_key, [])
-                    plan_copy["map"][day_key]["mode"] = st.session_state["map_state"]["mode_per_day"].get(day_key, "walking")
+                    # 所有日期的地图编辑（站点与出行方式）随计划正文一次提交，后端合并为一个版本
+                    mode_per_day = st.session_state["map_state"].get("mode_per_day", {})
+                    map_days = [
+                        {"date": k, "stops": v, "mode": mode_per_day.get(k, "walking")}
+                        for k, v in stops_by_day.items()
+                    ]
                     r = requests.post(
-                        f"{api_base}/api/v1/plans/save",
+                        f"{api_base}/api/v1/plans/save/bulk",
                         headers={"Authorization": f"Bearer {st.session_state['auth_token']}"},
-                        json={"title": title, "data": plan_copy},
+                        json={"title": title, "data": plan, "map": map_days},
                         timeout=60,
                     )
                     r.raise_for_status()
+                    st.session_state["_saved_ref"] = (r.json()["plan_id"], r.json()["version"])
                     st.success("已保存新版本")
                 except Exception as e:
                     st.error(f"保存失败：{e}")
 
         if st.session_state.get(f"_route_trigger_{day_key}"):
-            render_map_and_route(day_key, stops_by_day.get(day_key, []), st.session_state["map_state"]["mode_per_day"].get(day_key, "walking"), api_base)
+            try:
+                routes = fetch_routes(
+                    stops_by_day,
+                    st.session_state["map_state"]["mode_per_day"],
+                    st.session_state["map_state"].get("optimize", False),
+                    api_base,
+                )
+            except Exception as e:
+                st.error(f"路线计算失败：{e}")
+                routes = {}
+            render_map_and_route(day_key, stops_by_day.get(day_key, []), st.session_state["map_state"]["mode_per_day"].get(day_key, "walking"), routes.get(day_key))
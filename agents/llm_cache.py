@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from crewai import LLM
+
+from agents import progress
+from api.cache import TieredCache, make_key
+from api.config import LLM_CACHE_MODE, LLM_CACHE_TTL, LLM_CASSETTE_DIR
+from api.metrics import LLM_CALLS, LLM_SECONDS, LLM_TOKENS
+
+# 影响生成结果的参数，参与缓存键计算
+_KEY_PARAMS = ("temperature", "top_p", "max_tokens", "stop", "seed", "response_format")
+
+completion_cache = TieredCache("llm_completions", ttl=LLM_CACHE_TTL, max_entries=512)
+
+# 当前线程正在进行的 LLM 调用所属角色（token 用量回调发生在同一线程内）
+_local = threading.local()
+
+
+# 调用方 agent 的角色；无 agent（例如城市汇总的直接调用）时退化为当前规划阶段
+def _caller_role(kwargs: Dict[str, Any]) -> str:
+  agent = kwargs.get("from_agent")
+  role = getattr(agent, "role", None)
+  if role:
+    return str(role)
+  sink = progress.current_sink()
+  return f"stage:{sink.stage}" if sink is not None and sink.stage else "none"
+
+
+# 回放模式下找不到录制结果
+class ReplayMissError(RuntimeError):
+  pass
+
+
+# 录制文件：每条补全一个 JSON 文件，文件名为缓存键，便于在 CI 中直接提交/比对
+class Cassette:
+
+  def __init__(self, directory: str = LLM_CASSETTE_DIR):
+    self.directory = directory
+
+  def _path(self, key: str) -> str:
+    return os.path.join(self.directory, f"{key}.json")
+
+  def load(self, key: str) -> Optional[str]:
+    try:
+      with open(self._path(key), encoding="utf-8") as f:
+        return json.load(f)["response"]
+    except (OSError, ValueError, KeyError):
+      return None
+
+  def save(self, key: str, request: Dict[str, Any], response: str) -> None:
+    os.makedirs(self.directory, exist_ok=True)
+    tmp = self._path(key) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+      json.dump({"request": request, "response": response}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, self._path(key))
+
+
+# 带补全缓存与录制/回放的 LLM：键为 模型 + 生成参数 + 消息（及工具）内容的哈希
+class CachedLLM(LLM):
+
+  def __init__(self, *args, cache_mode: str = LLM_CACHE_MODE, cassette_dir: str = LLM_CASSETTE_DIR, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.cache_mode = cache_mode
+    self.cassette = Cassette(cassette_dir)
+
+  def _request(self, messages: Any, tools: Any) -> Dict[str, Any]:
+    if isinstance(messages, str):
+      messages = [{"role": "user", "content": messages}]
+    params = {name: getattr(self, name, None) for name in _KEY_PARAMS}
+    return {"model": self.model, "params": params, "messages": messages, "tools": tools}
+
+  # crewai 在拿到响应用量后回调该方法；按当前调用的角色累计 token 指标
+  def _track_token_usage_internal(self, usage_data, *args, **kwargs):
+    parent = getattr(super(), "_track_token_usage_internal", None)
+    if parent is not None:
+      parent(usage_data, *args, **kwargs)
+    role = getattr(_local, "role", None) or "none"
+    for kind in ("prompt_tokens", "completion_tokens"):
+      value = usage_data.get(kind) if isinstance(usage_data, dict) else getattr(usage_data, kind, None)
+      if value:
+        LLM_TOKENS.labels(role, self.model, kind.split("_")[0]).inc(value)
+
+  # 实际请求上游并记录调用次数与耗时
+  def _upstream_call(self, role, messages, tools, *args, **kwargs):
+    prev = getattr(_local, "role", None)
+    _local.role = role
+    start = time.perf_counter()
+    try:
+      return super().call(messages, tools, *args, **kwargs)
+    finally:
+      _local.role = prev
+      LLM_SECONDS.labels(role, self.model).observe(time.perf_counter() - start)
+      LLM_CALLS.labels(role, self.model, "upstream").inc()
+
+  def call(self, messages, tools=None, *args, **kwargs):
+    mode = self.cache_mode
+    role = _caller_role(kwargs)
+    if mode == "off":
+      return self._upstream_call(role, messages, tools, *args, **kwargs)
+
+    request = self._request(messages, tools)
+    key = make_key("llm", request)
+    if mode in ("cache", "replay"):
+      hit = completion_cache.get(key) if mode == "cache" else self.cassette.load(key)
+      if hit is not None:
+        LLM_CALLS.labels(role, self.model, "cache").inc()
+        # 命中时不会产生流式 chunk，整段作为一次 token 增量推送，保持前端流式体验一致
+        if getattr(self, "stream", False):
+          progress.emit("token", delta=hit)
+        return hit
+      if mode == "replay":
+        raise ReplayMissError(f"回放模式下缺少录制结果: {key}（请先以 LLM_CACHE_MODE=record 运行）")
+
+    result = self._upstream_call(role, messages, tools, *args, **kwargs)
+    # 只缓存纯文本补全；函数调用等结构化结果直接返回
+    if isinstance(result, str) and result:
+      if mode == "record":
+        self.cassette.save(key, request, result)
+      else:
+        completion_cache.set(key, result)
+    return result
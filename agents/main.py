@@ -1,11 +1,22 @@
 from crewai import Crew
 from textwrap import dedent
-from agents.trip_agents import TripAgents
+import concurrent.futures
+import re
+from agents.trip_agents import llm
+from agents.pool import agent_pool
 from agents.trip_tasks import TripTasks
+from agents import progress
+from tools.search_tools import SearchSession
+from api.config import CITY_FANOUT_ENABLED, CITY_FANOUT_MAX_WORKERS
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# 任务产出的原始文本（未运行或失败时为空串）
+def _task_text(task):
+  output = getattr(task, "output", None)
+  return str(getattr(output, "raw", "") or "") if output is not None else ""
+
 # 旅游规划助手的启动
 class TripCrew:
 
@@ -15,54 +26,162 @@ class TripCrew:
     self.origin = origin
     self.interests = interests
     self.date_range = date_range
+    # 各阶段产出（identify/gather/plan 的文本），运行后读取，随计划版本保存以支持增量再规划
+    self.stage_outputs = {}
+
+  # 拆分候选城市（兼容中英文逗号、顿号、分号），去重保序
+  def candidate_cities(self):
+    seen = []
+    for c in re.split(r"[,，、;；]+", self.cities or ""):
+      c = c.strip()
+      if c and c not in seen:
+        seen.append(c)
+    return seen
+
+  # 实例化agents与任务；progress_sink 为可选的进度接收端（任务/工具/token 事件）
+  # agent 与工具从模板池借出（见 agents/pool.py），每次请求只绑定自己的搜索会话与任务输入
+  def run(self, progress_sink=None):
+    search_session = SearchSession()
+    tasks = TripTasks()
+    candidates = self.candidate_cities()
+
+    # 多个候选城市时并行逐城评估，再由一次轻量汇总选出目的地
+    if CITY_FANOUT_ENABLED and len(candidates) > 1:
+      selection = self.select_city(candidates, progress_sink, search_session)
+      self.stage_outputs = {"identify": selection}
+      return self._run_guide_and_plan(tasks, progress_sink, search_session, selection=selection)
+
+    # 借出三个agent
+    roles = ("city_selection", "local_expert", "travel_concierge")
+    with agent_pool.lease(search_session, *roles) as (city_selector_agent, local_expert_agent, travel_concierge_agent):
+
+      # 对目的城市进行评估后的任务，规划出目的城市的信息（天气，机票，酒店，景点）
+      identify_task = tasks.identify_task(
+        city_selector_agent,
+        self.origin,
+        self.cities,
+        self.interests,
+        self.date_range
+      )
+
+      # 对目标城市的更详细的规划任务，主要包含当地城市的一些风俗文化，打卡地标和其中的必要开销
+      gather_task = tasks.gather_task(
+        local_expert_agent,
+        self.origin,
+        self.interests,
+        self.date_range
+      )
 
-  # 实例化agents与任务
-  def run(self):
-    agents = TripAgents()
+      # 将上述的规划详细整理，制定出完整的行程规划，包含整个旅程的全流程，最终提供格式化输出（markdown）
+      plan_task = tasks.plan_task(
+        travel_concierge_agent, 
+        self.origin,
+        self.interests,
+        self.date_range
+      )
+
+      # 实例化crew，并执行任务
+      crew = Crew(
+        agents=[
+          city_selector_agent, local_expert_agent, travel_concierge_agent
+        ],
+        tasks=[identify_task, gather_task, plan_task],
+        verbose=True
+      )
+
+      stages = {"identify": identify_task, "gather": gather_task, "plan": plan_task}
+      with progress.bind(progress_sink, stages):
+        result = crew.kickoff()
+    self.stage_outputs = {stage: _task_text(task) for stage, task in stages.items()}
+    return result
+
+  # 增量再规划：复用上一版本保存的阶段产出（stages），只重跑必要的阶段
+  #   mode="guide"：目的地不变、兴趣变化，以已有的目的地报告为基础重跑城市指南与行程规划
+  #   mode="plan"：只重跑行程规划；mode="days"：只重写 days 中的日期，其余日期由调用方保留
+  def replan(self, stages, feedback, mode="plan", days=None, progress_sink=None):
+    search_session = SearchSession()
     tasks = TripTasks()
+    self.stage_outputs = dict(stages)
+    if mode == "guide":
+      return self._run_guide_and_plan(tasks, progress_sink, search_session, selection=stages.get("identify"), feedback=feedback)
 
-    # 实例化三个agent
-    city_selector_agent = agents.city_selection_agent()
-    local_expert_agent = agents.local_expert()
-    travel_concierge_agent = agents.travel_concierge()
-
-    # 对目的城市进行评估后的任务，规划出目的城市的信息（天气，机票，酒店，景点）
-    identify_task = tasks.identify_task(
-      city_selector_agent,
-      self.origin,
-      self.cities,
-      self.interests,
-      self.date_range
-    )
-
-    # 对目标城市的更详细的规划任务，主要包含当地城市的一些风俗文化，打卡地标和其中的必要开销
-    gather_task = tasks.gather_task(
-      local_expert_agent,
-      self.origin,
-      self.interests,
-      self.date_range
-    )
-
-    # 将上述的规划详细整理，制定出完整的行程规划，包含整个旅程的全流程，最终提供格式化输出（markdown）
-    plan_task = tasks.plan_task(
-      travel_concierge_agent, 
-      self.origin,
-      self.interests,
-      self.date_range
-    )
-
-    # 实例化crew，并执行任务
-    crew = Crew(
-      agents=[
-        city_selector_agent, local_expert_agent, travel_concierge_agent
-      ],
-      tasks=[identify_task, gather_task, plan_task],
-      verbose=True
-    )
-
-    result = crew.kickoff()
+    guide = "\n\n".join(text for text in (stages.get("identify"), stages.get("gather")) if text)
+    with agent_pool.lease(search_session, "travel_concierge") as travel_concierge_agent:
+      replan_task = tasks.replan_task(
+        travel_concierge_agent,
+        self.origin,
+        self.interests,
+        self.date_range,
+        guide,
+        stages.get("plan", ""),
+        feedback,
+        days=days if mode == "days" else None,
+      )
+      crew = Crew(agents=[travel_concierge_agent], tasks=[replan_task], verbose=True)
+      with progress.bind(progress_sink, {"plan": replan_task}):
+        result = crew.kickoff()
+    self.stage_outputs["plan"] = _task_text(replan_task) or str(result)
     return result
 
+  # 在已完成目的地选择的前提下，运行城市指南与行程规划两个阶段
+  def _run_guide_and_plan(self, tasks, progress_sink, search_session, selection, feedback=None):
+    with agent_pool.lease(search_session, "local_expert", "travel_concierge") as (local_expert_agent, travel_concierge_agent):
+      gather_task = tasks.gather_task(
+        local_expert_agent,
+        self.origin,
+        self.interests,
+        self.date_range,
+        selection=selection,
+      )
+      plan_task = tasks.plan_task(
+        travel_concierge_agent,
+        self.origin,
+        self.interests,
+        self.date_range,
+        feedback=feedback,
+      )
+      crew = Crew(
+        agents=[local_expert_agent, travel_concierge_agent],
+        tasks=[gather_task, plan_task],
+        verbose=True
+      )
+      with progress.bind(progress_sink, {"gather": gather_task, "plan": plan_task}):
+        result = crew.kickoff()
+    self.stage_outputs.update(gather=_task_text(gather_task), plan=_task_text(plan_task))
+    return result
+
+  # 单个候选城市的调研：借出独立的 agent 并新建 crew，互不共享状态，可安全并发
+  def _research_city(self, city, progress_sink, search_session):
+    with agent_pool.lease(search_session, "city_selection") as agent:
+      task = TripTasks().city_research_task(agent, self.origin, city, self.interests, self.date_range)
+      crew = Crew(agents=[agent], tasks=[task], verbose=False)
+      with progress.bind(progress_sink, {"identify": task}):
+        return str(crew.kickoff())
+
+  # 目的地甄选（并行模式）：按城市并发调研，并发数受 CITY_FANOUT_MAX_WORKERS 限制；
+  # 汇总阶段只做一次无工具的 LLM 调用，输出最终选择与精简对比表
+  # 每个城市的调研 crew 拥有独立的搜索预算，但与整次规划共享限速与去重
+  def select_city(self, candidates, progress_sink=None, search_session=None):
+    search_session = search_session or SearchSession()
+    reports = {}
+    workers = max(1, min(CITY_FANOUT_MAX_WORKERS, len(candidates)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="city-research") as pool:
+      futures = {pool.submit(self._research_city, city, progress_sink, search_session.child()): city for city in candidates}
+      for future in concurrent.futures.as_completed(futures):
+        city = futures[future]
+        try:
+          reports[city] = future.result()[:1500]
+        except Exception as e:
+          reports[city] = f"（调研失败：{type(e).__name__}）"
+    if not any(not r.startswith("（调研失败") for r in reports.values()):
+      raise RuntimeError("所有候选城市调研均失败")
+    ordered = {city: reports[city] for city in candidates}
+    prompt = TripTasks().city_selection_prompt(self.origin, self.interests, self.date_range, ordered)
+    selection = str(llm.call([{"role": "user", "content": prompt}]))
+    if progress_sink is not None:
+      progress_sink.emit("city_selected", stage="identify", cities=candidates, summary=selection[:200])
+    return selection
+
 if __name__ == "__main__":
   print("## 欢迎使用旅游规划助手")
   print('-------------------------------')
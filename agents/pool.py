@@ -0,0 +1,133 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from agents.trip_agents import TripAgents
+from api.config import AGENT_POOL_MAX_IDLE, AGENT_POOL_MAX_USES
+from tools.search_tools import SerperSearchTool
+
+# 角色名 -> TripAgents 上的构建方法
+ROLES = {
+  "city_selection": "city_selection_agent",
+  "local_expert": "local_expert",
+  "travel_concierge": "travel_concierge",
+}
+
+
+class _Entry:
+
+  def __init__(self, role: str, agent: Any):
+    self.role = role
+    self.agent = agent
+    self.uses = 0
+
+
+# agent/工具模板池：Agent、工具与 LLM 客户端只构建一次，按角色放入空闲列表；
+# 每次请求独占借出，仅绑定本次请求的搜索会话，归还时解绑。
+# crewai 的 Agent 在执行期间持有 crew/executor 等可变状态，因此同一实例不会被并发借出；
+# 运行出错或复用次数达到上限的实例直接丢弃，下次按需重建
+class AgentPool:
+
+  def __init__(self, max_idle: int = AGENT_POOL_MAX_IDLE, max_uses: int = AGENT_POOL_MAX_USES):
+    self.max_idle = max_idle
+    self.max_uses = max_uses
+    self._lock = threading.Lock()
+    self._idle: Dict[str, List[_Entry]] = {role: [] for role in ROLES}
+    self._leased: Dict[int, _Entry] = {}
+    self._stats = {role: {"created": 0, "reused": 0, "discarded": 0, "failed": 0} for role in ROLES}
+
+  def _build(self, role: str) -> _Entry:
+    agent = getattr(TripAgents(), ROLES[role])()
+    with self._lock:
+      self._stats[role]["created"] += 1
+    return _Entry(role, agent)
+
+  @staticmethod
+  def _bind(agent: Any, search_session: Any) -> None:
+    for tool in agent.tools or []:
+      if isinstance(tool, SerperSearchTool):
+        tool.session = search_session
+
+  # 借出一个角色的 agent，并绑定本次请求的搜索会话
+  def acquire(self, role: str, search_session: Any = None) -> Any:
+    if role not in ROLES:
+      raise KeyError(f"未知的 agent 角色: {role}")
+    with self._lock:
+      entry = self._idle[role].pop() if self._idle[role] else None
+      if entry is not None:
+        self._stats[role]["reused"] += 1
+    if entry is None:
+      entry = self._build(role)
+    entry.uses += 1
+    self._bind(entry.agent, search_session)
+    with self._lock:
+      self._leased[id(entry.agent)] = entry
+    return entry.agent
+
+  # 归还 agent；healthy=False（运行出错）或复用次数达到上限时丢弃
+  def release(self, agent: Any, healthy: bool = True) -> None:
+    with self._lock:
+      entry = self._leased.pop(id(agent), None)
+    if entry is None:
+      return
+    self._bind(agent, None)
+    # 清理上一次运行遗留的 crew 关联，避免持有已结束的 crew 及其任务输出
+    try:
+      agent.crew = None
+      agent.agent_executor = None
+    except Exception:
+      healthy = False
+    with self._lock:
+      stats = self._stats[entry.role]
+      if not healthy:
+        stats["failed"] += 1
+      if not healthy or entry.uses >= self.max_uses or len(self._idle[entry.role]) >= self.max_idle:
+        stats["discarded"] += 1
+        return
+      self._idle[entry.role].append(entry)
+
+  # 借出一组角色，离开时统一归还；块内抛出异常视为不健康
+  @contextmanager
+  def lease(self, search_session: Any, *roles: str):
+    agents: List[Any] = []
+    healthy = True
+    try:
+      for role in roles:
+        agents.append(self.acquire(role, search_session))
+      yield agents[0] if len(agents) == 1 else tuple(agents)
+    except BaseException:
+      healthy = False
+      raise
+    finally:
+      for agent in agents:
+        self.release(agent, healthy=healthy)
+
+  # 预先为每种角色构建 n 个空闲实例（启动预热用）
+  def fill(self, n: int = 1) -> None:
+    for role in ROLES:
+      while True:
+        with self._lock:
+          if len(self._idle[role]) >= min(n, self.max_idle):
+            break
+        entry = self._build(role)
+        with self._lock:
+          self._idle[role].append(entry)
+
+  def clear(self) -> None:
+    with self._lock:
+      for idle in self._idle.values():
+        idle.clear()
+
+  def stats(self) -> Dict[str, Any]:
+    with self._lock:
+      leased: Dict[str, int] = {role: 0 for role in ROLES}
+      for entry in self._leased.values():
+        leased[entry.role] += 1
+      roles = {
+        role: {"idle": len(self._idle[role]), "in_use": leased[role], **self._stats[role]}
+        for role in ROLES
+      }
+    return {"max_idle": self.max_idle, "max_uses": self.max_uses, "roles": roles}
+
+
+agent_pool = AgentPool()
@@ -0,0 +1,200 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+# crewai 0.177+ 将事件总线迁移到 crewai.events，旧版本位于 crewai.utilities.events
+try:
+  from crewai.events import (
+    crewai_event_bus,
+    TaskStartedEvent,
+    TaskCompletedEvent,
+    TaskFailedEvent,
+    ToolUsageStartedEvent,
+    ToolUsageFinishedEvent,
+    ToolUsageErrorEvent,
+    LLMCallStartedEvent,
+    LLMStreamChunkEvent,
+  )
+except ImportError:  # pragma: no cover - 兼容旧版 crewai
+  from crewai.utilities.events import (
+    crewai_event_bus,
+    TaskStartedEvent,
+    TaskCompletedEvent,
+    TaskFailedEvent,
+    ToolUsageStartedEvent,
+    ToolUsageFinishedEvent,
+    ToolUsageErrorEvent,
+    LLMCallStartedEvent,
+    LLMStreamChunkEvent,
+  )
+
+from api.metrics import PLAN_STAGE_SECONDS
+
+
+# 单次规划的进度接收端：crew 运行过程中的任务/工具/token 事件都会投递到 emit 回调
+class ProgressSink:
+
+  def __init__(self, emit: Callable[[str, Dict[str, Any]], None]):
+    self._emit = emit
+    self.stage: Optional[str] = None
+
+  def emit(self, event: str, **data: Any) -> None:
+    try:
+      self._emit(event, data)
+    except Exception:
+      # 进度回调失败不能影响规划本身
+      pass
+
+
+_local = threading.local()
+_tasks: Dict[str, tuple] = {}  # task id -> (sink, stage)
+_started: Dict[str, float] = {}  # task id -> 开始时间（阶段耗时指标）
+_tasks_lock = threading.Lock()
+_installed = False
+_install_lock = threading.Lock()
+
+
+# 当前线程绑定的进度接收端
+def current_sink() -> Optional[ProgressSink]:
+  return getattr(_local, "sink", None)
+
+
+# 向当前线程绑定的接收端发送事件（未绑定时忽略）
+def emit(event: str, **data: Any) -> None:
+  sink = current_sink()
+  if sink is not None:
+    sink.emit(event, stage=sink.stage, **data)
+
+
+# 将接收端绑定到当前线程，并登记本次 crew 的任务 -> 阶段名映射；
+# 未传接收端时仍登记阶段，用于阶段耗时指标
+@contextmanager
+def bind(sink: Optional[ProgressSink], stages: Optional[Dict[str, Any]] = None):
+  install_listeners()
+  keys = []
+  with _tasks_lock:
+    for stage, task in (stages or {}).items():
+      key = str(getattr(task, "id", id(task)))
+      _tasks[key] = (sink, stage)
+      keys.append(key)
+  prev = current_sink()
+  if sink is not None:
+    _local.sink = sink
+  try:
+    yield
+  finally:
+    _local.sink = prev
+    with _tasks_lock:
+      for key in keys:
+        _tasks.pop(key, None)
+        _started.pop(key, None)
+
+
+def _task_key(event: Any) -> Optional[str]:
+  task = getattr(event, "task", None) or getattr(event, "from_task", None)
+  if task is not None and getattr(task, "id", None) is not None:
+    return str(task.id)
+  task_id = getattr(event, "task_id", None)
+  return str(task_id) if task_id else None
+
+
+# 定位事件所属的接收端：优先按任务 id 匹配，其次按发出事件的线程
+def _resolve(event: Any) -> tuple:
+  key = _task_key(event)
+  if key is not None:
+    with _tasks_lock:
+      hit = _tasks.get(key)
+    if hit is not None:
+      return hit
+  sink = current_sink()
+  return (sink, sink.stage if sink is not None else None)
+
+
+# 记录阶段耗时：任务开始时打点，完成/失败时按阶段写入直方图
+def _stage_started(event: Any) -> None:
+  key = _task_key(event)
+  if key is not None:
+    with _tasks_lock:
+      if key in _tasks:
+        _started[key] = time.perf_counter()
+
+
+def _stage_finished(event: Any, stage: Optional[str], outcome: str) -> None:
+  key = _task_key(event)
+  with _tasks_lock:
+    start = _started.pop(key, None) if key is not None else None
+  if start is not None and stage:
+    PLAN_STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - start)
+
+
+def _on_task_started(_source: Any, event: Any) -> None:
+  _stage_started(event)
+  sink, stage = _resolve(event)
+  if sink is not None:
+    sink.stage = stage
+    sink.emit("task_started", stage=stage)
+
+
+def _on_task_completed(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  _stage_finished(event, stage, "completed")
+  if sink is not None:
+    output = getattr(event, "output", None)
+    raw = getattr(output, "raw", None) if output is not None else None
+    sink.emit("task_finished", stage=stage, chars=len(raw or ""))
+
+
+def _on_task_failed(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  _stage_finished(event, stage, "failed")
+  if sink is not None:
+    sink.emit("task_failed", stage=stage, error=str(getattr(event, "error", "")))
+
+
+def _on_tool_started(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  if sink is not None:
+    sink.emit("tool_started", stage=stage, tool=getattr(event, "tool_name", ""), args=str(getattr(event, "tool_args", ""))[:500])
+
+
+def _on_tool_finished(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  if sink is not None:
+    sink.emit("tool_finished", stage=stage, tool=getattr(event, "tool_name", ""), from_cache=bool(getattr(event, "from_cache", False)))
+
+
+def _on_tool_error(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  if sink is not None:
+    sink.emit("tool_error", stage=stage, tool=getattr(event, "tool_name", ""), error=str(getattr(event, "error", "")))
+
+
+def _on_llm_started(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  if sink is not None:
+    sink.emit("llm_started", stage=stage)
+
+
+def _on_llm_chunk(_source: Any, event: Any) -> None:
+  sink, stage = _resolve(event)
+  chunk = getattr(event, "chunk", None)
+  if sink is not None and chunk:
+    sink.emit("token", stage=stage, delta=chunk)
+
+
+# 向 crewai 事件总线注册一次全局监听器（进程内只注册一次）
+def install_listeners() -> None:
+  global _installed
+  with _install_lock:
+    if _installed:
+      return
+    crewai_event_bus.on(TaskStartedEvent)(_on_task_started)
+    crewai_event_bus.on(TaskCompletedEvent)(_on_task_completed)
+    crewai_event_bus.on(TaskFailedEvent)(_on_task_failed)
+    crewai_event_bus.on(ToolUsageStartedEvent)(_on_tool_started)
+    crewai_event_bus.on(ToolUsageFinishedEvent)(_on_tool_finished)
+    crewai_event_bus.on(ToolUsageErrorEvent)(_on_tool_error)
+    crewai_event_bus.on(LLMCallStartedEvent)(_on_llm_started)
+    crewai_event_bus.on(LLMStreamChunkEvent)(_on_llm_chunk)
+    _installed = True
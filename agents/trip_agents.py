@@ -1,28 +1,41 @@
 import os
-from crewai import Agent, LLM
+from crewai import Agent
+from agents.llm_cache import CachedLLM
 from tools.search_tools import SearchTools
 from tools.browser_tools import BrowserTools
 from tools.calculator_tools import CalculatorTool
 from crewai.tools import BaseTool
 from api.config import (
+  LLM_API_BASE,
+  LLM_API_KEY_ENV,
+  LLM_MODEL,
   ENABLE_SEARCH_CITY_SELECTION,
   ENABLE_SEARCH_LOCAL_EXPERT,
   ENABLE_SEARCH_CONCIERGE,
 )
 
-# llm模型启动，请自行更换
-llm = LLM(
-    model="openai/qwen-plus",
-    api_key=os.getenv("ALI_APIKEY"),
-    api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    temperature=0.3,
-    max_tokens=1500,           # 限制单次生成长度，避免过长输出导致超时
-    request_timeout=120        # 单次请求超时时间（秒）
-)
+# llm模型启动，请自行更换；补全缓存与录制/回放由 LLM_CACHE_MODE 控制（见 api/config.py）
+def build_llm(stream: bool = False):
+  return CachedLLM(
+      model=LLM_MODEL,
+      api_key=os.getenv(LLM_API_KEY_ENV),
+      api_base=LLM_API_BASE,
+      temperature=0.3,
+      max_tokens=1500,           # 限制单次生成长度，避免过长输出导致超时
+      request_timeout=120,       # 单次请求超时时间（秒）
+      stream=stream,
+  )
+
+llm = build_llm()
+# 最终行程由 travel_concierge 输出，使用流式调用以便逐 token 推送给前端
+stream_llm = build_llm(stream=True)
 
-# 多agents启动
+# 多agents启动；search_session 为同一个 crew 内共享的搜索会话（调用预算/限速/去重）
 class TripAgents():
 
+  def __init__(self, search_session=None):
+    self.search_session = search_session
+
   # 用于评估多个目的地后最终作出抉择的agent
   def city_selection_agent(self):
     tools: list[BaseTool] = [CalculatorTool()]
@@ -30,7 +43,7 @@ class TripAgents():
     # 启动搜索工具，爬取网站，计算器工具
     if ENABLE_SEARCH_CITY_SELECTION:
       tools = [
-        SearchTools.search_tool(),
+        SearchTools.search_tool(self.search_session),
         BrowserTools.scrape_and_summarize_website,
         CalculatorTool(),
       ]
@@ -48,7 +61,7 @@ class TripAgents():
     tools: list[BaseTool] = [CalculatorTool()]
     if ENABLE_SEARCH_LOCAL_EXPERT:
       tools = [
-        SearchTools.search_tool(),
+        SearchTools.search_tool(self.search_session),
         BrowserTools.scrape_and_summarize_website,
         CalculatorTool(),
       ]
@@ -65,7 +78,7 @@ class TripAgents():
     tools: list[BaseTool] = [CalculatorTool()]
     if ENABLE_SEARCH_CONCIERGE:
       tools = [
-        SearchTools.search_tool(),
+        SearchTools.search_tool(self.search_session),
         BrowserTools.scrape_and_summarize_website,
         CalculatorTool(),
       ]
@@ -74,5 +87,5 @@ class TripAgents():
         goal="""为该城市制定精彩行程，附预算与行李打包建议""",
         backstory="""深耕旅行规划与出行物流，多年专业经验""",
         tools=tools,
-        llm=llm,
+        llm=stream_llm,
         verbose=True)
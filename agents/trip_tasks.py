@@ -26,8 +26,46 @@ class TripTasks:
             expected_output="关于所选城市的详细报告，包含交通费用、天气预报与景点推荐"
         )
 
-    # 用于为城市制定精彩行程的任务
-    def gather_task(self, agent, origin, interests, range):
+    # 并行评估模式下，针对单个候选城市的调研任务（只看这一座城市，输出精简报告）
+    def city_research_task(self, agent, origin, city, interests, range):
+        return Task(
+            description=dedent(f"""
+                请只针对候选城市「{city}」进行调研，不要分析其他城市。
+                重点收集：出行日期内的天气预报、从出发地前往的交通方式与大致费用、
+                当季的文化或季节性活动、与旅行兴趣相关的代表性景点。
+
+                最终产出一份精简报告（不超过 300 字），最后一行给出 1-10 的综合评分，
+                格式为「评分：X」。
+
+                出发地：{origin}
+                候选城市：{city}
+                出行日期：{range}
+                旅行兴趣：{interests}
+            """),
+            agent=agent,
+            expected_output=f"关于{city}的精简调研报告（天气、交通费用、活动、景点）及综合评分"
+        )
+
+    # 汇总各城市调研报告，选出最终目的地（单次 LLM 调用，不经过 agent 循环）
+    def city_selection_prompt(self, origin, interests, range, reports):
+        sections = "\n\n".join(f"### {city}\n{report}" for city, report in reports.items())
+        return dedent(f"""
+            以下是各候选城市的调研报告。请综合天气、交通费用、季节性活动与旅行兴趣，
+            选出本次旅行的最佳城市。
+
+            输出格式：
+            第一行为「最终选择：城市名」；
+            随后给出一张 Markdown 对比表，列为：城市 | 天气 | 交通费用 | 活动亮点 | 评分；
+            最后用两三句话说明选择理由。
+
+            出发地：{origin}
+            出行日期：{range}
+            旅行兴趣：{interests}
+        """) + "\n" + sections
+
+    # 用于为城市制定精彩行程的任务；selection 为并行评估模式下汇总出的目的地选择与对比表
+    def gather_task(self, agent, origin, interests, range, selection=None):
+        selection_section = f"\n目的地选择结果（已完成比较）：\n{selection}\n" if selection else ""
         return Task(
             description=dedent(f"""
                 作为该城市的本地专家，请为即将到访且追求“极致体验”的旅行者编写一份深度城市指南。
@@ -42,13 +80,14 @@ class TripTasks:
                 出行日期：{range}
                 出发地：{origin}
                 旅行兴趣：{interests}
-            """),
+            """) + selection_section,
             agent=agent,
             expected_output="全面的城市指南，涵盖小众宝藏、文化热点与实用出行建议"
         )
 
-    # 用于最终行程计划的安排的任务
-    def plan_task(self, agent, origin, interests, range):
+    # 用于最终行程计划的安排的任务；feedback 为再规划时用户对上一版行程的反馈
+    def plan_task(self, agent, origin, interests, range, feedback=None):
+        feedback_section = f"\n用户对上一版行程的反馈（请优先满足）：\n{feedback}\n" if feedback else ""
         return Task(
             description=dedent(f"""
                 将上述指南扩展为完整的行程安排，包含每日详细计划、
@@ -65,10 +104,38 @@ class TripTasks:
                 出行日期：{range}
                 出发地：{origin}
                 旅行兴趣：{interests}
-            """),
+            """) + feedback_section,
             agent=agent,
             expected_output="完整扩展的旅行计划，含每日安排、天气、行李建议与预算明细"
         )
 
+    # 增量再规划任务：不再调研，直接基于已有的目的地报告/城市指南与上一版行程按反馈修改；
+    # days 非空时只重写这些日期（其余日期保持不变，由调用方拼回）
+    def replan_task(self, agent, origin, interests, range, guide, previous_plan, feedback, days=None):
+        if days:
+            scope = (
+                f"只需重写以下日期的行程：{'、'.join(days)}；其他日期保持不变，不要输出。\n"
+                f"每一天以包含该日期的 Markdown 标题开头（例如「## {days[0]}」），标题下给出当天的详细安排。\n"
+            )
+            expected = f"{'、'.join(days)} 的 Markdown 行程（每天一个含日期的标题）"
+        else:
+            scope = (
+                "请输出修改后的完整 Markdown 行程规划（结构与上一版一致：每日时间表、天气、打包清单与预算），\n"
+                "每一天以包含日期的 Markdown 标题开头；未受反馈影响的部分尽量保持原样。\n"
+            )
+            expected = "按反馈修改后的完整 Markdown 行程规划"
+        return Task(
+            description=dedent(f"""
+                以下是已完成的目的地调研与城市指南，以及上一版行程规划。
+                请根据用户反馈修改行程，不需要重新调研目的地；只有在反馈涉及新的地点或餐厅时才进行必要的查询。
+
+                出行日期：{range}
+                出发地：{origin}
+                旅行兴趣：{interests}
+            """) + f"\n{scope}\n用户反馈：\n{feedback}\n\n## 目的地调研与城市指南\n{guide}\n\n## 上一版行程\n{previous_plan}\n",
+            agent=agent,
+            expected_output=expected
+        )
+
     def __tip_section(self):
         return "如果你拿出最好的表现，我会给你好评！"
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
+import multiprocessing
 import os
+import threading
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Optional
 
 # 导入jwt库，用于生成和验证JWT token
 import jwt 
@@ -10,30 +14,98 @@ import jwt
 from fastapi import Depends, HTTPException, status 
 # 导入fastapi安全库，用于认证
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials 
-# 导入passlib库，用于密码加密和验证
-from passlib.context import CryptContext 
+# 导入fastapi并发工具，用于在线程池中执行阻塞调用
+from fastapi.concurrency import run_in_threadpool
 # 导入sqlalchemy库，用于数据库操作
-from sqlalchemy.orm import Session 
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # 导入db库，用于数据库操作
-from .db import User, get_db
+from .cache import TieredCache
+from .config import AUTH_HASH_CONCURRENCY, AUTH_HASH_WORKERS, AUTH_PRINCIPAL_CACHE_SIZE, AUTH_PRINCIPAL_TTL
+from .db import User, get_async_db
+from .passwords import hash_password, verify_password
 
 # 安全认证，如有需要可自行配置
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALG = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", "720"))
 
-# 使用 PBKDF2-SHA256 以避免 bcrypt 在部分环境的兼容问题与 72 字节限制
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 security = HTTPBearer(auto_error=False)
 
-# 密码加密
-def hash_password(raw: str) -> str:
-    return pwd_context.hash(raw)
+# 口令哈希/校验（PBKDF2，CPU 密集）在专用进程池中执行，不占用请求线程与事件循环；
+# 信号量限制同时进行的数量，突发登录时排队而不是压垮 CPU
+_hash_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+_hash_slots: Optional[asyncio.Semaphore] = None
 
-# 密码验证
-def verify_password(raw: str, hashed: str) -> bool:
-    return pwd_context.verify(raw, hashed)
+
+def _get_hash_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            # spawn：子进程只导入 api.passwords，不继承父进程的线程与数据库连接
+            _hash_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=AUTH_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _hash_pool
+
+
+# 关闭进程池（服务退出或子进程异常后重建前调用）
+def shutdown_hash_pool() -> None:
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+
+async def _run_hashing(fn: Callable[..., Any], *args: Any) -> Any:
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(AUTH_HASH_CONCURRENCY)
+    async with _hash_slots:
+        if AUTH_HASH_WORKERS <= 0:
+            return await run_in_threadpool(fn, *args)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(_get_hash_pool(), fn, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            # 子进程异常退出：重建进程池后重试一次
+            shutdown_hash_pool()
+            return await loop.run_in_executor(_get_hash_pool(), fn, *args)
+
+# 密码加密（异步，进程池执行）
+async def hash_password_async(raw: str) -> str:
+    return await _run_hashing(hash_password, raw)
+
+# 密码验证（异步，进程池执行）
+async def verify_password_async(raw: str, hashed: str) -> bool:
+    return await _run_hashing(verify_password, raw, hashed)
+
+# 已认证主体：路由只需要用户 id 与用户名，缓存它而不是绑定会话的 ORM 对象
+class Principal:
+    __slots__ = ("id", "username")
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+# 令牌主体（sub）-> 主体 的短时缓存，避免每个认证请求都查询 users 表。
+# 缓存只在本进程内：用户更新/删除时的失效只清除当前 worker，其他 worker 最多在 AUTH_PRINCIPAL_TTL 秒内仍按旧主体放行
+principal_cache = TieredCache("principals", ttl=AUTH_PRINCIPAL_TTL, max_entries=AUTH_PRINCIPAL_CACHE_SIZE, disk=False)
+
+def _principal_key(user_id: int) -> str:
+    return f"sub:{user_id}"
+
+# 使某个用户的缓存主体失效（批量删除等不会触发 ORM 事件的场景需手动调用）
+def invalidate_principal(user_id: int) -> None:
+    principal_cache.delete(_principal_key(user_id))
+
+@event.listens_for(User, "after_delete")
+@event.listens_for(User, "after_update")
+def _on_user_changed(_mapper: Any, _connection: Any, target: User) -> None:
+    invalidate_principal(target.id)
 
 # 创建访问令牌
 def create_access_token(user_id: int, username: str) -> str:
@@ -47,9 +119,9 @@ def create_access_token(user_id: int, username: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
 # 获取当前用户
-def get_current_user(
+async def get_current_user(
     creds: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if creds is None or not creds.scheme.lower().startswith("bearer"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="未认证")
@@ -57,10 +129,16 @@ def get_current_user(
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
         user_id = int(payload.get("sub", "0"))
-        user = db.get(User, user_id)
+        if AUTH_PRINCIPAL_TTL > 0:
+            cached = principal_cache.get(_principal_key(user_id))
+            if cached is not None:
+                return Principal(cached["id"], cached["username"])
+        user = await db.get(User, user_id)
         if user is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="用户不存在")
-        return user
+        if AUTH_PRINCIPAL_TTL > 0:
+            principal_cache.set(_principal_key(user_id), {"id": user.id, "username": user.username})
+        return Principal(user.id, user.username)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="登录已过期")
     except Exception:
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import CACHE_DIR
+
+
+# 生成稳定的缓存键：对任意可 JSON 序列化的参数做规范化序列化后取 sha256
+def make_key(*parts: Any) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# 两级缓存：进程内 LRU（毫秒级以下）+ 磁盘 SQLite（同机多个 uvicorn worker 共享）
+# 值需可 JSON 序列化；过期按 TTL 判断，内存层超出容量按 LRU 淘汰
+class TieredCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int = 256,
+        disk: bool = True,
+        max_disk_entries: int = 10000,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self.path: Optional[str] = None
+        if disk:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_expires ON entries (expires_at)")
+
+    # 每个线程各自持有一个 SQLite 连接；WAL 模式允许多进程并发读写
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _mem_put(self, key: str, expires_at: float, value: Any) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._mem.move_to_end(key)
+                    self._stats["hits_memory"] += 1
+                    return item[1]
+                del self._mem[key]
+        if self.path is not None:
+            try:
+                row = self._connect().execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._mem_put(key, row[1], value)
+                    self._stats["hits_disk"] += 1
+                return value
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._mem_put(key, expires_at, value)
+            self._stats["sets"] += 1
+            self._writes += 1
+            prune = self._writes % 200 == 0
+        if self.path is None:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False, default=str), expires_at, now),
+            )
+            if prune:
+                self._prune(conn, now)
+        except sqlite3.Error:
+            # 磁盘层失败不影响主流程，内存层仍可用
+            pass
+
+    # 清理过期条目，并按写入时间淘汰超出上限的最旧条目
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM entries ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._mem.pop(key, None)
+        if self.path is not None:
+            try:
+                self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+            except sqlite3.Error:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        if self.path is not None:
+            try:
+                self._connect().execute("DELETE FROM entries")
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = dict(self._stats)
+            data["memory_entries"] = len(self._mem)
+        lookups = data["hits_memory"] + data["hits_disk"] + data["misses"]
+        data["hit_ratio"] = round((data["hits_memory"] + data["hits_disk"]) / lookups, 4) if lookups else 0.0
+        data["name"] = self.name
+        data["ttl"] = self.ttl
+        return data
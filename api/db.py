@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import json
+import logging
 import os
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 
 from sqlalchemy import (
     create_engine,
+    inspect,
+    select,
+    text,
+    update,
+    Index,
     Integer,
     String,
     DateTime,
@@ -15,19 +22,62 @@ from sqlalchemy import (
     UniqueConstraint,
     Boolean,
 )
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
-from .config import DB_URL as CONFIG_DB_URL
+from .config import (
+    ASYNC_DB_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_URL as CONFIG_DB_URL,
+)
+from .metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+
+# 由同步驱动地址推导异步驱动地址
+def to_async_url(url: str) -> str:
+    if url.startswith("mysql+pymysql://") or url.startswith("mysql://"):
+        return "mysql+aiomysql://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://") and not url.startswith("sqlite+"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+# 连接池参数：SQLite 仅保留探活，其余使用可配置的连接池
+def _pool_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
 
 
 # 固定配置优先（来自 api/config.py）
-if CONFIG_DB_URL:
-    engine = create_engine(CONFIG_DB_URL)
-else:
+if not CONFIG_DB_URL:
     # 兜底为本地 SQLite（理论上不会走到）
-    DB_DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "trip_planner.db")
-    engine = create_engine(f"sqlite:///{DB_DEFAULT_PATH}", connect_args={"check_same_thread": False})
+    CONFIG_DB_URL = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'trip_planner.db')}"
+# SQLite 连接会在线程池（规划任务）间复用，需关闭同线程检查
+_connect_args = {"check_same_thread": False} if CONFIG_DB_URL.startswith("sqlite") else {}
+
+# 同步引擎：规划任务线程池、建表/迁移与命令行工具使用
+engine = create_engine(CONFIG_DB_URL, connect_args=_connect_args, **_pool_options(CONFIG_DB_URL))
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# 异步引擎：API 路由使用，等待数据库时不占用线程池
+_async_url = ASYNC_DB_URL or to_async_url(CONFIG_DB_URL)
+async_engine = create_async_engine(_async_url, **_pool_options(_async_url))
+instrument_engine(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 
 class Base(DeclarativeBase):
     pass
@@ -44,25 +94,37 @@ class User(Base):
     favorites: Mapped[list[Favorite]] = relationship("Favorite", back_populates="user", cascade="all, delete-orphan")  # type: ignore[name-defined]
 
 # 计划表，存放计划的id，用户id，计划标题，创建时间，版本，备注
+# latest_version/updated_at 为冗余字段，随每次追加版本在同一事务内更新，列表查询无需聚合版本表
 class Plan(Base):
     __tablename__ = "plans"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     title: Mapped[str] = mapped_column(String(200))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    latest_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     user: Mapped[User] = relationship("User", back_populates="plans")
     versions: Mapped[list[PlanVersion]] = relationship("PlanVersion", back_populates="plan", cascade="all, delete-orphan")  # type: ignore[name-defined]
 
+    __table_args__ = (
+        # 保存时按 (user_id, title) 查找计划；列表按 (user_id, updated_at, id) 做游标分页
+        Index("uq_plan_user_title", "user_id", "title", unique=True),
+        Index("ix_plan_user_updated", "user_id", "updated_at", "id"),
+    )
+
 # 计划版本表，存放计划版本的id，计划id，版本，数据，备注，评分，创建时间
 class PlanVersion(Base):
     __tablename__ = "plan_versions"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     plan_id: Mapped[int] = mapped_column(ForeignKey("plans.id"), index=True)
     version: Mapped[int] = mapped_column(Integer)  # 1,2,3...
-    data: Mapped[dict] = mapped_column(JSON)  # 存储结构化行程与地图编辑数据
+    data: Mapped[dict] = mapped_column(JSON)  # 存储结构化行程与地图编辑数据；kind=delta 时为 {"patch": [...]}
+    kind: Mapped[str] = mapped_column(String(8), default="full", server_default="full")  # full / delta
+    base_version: Mapped[Optional[int]] = mapped_column(Integer, default=None)  # delta 所基于的版本号
     notes: Mapped[Optional[str]] = mapped_column(Text, default=None)
     rating: Mapped[Optional[int]] = mapped_column(Integer, default=None)  # 1-5
+    size: Mapped[Optional[int]] = mapped_column(Integer, default=None)  # 完整版本数据序列化后的字节数（delta 存储时亦然），版本摘要列表使用
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     plan: Mapped[Plan] = relationship("Plan", back_populates="versions")
@@ -83,9 +145,84 @@ class Favorite(Base):
     user: Mapped[User] = relationship("User", back_populates="favorites")
     plan: Mapped[Plan] = relationship("Plan")
 
+    __table_args__ = (
+        Index("uq_favorite_user_plan", "user_id", "plan_id", unique=True),
+    )
+
+# 规划任务表，存放异步规划任务的状态、请求参数与结果，服务重启后仍可查询
+class PlanJob(Base):
+    __tablename__ = "plan_jobs"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32), default="plan")
+    status: Mapped[str] = mapped_column(String(16), default="queued", index=True)  # queued/running/succeeded/failed/timeout
+    params: Mapped[dict] = mapped_column(JSON)
+    result: Mapped[Optional[dict]] = mapped_column(JSON, default=None)
+    error: Mapped[Optional[str]] = mapped_column(Text, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=None)
+
+# 序列化后的 JSON 字节数（与 JSON 列存储形式一致：保留非 ASCII 字符）
+def json_size(data: Any) -> int:
+    return len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+# 为历史版本回填 size，分批读取避免一次加载全部版本数据
+def _backfill_version_sizes(batch: int = 200) -> None:
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(PlanVersion.id, PlanVersion.data)
+                .where(PlanVersion.id > last_id, PlanVersion.size.is_(None))
+                .order_by(PlanVersion.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                return
+            for vid, data in rows:
+                db.execute(update(PlanVersion).where(PlanVersion.id == vid).values(size=json_size(data)))
+            db.commit()
+            last_id = rows[-1][0]
+
+
+# 已有数据库的增量升级：补齐新增列并回填，再创建缺失的索引（create_all 不会修改已存在的表）
+def _upgrade_schema() -> None:
+    columns = {c["name"] for c in inspect(engine).get_columns("plans")}
+    with engine.begin() as conn:
+        if "latest_version" not in columns:
+            conn.execute(text("ALTER TABLE plans ADD COLUMN latest_version INTEGER NOT NULL DEFAULT 0"))
+        if "updated_at" not in columns:
+            conn.execute(text("ALTER TABLE plans ADD COLUMN updated_at DATETIME NULL"))
+        if "latest_version" not in columns or "updated_at" not in columns:
+            conn.execute(text(
+                "UPDATE plans SET "
+                "latest_version = COALESCE((SELECT MAX(v.version) FROM plan_versions v WHERE v.plan_id = plans.id), 0), "
+                "updated_at = COALESCE((SELECT MAX(v.created_at) FROM plan_versions v WHERE v.plan_id = plans.id), created_at)"
+            ))
+    version_columns = {c["name"] for c in inspect(engine).get_columns("plan_versions")}
+    with engine.begin() as conn:
+        if "kind" not in version_columns:
+            conn.execute(text("ALTER TABLE plan_versions ADD COLUMN kind VARCHAR(8) NOT NULL DEFAULT 'full'"))
+        if "base_version" not in version_columns:
+            conn.execute(text("ALTER TABLE plan_versions ADD COLUMN base_version INTEGER NULL"))
+        if "size" not in version_columns:
+            conn.execute(text("ALTER TABLE plan_versions ADD COLUMN size INTEGER NULL"))
+    if "size" not in version_columns:
+        _backfill_version_sizes()
+    for table in (Plan.__table__, Favorite.__table__):
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                # 历史数据存在重复（例如并发保存产生的同名计划）时唯一索引无法建立，不阻塞启动
+                logger.warning("创建索引 %s 失败，请清理重复数据后重启: %s", index.name, e)
+
+
 # 初始化数据库
 def init_db() -> None:
     Base.metadata.create_all(bind=engine)
+    _upgrade_schema()
 
 # 获取数据库
 def get_db():
@@ -95,4 +232,9 @@ def get_db():
     finally:
         db.close()
 
+# 获取异步数据库会话（API 路由依赖）
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import concurrent.futures
+import datetime as dt
+import functools
+import html
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cache import TieredCache, make_key
+from .config import EXPORT_CACHE_MAX_BYTES, EXPORT_DIR, EXPORT_PDF_FONT, EXPORT_WORKERS
+
+# 计划导出：由计划版本数据渲染 ICS / Markdown / HTML / PDF。
+# 渲染在后台进程池中执行，结果以「数据内容 + 格式 + 渲染器版本」的哈希命名写入 EXPORT_DIR，
+# 同一内容只渲染一次；同一文件的并发请求共享同一个渲染任务
+
+# 模板或渲染逻辑变化时递增，使旧的缓存文件失效
+RENDERER_VERSION = 2
+
+# 未设置 EXPORT_PDF_FONT 时依次查找的中文字体（TrueType 轮廓；xhtml2pdf/reportlab 不支持 CFF 轮廓的 .otf 与 Noto CJK .ttc）
+PDF_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-zenhei/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/usr/share/fonts/google-droid/DroidSansFallbackFull.ttf",
+    "/System/Library/Fonts/STHeiti Light.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "C:/Windows/Fonts/simsun.ttc",
+)
+
+# 格式 -> (扩展名, Content-Type)
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "ics": ("ics", "text/calendar; charset=utf-8"),
+    "md": ("md", "text/markdown; charset=utf-8"),
+    "html": ("html", "text/html; charset=utf-8"),
+    "pdf": ("pdf", "application/pdf"),
+}
+
+_LIST_MARK = re.compile(r"^\s*(?:[-*+]\s+|\d+[.)、]\s+)")
+_TIMED = re.compile(r"^(\d{1,2})[:：](\d{2})\s*(?:[-~～—至到]\s*(\d{1,2})[:：](\d{2}))?\s*[：:、.\-—]?\s*(.*)$")
+
+_pool: Optional[concurrent.futures.Executor] = None
+_pool_lock = threading.Lock()
+_inflight: Dict[str, concurrent.futures.Future] = {}
+_inflight_lock = threading.Lock()
+
+
+# (plan_id, version, fmt) -> 内容哈希；版本不可变，命中后条件请求无需重建版本数据即可返回 304
+digest_cache = TieredCache("export_digests", ttl=7 * 24 * 3600, max_entries=4096, disk=False)
+
+
+# PDF 使用的中文字体文件：EXPORT_PDF_FONT，未设置时查找常见系统字体；都没有时返回 None（无法导出 PDF）
+@functools.lru_cache(maxsize=1)
+def pdf_font() -> Optional[str]:
+    if EXPORT_PDF_FONT:
+        return EXPORT_PDF_FONT if os.path.isfile(EXPORT_PDF_FONT) else None
+    return next((path for path in PDF_FONT_CANDIDATES if os.path.isfile(path)), None)
+
+
+# 导出内容哈希（也作为 ETag 与缓存文件名）；PDF 还取决于所用字体
+def content_hash(data: Dict[str, Any], fmt: str) -> str:
+    return make_key("export", RENDERER_VERSION, fmt, data, pdf_font() if fmt == "pdf" else None)
+
+
+def cache_path(digest: str, fmt: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{digest}.{FORMATS[fmt][0]}")
+
+
+# 已渲染的文件路径（不存在时返回 None）；命中时刷新访问时间，供容量淘汰参考
+def cached_file(digest: str, fmt: str) -> Optional[str]:
+    path = cache_path(digest, fmt)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+
+# ---- 渲染 ----
+
+PDF_FONT_MISSING = "未找到中文字体，无法导出 PDF：请设置 EXPORT_PDF_FONT 指向 TrueType 中文字体文件（.ttf/.ttc），或改用 html 导出"
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r", "").replace("\n", "\\n")
+
+
+# RFC 5545：内容行按 75 个八位组折行，续行以空格开头；不拆开多字节字符
+def _ics_fold(line: str) -> List[str]:
+    out: List[str] = []
+    current, size = "", 0
+    for ch in line:
+        width = len(ch.encode("utf-8"))
+        limit = 75 if not out else 74
+        if size + width > limit:
+            out.append(current)
+            current, size = "", 0
+        current += ch
+        size += width
+    out.append(current)
+    return [out[0]] + [" " + part for part in out[1:]]
+
+
+def _day_title(day: Dict[str, Any], index: int) -> str:
+    first = next((a for a in day.get("activities") or [] if a.strip()), "")
+    first = _LIST_MARK.sub("", first)
+    return f"第{index}天 · {first[:40]}" if first else f"第{index}天 行程"
+
+
+# 带时刻的活动行 -> [(开始分钟, 结束分钟或 None, 标题)]
+def _timed_items(activities: List[str]) -> List[Tuple[int, Optional[int], str]]:
+    items = []
+    for line in activities:
+        m = _TIMED.match(_LIST_MARK.sub("", line).strip())
+        if not m:
+            continue
+        start = int(m.group(1)) * 60 + int(m.group(2))
+        end = int(m.group(3)) * 60 + int(m.group(4)) if m.group(3) else None
+        if start >= 24 * 60 or (end is not None and (end >= 24 * 60 or end <= start)):
+            continue
+        items.append((start, end, m.group(5).strip() or line.strip()))
+    return items
+
+
+# ICS：每天一个全天事件（描述为当天全部活动、用餐与备注）；带时刻的活动行（如「09:00 参观故宫」）另建定时事件，
+# 未给结束时刻时持续到下一项开始（最长 2 小时）
+def render_ics(data: Dict[str, Any], digest: str = "") -> str:
+    stamp = dt.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    uid_base = (digest or uuid.uuid4().hex)[:16]
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//TripPlanner//CN", "CALSCALE:GREGORIAN"]
+    for index, day in enumerate(data.get("days") or [], start=1):
+        try:
+            date = dt.date.fromisoformat(str(day.get("date")))
+        except ValueError:
+            continue
+        ymd = date.strftime("%Y%m%d")
+        activities = [a for a in day.get("activities") or [] if a and a.strip()]
+        desc = list(activities)
+        if day.get("meals"):
+            desc += ["", "用餐：" + "；".join(day["meals"])]
+        if day.get("notes"):
+            desc += ["", "备注：" + str(day["notes"])]
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uid_base}-{ymd}@trip-planner",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{ymd}",
+            f"DTEND;VALUE=DATE:{(date + dt.timedelta(days=1)).strftime('%Y%m%d')}",
+            f"SUMMARY:{_ics_escape(_day_title(day, index))}",
+            f"DESCRIPTION:{_ics_escape(chr(10).join(desc))}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+        timed = _timed_items(activities)
+        for i, (start, end, title) in enumerate(timed):
+            if end is None:
+                nxt = timed[i + 1][0] if i + 1 < len(timed) else start + 60
+                end = min(max(nxt, start + 15), start + 120, 24 * 60 - 1)
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{uid_base}-{ymd}-{i}@trip-planner",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{ymd}T{start // 60:02d}{start % 60:02d}00",
+                f"DTEND:{ymd}T{end // 60:02d}{end % 60:02d}00",
+                f"SUMMARY:{_ics_escape(title[:80])}",
+                "END:VEVENT",
+            ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(folded for line in lines for folded in _ics_fold(line)) + "\r\n"
+
+
+# Markdown：优先使用模型原始输出；缺失时按结构化的每日活动生成
+def render_markdown(data: Dict[str, Any]) -> str:
+    raw = data.get("raw_markdown")
+    if raw:
+        return raw if raw.endswith("\n") else raw + "\n"
+    parts = [f"# 行程规划\n\n{data.get('summary', '')}\n"]
+    for day in data.get("days") or []:
+        parts.append(f"\n## {day.get('date', '')}\n")
+        parts += [f"- {_LIST_MARK.sub('', a)}" for a in day.get("activities") or []]
+        if day.get("meals"):
+            parts.append("\n**用餐**：" + "；".join(day["meals"]))
+        if day.get("notes"):
+            parts.append(f"\n> {day['notes']}")
+    return "\n".join(parts) + "\n"
+
+
+_STYLE = """
+@page { size: A4; margin: 18mm 16mm; }
+body { font-family: %(font)s; font-size: 11pt; line-height: 1.6; color: #1f2937; }
+h1 { font-size: 20pt; color: #0f766e; border-bottom: 2px solid #0f766e; padding-bottom: 4px; }
+h2 { font-size: 15pt; color: #0f766e; margin-top: 18px; }
+h3 { font-size: 12.5pt; color: #334155; }
+table { border-collapse: collapse; width: 100%%; margin: 8px 0; }
+th, td { border: 1px solid #cbd5e1; padding: 4px 6px; text-align: left; vertical-align: top; }
+th { background: #f1f5f9; }
+blockquote { color: #475569; border-left: 3px solid #94a3b8; margin: 6px 0; padding-left: 10px; }
+.summary { color: #475569; margin-bottom: 12px; }
+.meta { color: #64748b; font-size: 9pt; }
+"""
+
+
+# HTML：Markdown 正文转 HTML 并套用内联样式（PDF 复用同一份 HTML）
+def render_html(data: Dict[str, Any], for_pdf: bool = False) -> str:
+    import markdown
+
+    body = markdown.markdown(render_markdown(data), extensions=["tables", "sane_lists"])
+    font_face = ""
+    font = '"PingFang SC", "Microsoft YaHei", "Noto Sans CJK SC", sans-serif'
+    if for_pdf:
+        font_face = f'@font-face {{ font-family: "cjk"; src: url("{pdf_font()}"); }}\n'
+        font = '"cjk"'
+    meta = data.get("request") or data.get("meta") or {}
+    subtitle = " · ".join(str(meta[k]) for k in ("origin", "cities", "date_range") if meta.get(k))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"zh-CN\"><head><meta charset=\"utf-8\">"
+        "<title>行程规划</title>"
+        f"<style>{font_face}{_STYLE % {'font': font}}</style></head><body>"
+        f"<p class=\"meta\">{html.escape(subtitle)}</p>"
+        f"<p class=\"summary\">{html.escape(str(data.get('summary') or ''))}</p>"
+        f"{body}</body></html>\n"
+    )
+
+
+# PDF：xhtml2pdf 内置字体不含中文字形，没有可用的中文字体时拒绝渲染，避免生成满是空白方块的文件
+def render_pdf(data: Dict[str, Any], dest: str) -> None:
+    if pdf_font() is None:
+        raise RuntimeError(PDF_FONT_MISSING)
+    from xhtml2pdf import pisa
+
+    with open(dest, "wb") as fh:
+        status = pisa.CreatePDF(render_html(data, for_pdf=True), dest=fh, encoding="utf-8")
+    if status.err:
+        raise RuntimeError(f"PDF 渲染失败（{status.err} 处错误）")
+
+
+# 在工作进程中执行：渲染到临时文件后原子替换，读者不会看到半成品
+def _render_to_file(fmt: str, data: Dict[str, Any], digest: str) -> str:
+    path = cache_path(digest, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        if fmt == "pdf":
+            render_pdf(data, tmp)
+        else:
+            text = {"ics": lambda: render_ics(data, digest), "md": lambda: render_markdown(data), "html": lambda: render_html(data)}[fmt]()
+            with open(tmp, "w", encoding="utf-8", newline="") as fh:
+                fh.write(text)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+# ---- 后台渲染 ----
+
+def _get_pool() -> concurrent.futures.Executor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if EXPORT_WORKERS <= 0:
+                _pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
+            else:
+                # spawn：子进程只导入 api.exports 及其依赖，不继承父进程的线程与数据库连接
+                _pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+        return _pool
+
+
+# 关闭渲染进程池（服务退出或子进程异常后重建前调用）
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _done(digest: str, fmt: str, future: concurrent.futures.Future) -> None:
+    with _inflight_lock:
+        _inflight.pop(f"{digest}.{fmt}", None)
+    if not future.cancelled() and future.exception() is None:
+        prune()
+
+
+# 提交渲染（已有相同内容的任务在进行时复用之）；返回结果为缓存文件路径的 Future
+def submit(fmt: str, data: Dict[str, Any], digest: Optional[str] = None) -> concurrent.futures.Future:
+    if fmt not in FORMATS:
+        raise KeyError(fmt)
+    digest = digest or content_hash(data, fmt)
+    key = f"{digest}.{fmt}"
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        try:
+            future = _get_pool().submit(_render_to_file, fmt, data, digest)
+        except concurrent.futures.process.BrokenProcessPool:
+            shutdown_pool()
+            future = _get_pool().submit(_render_to_file, fmt, data, digest)
+        _inflight[key] = future
+    future.add_done_callback(lambda f: _done(digest, fmt, f))
+    return future
+
+
+# 缓存目录超出 EXPORT_CACHE_MAX_BYTES 时，按最近访问时间从旧到新删除
+def prune(max_bytes: int = EXPORT_CACHE_MAX_BYTES) -> int:
+    try:
+        entries = [e for e in os.scandir(EXPORT_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+    except FileNotFoundError:
+        return 0
+    stats = [(e.stat().st_atime, e.stat().st_size, e.path) for e in entries]
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
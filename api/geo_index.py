@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from .config import CACHE_DIR
+
+# 城市索引：由 geonamescache 预先构建，按国家保存「已排序的检索键 + 城市下标」，前缀查询用二分定位后顺序扫描。
+# 检索键包括英文名、去掉重音的英文名、中日文别名（含去掉「市」「特别市」等后缀的写法）、拼音（别名中的小写罗马字，如 hang zhou）及拼音首字母。
+# 构建结果写入 CACHE_DIR/geo_index.json，之后的进程直接加载文件。
+
+# 索引结构或构建规则变化时递增，使旧的索引文件失效
+INDEX_VERSION = 1
+INDEX_PATH = os.path.join(CACHE_DIR, "geo_index.json")
+
+_IDEOGRAPHS = re.compile(r"^[一-鿿]+$")
+_CJK = re.compile(r"[一-鿿]")
+_ROMAN = re.compile(r"^[a-z]+(?: [a-z]+){1,3}$")
+_CITY_SUFFIX = re.compile(r"(?:特别市|特別市|广域市|廣域市|市)$")
+
+_index: Optional[Dict[str, Dict[str, Any]]] = None
+_lock = threading.Lock()
+
+
+def _fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def _key(text: str) -> str:
+    return "".join(_fold(text).split())
+
+
+# 中文显示名（去掉行政后缀后保存）的优先级：简体（可用 GB2312 编码）且带「市」等后缀的正式名 > 简体 > 其他纯汉字别名（繁体/日文汉字）
+def _zh_rank(alt: str) -> int:
+    try:
+        alt.encode("gb2312")
+    except UnicodeEncodeError:
+        return 2
+    return 0 if _CITY_SUFFIX.search(alt) else 1
+
+
+# 一个城市的全部检索键与中文显示名
+def _aliases(city: Dict[str, Any]) -> tuple:
+    keys = {_key(city["name"])}
+    zh, zh_rank = None, 3
+    for alt in city.get("alternatenames") or []:
+        if _CJK.search(alt):
+            short = _CITY_SUFFIX.sub("", alt) if len(alt) > 2 else alt
+            keys.update((_key(alt), _key(short)))
+            if _IDEOGRAPHS.match(alt) and _zh_rank(alt) < zh_rank:
+                zh, zh_rank = short, _zh_rank(alt)
+        elif city.get("countrycode") in ("CN", "TW", "HK", "MO") and _ROMAN.match(alt):
+            # 拼音别名：连写与首字母
+            keys.add(alt.replace(" ", ""))
+            keys.add("".join(w[0] for w in alt.split()))
+    keys.discard("")
+    return keys, zh
+
+
+def build() -> Dict[str, Dict[str, Any]]:
+    import geonamescache  # type: ignore
+
+    by_country: Dict[str, List[Dict[str, Any]]] = {}
+    for city in geonamescache.GeonamesCache().get_cities().values():
+        if city.get("countrycode") and city.get("name"):
+            by_country.setdefault(city["countrycode"], []).append(city)
+    index: Dict[str, Dict[str, Any]] = {}
+    for cc, cities in by_country.items():
+        # 城市按人口降序存放，下标越小人口越多；同一前缀的结果按下标排序即按人口排序
+        cities.sort(key=lambda c: -(c.get("population") or 0))
+        rows, pairs = [], []
+        for i, city in enumerate(cities):
+            keys, zh = _aliases(city)
+            rows.append([city["name"], zh, round(float(city["latitude"]), 5), round(float(city["longitude"]), 5), int(city.get("population") or 0)])
+            pairs.extend((k, i) for k in keys)
+        pairs.sort()
+        index[cc] = {"cities": rows, "keys": [k for k, _ in pairs], "refs": [i for _, i in pairs]}
+    return index
+
+
+# 进程内共享的索引：优先加载索引文件，不存在或版本不符时构建并写入
+def get_index() -> Dict[str, Dict[str, Any]]:
+    global _index
+    if _index is not None:
+        return _index
+    with _lock:
+        if _index is None:
+            loaded = None
+            try:
+                with open(INDEX_PATH, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    loaded = data["countries"]
+            except (OSError, ValueError):
+                pass
+            if loaded is None:
+                try:
+                    loaded = build()
+                except ImportError:
+                    loaded = {}
+                if loaded:
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    tmp = f"{INDEX_PATH}.{os.getpid()}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump({"version": INDEX_VERSION, "countries": loaded}, f, ensure_ascii=False, separators=(",", ":"))
+                    os.replace(tmp, INDEX_PATH)
+            _index = loaded
+    return _index
+
+
+# 前缀查询：返回人口从多到少的城市；prefix 为空时返回该国人口最多的城市
+def search(country: str, prefix: str = "", limit: int = 50) -> List[Dict[str, Any]]:
+    entry = get_index().get(country.upper())
+    if not entry:
+        return []
+    cities = entry["cities"]
+    key = _key(prefix)
+    if not key:
+        hits = range(min(limit, len(cities)))
+    else:
+        keys, refs = entry["keys"], entry["refs"]
+        found = set()
+        i = bisect.bisect_left(keys, key)
+        while i < len(keys) and keys[i].startswith(key):
+            found.add(refs[i])
+            i += 1
+        hits = sorted(found)[:limit]
+    return [
+        {"name": cities[i][0], "zh": cities[i][1], "lat": cities[i][2], "lng": cities[i][3], "population": cities[i][4]}
+        for i in hits
+    ]
+
+
+def warm() -> None:
+    get_index()
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from .cache import TieredCache, make_key
+from .config import (
+    CACHE_DIR,
+    GEOCODE_CACHE_TTL,
+    GEOCODE_MIN_INTERVAL,
+    GEOCODE_NEGATIVE_TTL,
+    GEOCODE_QUEUE_MAX,
+    GEOCODE_TIMEOUT,
+    GEOCODE_URL,
+    GEOCODE_USER_AGENT,
+)
+
+# 地理编码服务：名称清洗与规范化 -> 持久缓存（SQLite，进程内 LRU 在前）-> geonamescache 离线城市库 -> 上游 Nominatim。
+# 上游请求由每个进程一个后台线程按队列顺序发出，相邻请求间隔由磁盘上的共享时钟控制，同机所有 worker 合计不超过
+# 每 GEOCODE_MIN_INTERVAL 秒一次；同一名称的并发请求共享同一个上游任务。
+
+_LIST_MARK = re.compile(r"^\s*(?:[-*+•]\s+|\d+[.)、]\s+)")
+_TIME_PREFIX = re.compile(r"^\d{1,2}[:：]\d{2}(?:\s*[-~～—至到]\s*\d{1,2}[:：]\d{2})?\s*[：:、.\-—]?\s*")
+_BRACKETS = re.compile(r"[（(【\[][^）)】\]]*[）)】\]]")
+_VERB_PREFIX = re.compile(r"^(?:参观|游览|前往|抵达|到达|漫步|打卡|入住|游玩|探访|逛逛|逛|登上|登|去|在|乘坐|步行至|步行到)\s*")
+_CLAUSE_END = re.compile(r"[，,。;；！!？?]")
+_CJK = re.compile(r"[一-鿿]")
+
+# 成功结果与未找到结果（lat 为 None）分别按各自的 TTL 缓存
+geocode_cache = TieredCache("geocode", ttl=GEOCODE_CACHE_TTL, max_entries=4096)
+
+_queue: "queue.Queue[Tuple[str, str]]" = queue.Queue(maxsize=GEOCODE_QUEUE_MAX)
+_inflight: Dict[str, concurrent.futures.Future] = {}
+_inflight_lock = threading.Lock()
+_worker: Optional[threading.Thread] = None
+_session: Optional[requests.Session] = None
+_cities: Optional[Dict[str, Tuple[float, float, int]]] = None
+_cities_lock = threading.Lock()
+
+
+# 从活动描述中提取地点名：去掉列表符号、时刻、括号内说明、动词前缀与逗号后的描述
+def clean_name(text: str) -> str:
+    name = _LIST_MARK.sub("", text or "").strip()
+    name = _TIME_PREFIX.sub("", name)
+    name = _BRACKETS.sub("", name)
+    name = _CLAUSE_END.split(name, 1)[0]
+    name = _VERB_PREFIX.sub("", name.strip())
+    return name.strip(" \t*_`\"'：:")
+
+
+# 规范化键：NFKC（全角转半角）+ 忽略大小写 + 合并空白
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+# 离线城市库：规范化名称（英文名与中日文别名，含去掉「市」的写法）-> (lat, lng, 人口)，同名取人口最多者
+def _city_index() -> Dict[str, Tuple[float, float, int]]:
+    global _cities
+    if _cities is not None:
+        return _cities
+    with _cities_lock:
+        if _cities is None:
+            index: Dict[str, Tuple[float, float, int]] = {}
+            try:
+                import geonamescache  # type: ignore
+                cities = geonamescache.GeonamesCache().get_cities()
+            except Exception:
+                cities = {}
+            for city in cities.values():
+                entry = (float(city["latitude"]), float(city["longitude"]), int(city.get("population") or 0))
+                names = [city["name"]] + [n for n in city.get("alternatenames") or [] if _CJK.search(n)]
+                for name in names:
+                    for variant in (name, name[:-1] if name.endswith("市") and len(name) > 2 else None):
+                        if not variant:
+                            continue
+                        key = normalize(variant)
+                        if key not in index or index[key][2] < entry[2]:
+                            index[key] = entry
+            _cities = index
+    return _cities
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.headers["user-agent"] = GEOCODE_USER_AGENT
+        session.headers["accept-language"] = "zh-CN,zh;q=0.9,en;q=0.8"
+        _session = session
+    return _session
+
+
+# 跨进程共享的上游请求时钟：在 SQLite 事务内预约下一个可用时刻，返回需等待的秒数
+def _reserve_slot() -> float:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, "geocode_rate.sqlite3"), timeout=10.0, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS slots (name TEXT PRIMARY KEY, next_at REAL NOT NULL)")
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT next_at FROM slots WHERE name = 'upstream'").fetchone()
+        now = time.time()
+        at = max(now, row[0] if row else 0.0)
+        conn.execute("INSERT OR REPLACE INTO slots (name, next_at) VALUES ('upstream', ?)", (at + GEOCODE_MIN_INTERVAL,))
+        conn.execute("COMMIT")
+        return at - now
+    finally:
+        conn.close()
+
+
+def _lookup_upstream(query: str) -> Optional[Dict[str, Any]]:
+    wait = _reserve_slot()
+    if wait > 0:
+        time.sleep(wait)
+    resp = _get_session().get(GEOCODE_URL, params={"q": query, "format": "jsonv2", "limit": 1}, timeout=GEOCODE_TIMEOUT)
+    resp.raise_for_status()
+    items = resp.json()
+    if not items:
+        return None
+    return {"lat": float(items[0]["lat"]), "lng": float(items[0]["lon"]), "display_name": items[0].get("display_name")}
+
+
+# 上游队列的消费线程：逐个请求并写入缓存；未找到的结果按较短 TTL 缓存，请求失败不缓存
+def _run_worker() -> None:
+    while True:
+        key, query = _queue.get()
+        with _inflight_lock:
+            future = _inflight.get(key)
+        try:
+            found = _lookup_upstream(query)
+            value = {"query": query, **(found or {"lat": None, "lng": None})}
+            geocode_cache.set(key, value, ttl=None if found else GEOCODE_NEGATIVE_TTL)
+            if future is not None:
+                future.set_result(value)
+        except Exception as e:
+            if future is not None:
+                future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+            _queue.task_done()
+
+
+def _ensure_worker() -> None:
+    global _worker
+    with _inflight_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name="geocode-upstream", daemon=True)
+            _worker.start()
+
+
+# 排入上游队列；同一键已在队列中时复用其 Future。队列已满返回 None
+def _submit(key: str, query: str) -> Optional[concurrent.futures.Future]:
+    _ensure_worker()
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = concurrent.futures.Future()
+        try:
+            _queue.put_nowait((key, query))
+        except queue.Full:
+            return None
+        _inflight[key] = future
+    return future
+
+
+def _item(name: str, label: str, status: str, source: Optional[str] = None, value: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    value = value or {}
+    return {
+        "name": name,
+        "label": label,
+        "status": status,
+        "source": source,
+        "lat": value.get("lat"),
+        "lng": value.get("lng"),
+        "display_name": value.get("display_name"),
+    }
+
+
+# 批量解析（不等待上游）：返回每个名称的即时结果，以及需要等待的 {键: Future}。
+# status：ok / not_found / pending（已排队）/ busy（队列已满）/ empty（清洗后为空）
+def resolve_batch(names: List[str], hint: str = "") -> Tuple[List[Dict[str, Any]], Dict[str, concurrent.futures.Future]]:
+    hint = clean_name(hint)
+    items: List[Dict[str, Any]] = []
+    futures: Dict[str, concurrent.futures.Future] = {}
+    seen: Dict[str, Dict[str, Any]] = {}
+    cities = _city_index()
+    for name in names:
+        label = clean_name(name)
+        if not label:
+            items.append(_item(name, label, "empty"))
+            continue
+        norm = normalize(label)
+        query = label if not hint or normalize(hint) in norm else f"{hint} {label}"
+        key = make_key("geocode", normalize(query))
+        if key in seen:
+            items.append({**seen[key], "name": name})
+            continue
+        # 离线库只用于城市级名称：有城市提示时，只有名称就是该城市本身才按离线结果返回（避免「西湖」匹配到同名小镇）
+        city = cities.get(norm) if not hint or norm == normalize(hint) else None
+        cached = geocode_cache.get(key) if city is None else None
+        if city is not None:
+            item = _item(name, label, "ok", "offline", {"lat": city[0], "lng": city[1]})
+        elif cached is not None:
+            item = _item(name, label, "ok" if cached.get("lat") is not None else "not_found", "cache", cached)
+        else:
+            future = _submit(key, query)
+            if future is None:
+                item = _item(name, label, "busy")
+            else:
+                futures[key] = future
+                item = {**_item(name, label, "pending", "upstream"), "_key": key}
+        seen[key] = item
+        items.append(item)
+    return items, futures
+
+
+# 用已完成的上游结果填充 pending 项
+def fill_results(items: List[Dict[str, Any]], futures: Dict[str, concurrent.futures.Future]) -> List[Dict[str, Any]]:
+    out = []
+    for item in items:
+        key = item.pop("_key", None)
+        future = futures.get(key) if key else None
+        if future is not None and future.done():
+            if future.exception() is not None:
+                item = {**item, "status": "error"}
+            else:
+                value = future.result()
+                item = _item(item["name"], item["label"], "ok" if value.get("lat") is not None else "not_found", "upstream", value)
+        out.append(item)
+    return out
+
+
+# 预先加载离线城市库（首次约 0.5 秒），避免首个批量请求等待
+def warm() -> None:
+    _city_index()
+
+
+def stats() -> Dict[str, Any]:
+    return {"cache": geocode_cache.stats(), "queued": _queue.qsize(), "offline_names": len(_cities or {})}
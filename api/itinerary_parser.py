@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 行程 Markdown 解析：单遍扫描，每行至多做一次标题匹配，标题中的日期/天数通过一个组合正则识别后按字典定位到日期，
+# 与行程天数无关（旧实现对每个标题逐一比较所有日期）。支持的写法：
+#   2025-10-01 / 2025/10/01 / 2025.10.01 / 2025年10月1日 / 10月1日 / 10/01 / 第1天 / 第一天 / Day 1 / D1
+# 标题可以是 Markdown 标题（# ~ ######）或独占一行的粗体（**第1天：抵达**）。
+# 一天内的「用餐/费用/备注」按小节标题或行首标签归入 DayPlan 的 meals / costs / notes，其余行为 activities。
+# 预算只累加明细金额：合计/小计行不计入（当天没有明细时才采用）；当天有费用小节时以小节为准，活动/用餐行里的价格不再重复累加。
+# 支持流式输入：feed() 逐块喂入文本，返回已完成的日期；close() 结束并返回剩余的日期。
+
+_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$|^\s*\*\*(.+?)\*\*\s*[:：]?\s*$")
+_DAY_REF = re.compile(
+    r"(?P<y>\d{4})\s*[-/.年]\s*(?P<ym>\d{1,2})\s*[-/.月]\s*(?P<yd>\d{1,2})"
+    r"|(?P<m>\d{1,2})\s*月\s*(?P<md>\d{1,2})\s*[日号]"
+    r"|(?<![\d/])(?P<sm>\d{1,2})/(?P<sd>\d{1,2})(?![\d/])"
+    r"|第\s*(?P<n>[0-9零〇一二两三四五六七八九十百]+)\s*[天日]"
+    r"|(?<![a-z0-9])(?:day|d)\s*(?P<dn>\d{1,3})(?![0-9])",
+    re.I,
+)
+_LIST_MARK = re.compile(r"^\s*(?:[-*+•]\s+|\d+[.)、]\s+)")
+_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{2,}")
+_LABEL = re.compile(
+    r"^\**\s*(?:(?P<meal>早餐|午餐|晚餐|早饭|午饭|晚饭|早午餐|下午茶|夜宵|宵夜|用餐|餐饮|美食推荐|breakfast|brunch|lunch|dinner|meals?)"
+    r"|(?P<cost>费用|花费|开销|预算|门票|交通费|住宿费|cost|budget|price)"
+    r"|(?P<note>备注|提示|注意事项|注意|小贴士|贴士|tips?|notes?))\s*\**\s*[:：]\s*\**\s*(?P<rest>.*)$",
+    re.I,
+)
+_SECTION = re.compile(
+    r"(?P<meal>餐|美食|吃|meal|food|dining)|(?P<cost>费用|花费|开销|预算|cost|budget)|(?P<note>备注|提示|注意|贴士|tips?|notes?)",
+    re.I,
+)
+# 时段/餐次标题只会出现在某一天之内，即使与日期标题同级也不结束当天
+_DAYPART = re.compile(r"上午|中午|下午|傍晚|晚上|早上|清晨|夜间|夜晚|早餐|午餐|晚餐|夜宵|morning|noon|afternoon|evening|night", re.I)
+_AMOUNT = re.compile(
+    r"(?:¥|￥|RMB\s*|CNY\s*)(?P<a>\d+(?:\.\d+)?)(?:\s*[-~～至]\s*(?:¥|￥)?(?P<a2>\d+(?:\.\d+)?))?"
+    r"|(?P<b>\d+(?:\.\d+)?)(?:\s*[-~～至]\s*(?P<b2>\d+(?:\.\d+)?))?\s*(?:元|块|rmb|cny)",
+    re.I,
+)
+# 合计/小计行：金额是其他明细之和
+_TOTAL = re.compile(r"合计|总计|小计|共计|总费用|总花费|总开销|总预算|sub-?total|\btotal\b", re.I)
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+
+def _cn_number(text: str) -> int:
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        elif ch == "百":
+            total += (current or 1) * 100
+            current = 0
+        elif ch == "十":
+            total += (current or 1) * 10
+            current = 0
+    return total + current
+
+
+# 标题 -> 日期：年月日按字典精确定位，无年份的月日按行程内的 (月, 日) 定位，天数按序号定位
+class DayMatcher:
+    def __init__(self, days: List[str]):
+        self.days = list(days)
+        self._by_date = {d: d for d in self.days}
+        self._by_month_day: Dict[Tuple[int, int], str] = {}
+        for d in self.days:
+            try:
+                self._by_month_day.setdefault((int(d[5:7]), int(d[8:10])), d)
+            except ValueError:
+                continue
+
+    def _resolve(self, m: re.Match) -> Optional[str]:
+        if m.group("y"):
+            return self._by_date.get(f"{int(m.group('y')):04d}-{int(m.group('ym')):02d}-{int(m.group('yd')):02d}")
+        if m.group("m"):
+            return self._by_month_day.get((int(m.group("m")), int(m.group("md"))))
+        if m.group("sm"):
+            return self._by_month_day.get((int(m.group("sm")), int(m.group("sd"))))
+        n = _cn_number(m.group("n")) if m.group("n") else int(m.group("dn"))
+        return self.days[n - 1] if 1 <= n <= len(self.days) else None
+
+    # 文本中第一个能定位到行程日期的引用
+    def match(self, text: str) -> Optional[str]:
+        for m in _DAY_REF.finditer(text):
+            day = self._resolve(m)
+            if day is not None:
+                return day
+        return None
+
+    # 文本中所有能定位到行程日期的引用（按出现顺序，可能重复）
+    def match_all(self, text: str) -> List[str]:
+        return [day for day in map(self._resolve, _DAY_REF.finditer(text)) if day is not None]
+
+
+_CURRENCY_HINTS = ("元", "¥", "￥", "块", "RMB", "CNY", "rmb", "cny")
+
+
+# 行内金额（取区间上限）；无金额返回 None。先用子串判断是否含货币标记，绝大多数行无需进入正则
+def parse_amount(text: str) -> Optional[float]:
+    if not any(hint in text for hint in _CURRENCY_HINTS):
+        return None
+    m = _AMOUNT.search(text)
+    if not m:
+        return None
+    value = (m.group("a2") or m.group("a")) if m.group("a") else (m.group("b2") or m.group("b"))
+    return float(value)
+
+
+def _heading(line: str) -> Optional[Tuple[int, str]]:
+    stripped = line.lstrip()
+    if not stripped or stripped[0] not in "#*":
+        return None
+    m = _HEADING.match(line)
+    if not m:
+        return None
+    if m.group(1):
+        return len(m.group(1)), m.group(2)
+    # 粗体行视为最低级标题
+    return 7, m.group(3)
+
+
+class ItineraryParser:
+    def __init__(self, days: List[str]):
+        self.days = list(days)
+        self.matcher = DayMatcher(self.days)
+        self.plans: Dict[str, Dict[str, Any]] = {}
+        self.emitted: set = set()
+        self.reset()
+
+    # 丢弃未完成的缓冲与当前段落（例如新一轮 LLM 调用从头输出），已解析出的日期保留
+    def reset(self) -> None:
+        self._buf = ""
+        self._active: Optional[str] = None
+        self._level = 0
+        self._section: Optional[str] = None
+
+    def _plan(self, day: str) -> Dict[str, Any]:
+        plan = self.plans.get(day)
+        if plan is None:
+            plan = self.plans[day] = {
+                "date": day, "activities": [], "meals": [], "costs": [], "notes": [],
+                "activity_costs": [], "cost_section": False,
+            }
+        return plan
+
+    # 逐块喂入文本，返回本次新完成的日期（按完成顺序）
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._buf += chunk
+        if "\n" not in self._buf:
+            return []
+        *lines, self._buf = self._buf.split("\n")
+        done: List[Dict[str, Any]] = []
+        for line in lines:
+            finished = self._line(line)
+            if finished is not None:
+                done.append(finished)
+        return done
+
+    # 输入结束：处理剩余缓冲并返回最后完成的日期
+    def close(self) -> List[Dict[str, Any]]:
+        done: List[Dict[str, Any]] = []
+        if self._buf:
+            finished = self._line(self._buf)
+            if finished is not None:
+                done.append(finished)
+            self._buf = ""
+        finished = self._finish()
+        if finished is not None:
+            done.append(finished)
+        return done
+
+    # 一次性解析完整文本
+    def parse(self, text: str) -> List[Dict[str, Any]]:
+        self.feed(text)
+        self.close()
+        return self.result()
+
+    # 按行程日期顺序输出全部日期（无内容的日期为空活动）
+    def result(self) -> List[Dict[str, Any]]:
+        return [_finalize(self.plans[d]) if d in self.plans else _finalize({"date": d}) for d in self.days]
+
+    def _finish(self) -> Optional[Dict[str, Any]]:
+        day = self._active
+        self._active, self._section = None, None
+        if day is None or day in self.emitted:
+            return None
+        self.emitted.add(day)
+        return _finalize(self.plans[day])
+
+    def _line(self, line: str) -> Optional[Dict[str, Any]]:
+        head = _heading(line)
+        if head is not None and head[0] == 7 and self._active is not None:
+            # 粗体行若是「标签：内容」（如 **午餐：知味观**）按内容行处理，而不是小节标题
+            label = _LABEL.match(head[1])
+            if label and label.group("rest").strip():
+                head, line = None, head[1]
+        if head is not None:
+            level, text = head
+            day = self.matcher.match(text)
+            if day is not None:
+                finished = self._finish() if day != self._active else None
+                self._active, self._level, self._section = day, level, None
+                self._plan(day)
+                return finished
+            if self._active is None:
+                return None
+            if level <= self._level and not _DAYPART.search(text):
+                # 同级或更高级的非日期标题（如「## 预算汇总」）结束当天
+                return self._finish()
+            # 当天内的小节标题（如「### 午餐推荐」「### 费用」）决定后续行的归类
+            section = _SECTION.search(text)
+            self._section = section.lastgroup if section else None
+            if self._section == "cost":
+                self.plans[self._active]["cost_section"] = True
+            return None
+
+        if self._active is None:
+            return None
+        text = line.strip()
+        if not text:
+            return None
+        if text[0] in "-*+•0123456789":
+            text = _LIST_MARK.sub("", text)
+            if text.startswith("-") and _TABLE_RULE.match(text):
+                return None
+        elif text[0] in "|:" and _TABLE_RULE.match(text):
+            return None
+        plan = self.plans[self._active]
+        # 标签行必含冒号，无冒号的行跳过标签匹配
+        label = _LABEL.match(text) if ("：" in text or ":" in text) else None
+        if label:
+            kind = "meal" if label.group("meal") else "cost" if label.group("cost") else "note"
+            value = label.group("rest").strip() or text
+            if kind == "meal" and self._section == "cost":
+                # 费用小节中的「午餐：80元」「餐饮：175元」是餐费明细
+                kind, value = "cost", text
+        else:
+            kind, value = self._section, text
+        if kind == "meal":
+            plan["meals"].append(value)
+            amount = parse_amount(value)
+            if amount is not None:
+                plan["activity_costs"].append(_cost(text, amount))
+        elif kind == "note":
+            plan["notes"].append(value)
+        elif kind == "cost":
+            plan["costs"].append(_cost(value, parse_amount(value)))
+        else:
+            plan["activities"].append(text)
+            amount = parse_amount(text)
+            if amount is not None:
+                plan["activity_costs"].append(_cost(text, amount))
+        return None
+
+
+def _cost(item: str, amount: Optional[float]) -> Dict[str, Any]:
+    if _TOTAL.search(item):
+        return {"item": item, "amount": amount, "total": True}
+    return {"item": item, "amount": amount}
+
+
+# 有费用小节的日期只保留小节与标签行中的费用；否则附上活动/用餐行中识别出的价格
+def _finalize(plan: Dict[str, Any]) -> Dict[str, Any]:
+    costs = list(plan.get("costs") or [])
+    if not plan.get("cost_section"):
+        costs.extend(plan.get("activity_costs") or [])
+    return {
+        "date": plan["date"],
+        "activities": list(plan.get("activities") or []),
+        "meals": list(plan.get("meals") or []) or None,
+        "costs": costs or None,
+        "notes": "\n".join(plan.get("notes") or []) or None,
+    }
+
+
+# 各天费用汇总为预算估计：累加明细金额，当天只有合计行时取最大的合计；没有可识别金额时返回 None
+def budget_from_days(days: List[Dict[str, Any]], currency: str = "CNY") -> Optional[Dict[str, Any]]:
+    per_day = {}
+    for day in days:
+        costs = [c for c in day.get("costs") or [] if c.get("amount") is not None]
+        items = [c["amount"] for c in costs if not c.get("total")]
+        totals = [c["amount"] for c in costs if c.get("total")]
+        if items:
+            per_day[day["date"]] = round(sum(items), 2)
+        elif totals:
+            per_day[day["date"]] = round(max(totals), 2)
+    if not per_day:
+        return None
+    return {"currency": currency, "total": round(sum(per_day.values()), 2), "per_day": per_day}
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import concurrent.futures
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import select, update
+
+from .config import JOB_POLL_INTERVAL, PLAN_QUEUE_MAX, PLAN_TIMEOUT, PLAN_WORKERS
+from .db import PlanJob, SessionLocal
+from .metrics import PLAN_JOBS, PLAN_JOBS_PENDING, PLANS_IN_FLIGHT
+
+# 任务执行函数：输入请求参数（及可选的进度接收端 progress），返回可 JSON 序列化的结果
+JobRunner = Callable[..., Dict[str, Any]]
+
+_runners: Dict[str, JobRunner] = {}
+_futures: Dict[str, concurrent.futures.Future] = {}
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+# 队列已满
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+# 注册某类任务的执行函数（例如 "plan"）
+def register_runner(kind: str, runner: JobRunner) -> None:
+    _runners[kind] = runner
+
+
+# 获取进程内共享的规划线程池（固定大小，所有请求共用）
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=PLAN_WORKERS, thread_name_prefix="plan-worker"
+            )
+        return _executor
+
+
+# 当前进程内排队与运行中的任务数
+def pending_count() -> int:
+    with _lock:
+        return sum(1 for f in _futures.values() if not f.done())
+
+
+PLAN_JOBS_PENDING.set_function(pending_count)
+
+
+def _to_dict(job: PlanJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "params": job.params,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _update(job_id: str, **fields: Any) -> None:
+    with SessionLocal() as db:
+        job = db.get(PlanJob, job_id)
+        if job is None:
+            return
+        for k, v in fields.items():
+            setattr(job, k, v)
+        db.commit()
+
+
+# 抢占任务：仅当任务仍为 queued 时置为 running，避免多个 worker 进程重复执行同一任务
+def _claim(job_id: str) -> bool:
+    with SessionLocal() as db:
+        res = db.execute(
+            update(PlanJob)
+            .where(PlanJob.id == job_id, PlanJob.status == "queued")
+            .values(status="running", started_at=datetime.utcnow())
+        )
+        db.commit()
+        return bool(res.rowcount)
+
+
+# 在线程池中执行任务，并把状态/结果写回任务表
+def _execute(job_id: str, kind: str, params: Dict[str, Any], progress: Any = None) -> Optional[Dict[str, Any]]:
+    if not _claim(job_id):
+        return None
+    try:
+        with PLANS_IN_FLIGHT.track_inprogress():
+            result = _runners[kind](params, progress=progress)
+    except Exception as e:
+        PLAN_JOBS.labels(kind, "failed").inc()
+        _update(job_id, status="failed", error=f"{type(e).__name__}: {e}", finished_at=datetime.utcnow())
+        raise
+    PLAN_JOBS.labels(kind, "succeeded").inc()
+    # 即使已被标记为超时，迟到的结果仍然保存，便于用户稍后取回
+    _update(job_id, status="succeeded", result=result, error=None, finished_at=datetime.utcnow())
+    return result
+
+
+def _enqueue(job_id: str, kind: str, params: Dict[str, Any], progress: Any = None) -> concurrent.futures.Future:
+    future = get_executor().submit(_execute, job_id, kind, params, progress)
+    with _lock:
+        _futures[job_id] = future
+    future.add_done_callback(lambda _f: _forget(job_id))
+    return future
+
+
+def _forget(job_id: str) -> None:
+    with _lock:
+        _futures.pop(job_id, None)
+
+
+# 提交任务：写入任务表后立即返回，实际执行交给共享线程池；progress 仅在本进程内有效，不持久化
+def submit_job(kind: str, params: Dict[str, Any], progress: Any = None) -> Dict[str, Any]:
+    if kind not in _runners:
+        raise KeyError(f"未注册的任务类型: {kind}")
+    if pending_count() >= PLAN_QUEUE_MAX:
+        raise JobQueueFullError("规划任务排队已满，请稍后重试")
+    job_id = uuid.uuid4().hex
+    with SessionLocal() as db:
+        job = PlanJob(id=job_id, kind=kind, status="queued", params=params)
+        db.add(job)
+        db.commit()
+        snapshot = _to_dict(job)
+    _enqueue(job_id, kind, params, progress)
+    return snapshot
+
+
+# 记录一个已完成的任务（例如命中结果缓存），不占用线程池
+def record_completed(kind: str, params: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        job = PlanJob(
+            id=uuid.uuid4().hex, kind=kind, status="succeeded", params=params,
+            result=result, started_at=now, finished_at=now,
+        )
+        db.add(job)
+        db.commit()
+        return _to_dict(job)
+
+
+# 同步等待某个任务完成；超时抛出 concurrent.futures.TimeoutError，任务失败抛出 RuntimeError。
+# 本进程提交且抢占成功的任务直接等待其 Future；抢占失败（任务已被其他 worker 执行）或任务不在本进程时，
+# 轮询任务表直到任务结束
+def wait_job(job_id: str, timeout: float = PLAN_TIMEOUT, poll: float = JOB_POLL_INTERVAL) -> Dict[str, Any]:
+    deadline = time.monotonic() + timeout
+    with _lock:
+        future = _futures.get(job_id)
+    if future is not None:
+        result = future.result(timeout=timeout)
+        if result is not None:
+            return result
+    while True:
+        job = get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job["status"] == "succeeded":
+            return job["result"]
+        if job["status"] not in ("queued", "running"):
+            raise RuntimeError(job["error"] or f"任务状态: {job['status']}")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise concurrent.futures.TimeoutError(f"任务 {job_id} 仍在{'排队' if job['status'] == 'queued' else '运行'}")
+        time.sleep(min(poll, remaining))
+
+
+# 查询任务；运行超过超时时间的任务标记为 timeout（线程无法强杀，结果若迟到仍会写回）
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with SessionLocal() as db:
+        job = db.get(PlanJob, job_id)
+        if job is None:
+            return None
+        if (
+            job.status == "running"
+            and job.started_at is not None
+            and datetime.utcnow() - job.started_at > timedelta(seconds=PLAN_TIMEOUT)
+        ):
+            job.status = "timeout"
+            job.error = f"规划超过 {PLAN_TIMEOUT}s 未完成"
+            db.commit()
+        return _to_dict(job)
+
+
+# 服务启动时恢复任务：排队中的任务重新入队；运行中且已超时的任务视为被重启中断
+# （未超时的 running 任务可能属于仍存活的其他 worker 进程，保持不动，超时后由 get_job 标记）
+def recover_jobs() -> int:
+    deadline = datetime.utcnow() - timedelta(seconds=PLAN_TIMEOUT)
+    with SessionLocal() as db:
+        jobs = db.execute(
+            select(PlanJob).where(PlanJob.status.in_(["queued", "running"]))
+        ).scalars().all()
+        todo = []
+        for job in jobs:
+            if job.status == "running":
+                if job.started_at is None or job.started_at < deadline:
+                    job.status = "failed"
+                    job.error = "服务重启，任务被中断"
+                    job.finished_at = datetime.utcnow()
+                continue
+            if job.kind not in _runners:
+                job.status = "failed"
+                job.error = "服务重启后无法恢复的任务类型"
+                job.finished_at = datetime.utcnow()
+                continue
+            todo.append((job.id, job.kind, dict(job.params)))
+        db.commit()
+    for job_id, kind, params in todo:
+        _enqueue(job_id, kind, params)
+    return len(todo)
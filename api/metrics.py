@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 轻量的 Prometheus 文本格式指标（无第三方依赖）：Counter / Gauge / Histogram，支持标签；
+# 所有指标注册在进程内的 REGISTRY，由 GET /metrics 以 text/plain; version=0.0.4 输出
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认分桶（秒）：覆盖毫秒级 DB 查询到分钟级的规划阶段
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 规划阶段/LLM 调用耗时分桶（秒）
+SLOW_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: Any, **kwvalues: Any) -> Any:
+        if kwvalues:
+            values = tuple(kwvalues[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    # HELP/TYPE 行使用的指标族名，需与样本名一致
+    @property
+    def family(self) -> str:
+        return self.name
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.family} {self.documentation}", f"# TYPE {self.family} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = float(value)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    # 计数器样本带 _total 后缀（与 prometheus_client 一致），HELP/TYPE 使用同一族名
+    @property
+    def family(self) -> str:
+        return f"{self.name}_total"
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            yield f"{self.family}{_labels_text(self.labelnames, key)} {_fmt(child.value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    # 采集时才计算的取值（例如当前排队任务数）
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._function = fn
+
+    @contextmanager
+    def track_inprogress(self, *labelvalues: Any):
+        child = self.labels(*labelvalues)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+    def _samples(self) -> Iterator[str]:
+        if self._function is not None:
+            try:
+                yield f"{self.name} {_fmt(float(self._function()))}"
+            except Exception:
+                pass
+            return
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            yield f"{self.name}{_labels_text(self.labelnames, key)} {_fmt(child.value)}"
+
+
+class _HistogramValue:
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if i < len(self.counts):
+                self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                yield f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {count}"
+            yield f"{self.name}_sum{_labels_text(self.labelnames, key)} {_fmt(total)}"
+            yield f"{self.name}_count{_labels_text(self.labelnames, key)} {count}"
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# --- 服务指标 ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "trip_http_request_duration_seconds", "HTTP 请求耗时（流式响应为首字节耗时）", ("method", "route", "status"),
+)
+PLAN_STAGE_SECONDS = Histogram(
+    "trip_crew_stage_duration_seconds", "规划各阶段（identify/gather/plan）任务耗时", ("stage", "outcome"), buckets=SLOW_BUCKETS,
+)
+PLANS_IN_FLIGHT = Gauge("trip_plans_in_flight", "正在运行的规划任务数")
+PLAN_JOBS_PENDING = Gauge("trip_plan_jobs_pending", "本进程内排队与运行中的规划任务数")
+PLAN_JOBS = Counter("trip_plan_jobs", "规划任务结束次数", ("kind", "outcome"))
+LLM_CALLS = Counter("trip_llm_calls", "LLM 调用次数（cache 为补全缓存/回放命中）", ("role", "model", "source"))
+LLM_SECONDS = Histogram("trip_llm_call_duration_seconds", "LLM 调用耗时（不含缓存命中）", ("role", "model"), buckets=SLOW_BUCKETS)
+LLM_TOKENS = Counter("trip_llm_tokens", "LLM token 用量", ("role", "model", "type"))
+TOOL_CALLS = Counter("trip_tool_calls", "工具调用次数", ("tool", "status"))
+TOOL_SECONDS = Histogram("trip_tool_call_duration_seconds", "工具调用耗时", ("tool",))
+DB_QUERY_SECONDS = Histogram(
+    "trip_db_query_duration_seconds", "数据库语句耗时", ("operation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+# 记录一次工具调用：块内将 status 改为 error/cache 等即可区分结果，抛出异常计为 error
+@contextmanager
+def track_tool(tool: str):
+    outcome = {"status": "ok"}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except Exception:
+        outcome["status"] = "error"
+        raise
+    finally:
+        TOOL_SECONDS.labels(tool).observe(time.perf_counter() - start)
+        TOOL_CALLS.labels(tool, outcome["status"]).inc()
+
+
+# 为 SQLAlchemy 引擎挂载语句计时（按 SELECT/INSERT/UPDATE/... 分类）
+def instrument_engine(engine: Any) -> None:
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("query_start")
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.labels(operation).observe(elapsed)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from passlib.context import CryptContext
+
+# 口令哈希（单独成模块：进程池子进程只需导入 passlib，不会加载 FastAPI/数据库引擎）
+# 使用 PBKDF2-SHA256 以避免 bcrypt 在部分环境的兼容问题与 72 字节限制
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+
+# 密码加密
+def hash_password(raw: str) -> str:
+    return pwd_context.hash(raw)
+
+
+# 密码验证
+def verify_password(raw: str, hashed: str) -> bool:
+    return pwd_context.verify(raw, hashed)
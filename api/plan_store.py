@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import random
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from .cache import TieredCache
+from .config import PLAN_SAVE_BACKOFF, PLAN_SAVE_RETRIES, PLAN_SNAPSHOT_EVERY, PLAN_STORE_MODE, PLAN_VERSION_CACHE_SIZE
+from .db import Plan, PlanVersion, SessionLocal, init_db, json_size
+
+# 计划版本存储：delta 模式下每个版本只保存相对上一版本的 JSON Patch（RFC 6902 的 add/remove/replace），
+# 每 PLAN_SNAPSHOT_EVERY 个版本写一次完整快照；读取时从最近的快照（或已缓存的版本）顺序重放补丁
+
+# 重建后的版本数据（版本不可变，无需失效）；键为 "plan_id:version"
+version_cache = TieredCache("plan_versions", ttl=7 * 24 * 3600, max_entries=PLAN_VERSION_CACHE_SIZE, disk=False)
+
+
+# 补丁无法应用（数据链断裂或被手工修改）
+class PatchError(ValueError):
+    pass
+
+
+def _cache_key(plan_id: int, version: int) -> str:
+    return f"{plan_id}:{version}"
+
+
+def _escape(token: Any) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+# 区分类型的深度相等：1、True 与 1.0 在 Python 中相等，但在 JSON 中是不同的值，重放后必须还原为原类型
+def _same(a: Any, b: Any) -> bool:
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b, strict=True))
+    return a == b
+
+
+# 生成把 old 变为 new 的补丁：字典逐键比较，等长列表逐项比较，不等长列表比较公共前缀后在尾部追加/删除
+def diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    if type(old) is not type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+    if isinstance(old, dict):
+        ops: List[Dict[str, Any]] = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            sub = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": sub, "value": value})
+            elif not _same(old[key], value):
+                ops.extend(diff(old[key], value, sub))
+        return ops
+    if isinstance(old, list):
+        ops = []
+        common = min(len(old), len(new))
+        for i in range(common):
+            if not _same(old[i], new[i]):
+                ops.extend(diff(old[i], new[i], f"{path}/{i}"))
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+        for value in new[common:]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+        return ops
+    if old != new:
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+
+# 原地应用补丁；返回新的文档（根路径 replace 时为新对象）
+def apply_patch(doc: Any, patch: Iterable[Dict[str, Any]]) -> Any:
+    for op in patch:
+        path = op["path"]
+        if path == "":
+            if op["op"] != "replace":
+                raise PatchError(f"不支持对根路径执行 {op['op']}")
+            doc = copy.deepcopy(op["value"])
+            continue
+        tokens = [_unescape(t) for t in path.split("/")[1:]]
+        parent = doc
+        try:
+            for token in tokens[:-1]:
+                parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+            last = tokens[-1]
+            if isinstance(parent, list):
+                if op["op"] == "add":
+                    value = copy.deepcopy(op["value"])
+                    if last == "-":
+                        parent.append(value)
+                    else:
+                        parent.insert(int(last), value)
+                elif op["op"] == "remove":
+                    del parent[int(last)]
+                elif op["op"] == "replace":
+                    parent[int(last)] = copy.deepcopy(op["value"])
+                else:
+                    raise PatchError(f"不支持的操作: {op['op']}")
+            else:
+                if op["op"] in ("add", "replace"):
+                    parent[last] = copy.deepcopy(op["value"])
+                elif op["op"] == "remove":
+                    del parent[last]
+                else:
+                    raise PatchError(f"不支持的操作: {op['op']}")
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            if isinstance(e, PatchError):
+                raise
+            raise PatchError(f"补丁路径无效: {path}") from e
+    return doc
+
+
+# 按版本号批量读取完整数据：一次范围查询取出 [最近快照, 最大版本] 之间的行，顺序重放，
+# 途中命中缓存的版本直接作为起点；返回 {version: data}
+def load_versions(db: Session, plan_id: int, versions: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    wanted = sorted(set(versions))
+    result: Dict[int, Dict[str, Any]] = {}
+    missing: List[int] = []
+    for v in wanted:
+        hit = version_cache.get(_cache_key(plan_id, v))
+        if hit is not None:
+            result[v] = copy.deepcopy(hit)
+        else:
+            missing.append(v)
+    if not missing:
+        return result
+
+    lowest, highest = missing[0], missing[-1]
+    start = db.scalar(
+        select(PlanVersion.version)
+        .where(PlanVersion.plan_id == plan_id, PlanVersion.version <= lowest, PlanVersion.kind == "full")
+        .order_by(PlanVersion.version.desc())
+        .limit(1)
+    )
+    if start is None:
+        raise PatchError(f"计划 {plan_id} 的版本 {lowest} 之前没有完整快照")
+    rows = db.execute(
+        select(PlanVersion.version, PlanVersion.kind, PlanVersion.base_version, PlanVersion.data)
+        .where(PlanVersion.plan_id == plan_id, PlanVersion.version >= start, PlanVersion.version <= highest)
+        .order_by(PlanVersion.version)
+    ).all()
+
+    need = set(missing)
+    current: Optional[Dict[str, Any]] = None
+    current_version: Optional[int] = None
+    for version, kind, base_version, data in rows:
+        if kind == "full":
+            current = copy.deepcopy(data)
+        else:
+            if current is None or current_version != base_version:
+                cached = version_cache.get(_cache_key(plan_id, base_version)) if base_version is not None else None
+                if cached is None:
+                    raise PatchError(f"计划 {plan_id} 版本 {version} 的基准版本 {base_version} 不可用")
+                current = copy.deepcopy(cached)
+            current = apply_patch(current, (data or {}).get("patch", []))
+        current_version = version
+        if version in need:
+            version_cache.set(_cache_key(plan_id, version), copy.deepcopy(current))
+            result[version] = copy.deepcopy(current)
+    for v in missing:
+        if v not in result:
+            raise PatchError(f"计划 {plan_id} 的版本 {v} 不存在")
+    return result
+
+
+def load_version(db: Session, plan_id: int, version: int) -> Dict[str, Any]:
+    return load_versions(db, plan_id, [version])[version]
+
+
+# 决定新版本的存储形式：返回 (kind, base_version, stored_data)
+def encode_version(db: Session, plan_id: int, version: int, data: Dict[str, Any], mode: str = PLAN_STORE_MODE) -> tuple:
+    if mode != "delta" or version <= 1 or (version - 1) % PLAN_SNAPSHOT_EVERY == 0:
+        return "full", None, data
+    base = version - 1
+    try:
+        previous = load_version(db, plan_id, base)
+    except PatchError:
+        # 上一版本尚不可见（例如并发写入）或链断裂：退化为完整快照，保证可重建
+        return "full", None, data
+    patch = diff(previous, data)
+    # 补丁不比完整数据小很多时直接存快照，缩短后续重建链
+    if json_size(patch) * 2 >= json_size(data):
+        return "full", None, data
+    return "delta", base, {"patch": patch}
+
+
+# 在当前事务内追加一个版本（不提交）：原子地递增 plans.latest_version 并取得新版本号，
+# 行锁保证并发保存不会拿到相同版本号，版本行与计划的冗余字段在调用方提交时一同生效
+def _append_in_txn(db: Session, plan_id: int, data: Dict[str, Any], notes: Optional[str], rating: Optional[int]) -> int:
+    now = datetime.utcnow()
+    db.execute(
+        update(Plan)
+        .where(Plan.id == plan_id)
+        .values(latest_version=Plan.latest_version + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    next_ver = int(db.scalar(select(Plan.latest_version).where(Plan.id == plan_id)))
+    kind, base_version, stored = encode_version(db, plan_id, next_ver, data)
+    db.add(PlanVersion(
+        plan_id=plan_id, version=next_ver, data=stored, kind=kind, base_version=base_version,
+        notes=notes, rating=rating, size=json_size(data),
+    ))
+    return next_ver
+
+
+# 追加一个版本并提交
+def append_version(db: Session, plan: Plan, data: Dict[str, Any], notes: Optional[str] = None, rating: Optional[int] = None) -> int:
+    plan_id = plan.id
+    next_ver = _append_in_txn(db, plan_id, data, notes, rating)
+    db.commit()
+    version_cache.set(_cache_key(plan_id, next_ver), copy.deepcopy(data))
+    return next_ver
+
+
+# MySQL 死锁（1213）与锁等待超时（1205）
+_MYSQL_LOCK_ERRORS = (1205, 1213)
+
+
+# 可重试的写冲突：唯一约束冲突、MySQL 死锁/锁等待超时、SQLite 的 database is locked
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, IntegrityError):
+        return True
+    if not isinstance(exc, OperationalError):
+        return False
+    orig = exc.orig
+    if orig is not None and orig.args and orig.args[0] in _MYSQL_LOCK_ERRORS:
+        return True
+    msg = str(orig).lower()
+    return "database is locked" in msg or "deadlock" in msg or "lock wait timeout" in msg
+
+
+# 第 attempt 次重试前的等待时长：指数退避加随机抖动，错开并发写入
+def retry_delay(attempt: int) -> float:
+    return PLAN_SAVE_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+# 单事务保存：按 (user_id, title) 查找或创建计划（flush 取得 id）、递增版本号、写入版本行，只提交一次。
+# data 为 None 时以该计划的最新版本为基础（新计划为空文档）；merge 在写入前对基础数据做修改（如合并多日地图编辑）。
+# 已有计划先加行锁（SELECT ... FOR UPDATE），基于最新版本合并时不会与并发保存交错；
+# 唯一约束冲突、死锁或锁等待超时（见 is_retryable）时回滚，退避后重试；返回 (plan_id, version)
+def save_version(
+    db: Session,
+    user_id: int,
+    title: str,
+    data: Optional[Dict[str, Any]],
+    notes: Optional[str] = None,
+    rating: Optional[int] = None,
+    merge: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    retries: int = PLAN_SAVE_RETRIES,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Tuple[int, int]:
+    for attempt in range(retries + 1):
+        try:
+            row = db.execute(
+                select(Plan.id, Plan.latest_version)
+                .where(Plan.user_id == user_id, Plan.title == title)
+                .with_for_update()
+            ).first()
+            if row is None:
+                plan = Plan(user_id=user_id, title=title)
+                db.add(plan)
+                db.flush()
+                plan_id, latest = plan.id, 0
+            else:
+                plan_id, latest = row[0], int(row[1] or 0)
+            doc = copy.deepcopy(data) if data is not None else (load_version(db, plan_id, latest) if latest > 0 else {})
+            if merge is not None:
+                doc = merge(doc)
+            next_ver = _append_in_txn(db, plan_id, doc, notes, rating)
+            db.commit()
+        except (IntegrityError, OperationalError) as e:
+            db.rollback()
+            if attempt >= retries or not is_retryable(e):
+                raise
+            sleep(retry_delay(attempt))
+            continue
+        version_cache.set(_cache_key(plan_id, next_ver), copy.deepcopy(doc))
+        return plan_id, next_ver
+    raise RuntimeError("unreachable")
+
+
+# 迁移已有版本：按版本顺序重建完整数据后，以目标模式（delta/full）重写每一行
+def migrate_plan(db: Session, plan_id: int, mode: str, dry_run: bool = False) -> Dict[str, int]:
+    rows = db.execute(
+        select(PlanVersion).where(PlanVersion.plan_id == plan_id).order_by(PlanVersion.version)
+    ).scalars().all()
+    docs = load_versions(db, plan_id, [r.version for r in rows]) if rows else {}
+    stats = {"versions": len(rows), "bytes_before": 0, "bytes_after": 0}
+    previous: Optional[Dict[str, Any]] = None
+    for row in rows:
+        stats["bytes_before"] += json_size(row.data)
+        doc = docs[row.version]
+        if mode == "delta" and previous is not None and (row.version - 1) % PLAN_SNAPSHOT_EVERY != 0 and row.version - 1 in docs:
+            patch = diff(previous, doc)
+            if json_size(patch) * 2 < json_size(doc):
+                kind, base_version, stored = "delta", row.version - 1, {"patch": patch}
+            else:
+                kind, base_version, stored = "full", None, doc
+        else:
+            kind, base_version, stored = "full", None, doc
+        stats["bytes_after"] += json_size(stored)
+        if not dry_run:
+            row.kind, row.base_version, row.data, row.size = kind, base_version, stored, json_size(doc)
+        previous = doc
+    if not dry_run:
+        db.commit()
+    return stats
+
+
+def _cli(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(prog="python -m api.plan_store", description="计划版本存储工具")
+    sub = ap.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="将已有版本改写为 delta（或 full）存储")
+    mig.add_argument("--to", choices=["delta", "full"], default="delta")
+    mig.add_argument("--plan-id", type=int, action="append", help="只迁移指定计划，可重复")
+    mig.add_argument("--dry-run", action="store_true", help="只统计迁移前后的存储字节数，不写入")
+    args = ap.parse_args(argv)
+
+    init_db()
+    with SessionLocal() as db:
+        plan_ids = args.plan_id or list(db.scalars(select(Plan.id).order_by(Plan.id)))
+    total = {"plans": 0, "versions": 0, "bytes_before": 0, "bytes_after": 0}
+    for plan_id in plan_ids:
+        with SessionLocal() as db:
+            try:
+                stats = migrate_plan(db, plan_id, args.to, dry_run=args.dry_run)
+            except PatchError as e:
+                db.rollback()
+                print(f"计划 {plan_id} 跳过：{e}")
+                continue
+        total["plans"] += 1
+        for k in ("versions", "bytes_before", "bytes_after"):
+            total[k] += stats[k]
+        print(f"计划 {plan_id}: {stats['versions']} 个版本，{stats['bytes_before']} -> {stats['bytes_after']} 字节")
+    print(json.dumps(total, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    _cli()
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .itinerary_parser import DayMatcher
+
+# 增量再规划：根据反馈与输入变化决定重跑范围，并把只重写的日期拼回上一版行程
+#   full  ：出发地/目的地/日期变化，完整重跑 identify -> gather -> plan
+#   guide ：目的地不变、兴趣变化，复用目的地报告，重跑城市指南与行程规划
+#   plan  ：只重跑行程规划（复用目的地报告与城市指南）
+#   days  ：只重写反馈涉及的日期，其余日期原样保留
+
+STAGES = ("identify", "gather", "plan")
+
+_SPLIT_CITIES = re.compile(r"[,，、;；]+")
+_SPLIT_INTERESTS = re.compile(r"[,，、;；/|\s]+")
+_DEST_CHANGE = re.compile(r"(换|改|不去|别去).{0,8}(城市|目的地)|目的地.{0,4}(换|改)|(改去|换去|改成去|换成去)")
+_DATE_CHANGE = re.compile(r"提前|推迟|延后|延期|改期|延长|缩短|(多|少|加|减)(玩|待|住)?[一两1-9]\s*天")
+_ISO_DATE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_HEADING = re.compile(r"^\s*(#{1,6})\s")
+
+
+# 上一版本的规划输入：新版本保存在 data["request"]，旧版本退回前端写入的 meta；缺少必要字段时返回 None
+def previous_request(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    source = data.get("request") or data.get("meta") or {}
+    req = {k: source.get(k) for k in ("origin", "cities", "date_range", "interests")}
+    if not req["origin"] or not req["cities"] or not req["date_range"]:
+        return None
+    return req
+
+
+def _iso(match: re.Match) -> str:
+    return f"{int(match.group(1)):04d}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
+
+
+# 反馈中提到的日期（写法同行程标题：2025-10-02、10月2日、10/02、第二天、Day 2 等），按行程顺序返回，只保留行程内的日期
+def mentioned_days(feedback: str, plan_days: List[str]) -> List[str]:
+    hits = set(DayMatcher(plan_days).match_all(feedback))
+    return [d for d in plan_days if d in hits]
+
+
+def _city_set(cities: Optional[str]) -> set:
+    return {c.strip().casefold() for c in _SPLIT_CITIES.split(cities or "") if c.strip()}
+
+
+def _interest_set(interests: Optional[str]) -> set:
+    return {t.casefold() for t in _SPLIT_INTERESTS.split(interests or "") if t}
+
+
+def _same_cities(a: str, b: str) -> bool:
+    return _city_set(a) == _city_set(b)
+
+
+def _same_interests(a: Optional[str], b: Optional[str]) -> bool:
+    return _interest_set(a) == _interest_set(b)
+
+
+# 选择重跑范围；返回 (mode, 需重写的日期)
+def choose_mode(
+    prev_req: Dict[str, Any],
+    new_req: Dict[str, Any],
+    stages: Optional[Dict[str, Any]],
+    feedback: str,
+    plan_days: List[str],
+    prev_days: List[str],
+    days: Optional[List[str]] = None,
+) -> Tuple[str, List[str]]:
+    if not stages or not all(stages.get(k) for k in STAGES):
+        return "full", []
+    if (prev_req["origin"] or "").strip().casefold() != (new_req["origin"] or "").strip().casefold():
+        return "full", []
+    if not _same_cities(prev_req["cities"], new_req["cities"]) or plan_days != prev_days:
+        return "full", []
+    if _DEST_CHANGE.search(feedback) or _DATE_CHANGE.search(feedback):
+        return "full", []
+    if any(_iso(m) not in plan_days for m in _ISO_DATE.finditer(feedback)):
+        return "full", []
+    if not _same_interests(prev_req.get("interests"), new_req.get("interests")):
+        return "guide", []
+    affected = [d for d in plan_days if d in set(days)] if days else mentioned_days(feedback, plan_days)
+    if affected and len(affected) < len(plan_days):
+        return "days", affected
+    return "plan", []
+
+
+# 按含日期/天数的标题（识别规则同行程解析器）切分 Markdown：返回 [(date, start, end)]，区间为行号 [start, end)；
+# 一天的段落持续到下一个同级或更高级的标题（或下一个含日期的标题）为止
+def _day_sections(lines: List[str], plan_days: List[str]) -> List[Tuple[str, int, int]]:
+    matcher = DayMatcher(plan_days)
+    marks = []
+    for i, line in enumerate(lines):
+        m = _HEADING.match(line)
+        if not m:
+            continue
+        marks.append((i, len(m.group(1)), matcher.match(line)))
+    sections = []
+    for idx, (start, level, day) in enumerate(marks):
+        if day is None:
+            continue
+        end = len(lines)
+        for nxt, nxt_level, nxt_day in marks[idx + 1:]:
+            if nxt_level <= level or nxt_day is not None:
+                end = nxt
+                break
+        sections.append((day, start, end))
+    return sections
+
+
+# 把模型只重写的若干天切分为 {date: 段落文本}
+def split_day_sections(markdown: str, plan_days: List[str]) -> Dict[str, str]:
+    lines = markdown.splitlines()
+    out: Dict[str, str] = {}
+    for day, start, end in _day_sections(lines, plan_days):
+        out.setdefault(day, "\n".join(lines[start:end]).rstrip())
+    return out
+
+
+# 用新段落替换上一版行程中对应日期的段落；上一版找不到的日期追加到末尾
+def splice_days(markdown: str, plan_days: List[str], replacements: Dict[str, str]) -> str:
+    lines = markdown.splitlines()
+    done = set()
+    pieces: List[str] = []
+    cursor = 0
+    for day, start, end in _day_sections(lines, plan_days):
+        if day not in replacements or day in done:
+            continue
+        pieces.extend(lines[cursor:start])
+        pieces.extend(replacements[day].splitlines())
+        pieces.append("")
+        cursor = end
+        done.add(day)
+    pieces.extend(lines[cursor:])
+    for day in plan_days:
+        if day in replacements and day not in done:
+            pieces.extend(["", *replacements[day].splitlines()])
+    return "\n".join(pieces).rstrip() + "\n"
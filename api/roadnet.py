@@ -0,0 +1,412 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import ROADNET_DIR, ROADNET_GRID_DEG, ROADNET_MAX_SNAP_M, ROUTE_SPEED_KMH
+
+logger = logging.getLogger(__name__)
+
+# 离线路网：把 OSM 道路数据预处理为按出行方式划分的 CSR 邻接数组（.npy），运行时以 mmap 只读加载，
+# 多个 uvicorn worker 共享同一份页缓存。查询为双向 A*（平均势函数，边权为通行秒数），
+# 站点通过网格索引吸附到最近的可通行节点。
+# 目录结构（ROADNET_DIR）：
+#   meta.json                               版本、节点/边数、范围、构建时间
+#   lat.npy / lng.npy                       节点坐标（float64，度）
+#   xyz.npy                                 节点地心直角坐标（米），A* 启发用弦长（不超过大圆距离，可采纳）
+#   grid_keys.npy / grid_ptr.npy / grid_nodes.npy   节点网格索引（按格子排序）
+#   {mode}_indptr.npy / _indices.npy / _seconds.npy / _meters.npy       正向邻接
+#   {mode}_rindptr.npy / _rindices.npy / _rseconds.npy / _rmeters.npy   反向邻接（双向搜索的后向部分）
+
+# 文件格式变化时递增；旧格式目录需重新构建
+ROADNET_VERSION = 1
+MODES = ("walking", "driving")
+EARTH_RADIUS_M = 6371008.8
+
+# 驾车：道路等级 -> 默认车速（km/h），未列出的等级不可驾车
+DRIVE_SPEEDS = {
+    "motorway": 100.0, "motorway_link": 50.0, "trunk": 80.0, "trunk_link": 40.0,
+    "primary": 60.0, "primary_link": 35.0, "secondary": 50.0, "secondary_link": 30.0,
+    "tertiary": 40.0, "tertiary_link": 25.0, "unclassified": 30.0, "residential": 25.0,
+    "living_street": 10.0, "service": 15.0, "road": 30.0,
+}
+# 步行：排除的道路等级（其余 highway 均可步行）
+WALK_EXCLUDED = {"motorway", "motorway_link", "trunk", "trunk_link", "construction", "proposed", "raceway", "bus_guideway", "abandoned"}
+_NO = {"no", "private"}
+_YES = {"yes", "true", "1"}
+
+
+def _parse_speed(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    text = value.strip().lower()
+    try:
+        if text.endswith("mph"):
+            return float(text[:-3].strip()) * 1.609344
+        return float(text.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+# 一条 OSM way 在各出行方式下的通行规则：{mode: (正向可行, 反向可行, 速度 km/h)}
+def edge_rules(tags: Dict[str, str]) -> Dict[str, Tuple[bool, bool, float]]:
+    highway = tags.get("highway")
+    if not highway or tags.get("area") == "yes":
+        return {}
+    rules: Dict[str, Tuple[bool, bool, float]] = {}
+    access = tags.get("access")
+    if highway not in WALK_EXCLUDED and tags.get("foot") not in _NO and (access not in _NO or tags.get("foot") in _YES):
+        rules["walking"] = (True, True, ROUTE_SPEED_KMH["walking"])
+    if highway in DRIVE_SPEEDS and access not in _NO and tags.get("motor_vehicle") not in _NO:
+        oneway = tags.get("oneway", "").lower()
+        implied = highway in ("motorway", "motorway_link") or tags.get("junction") == "roundabout"
+        if oneway == "-1":
+            fwd, bwd = False, True
+        elif oneway in _YES or (implied and oneway != "no"):
+            fwd, bwd = True, False
+        else:
+            fwd, bwd = True, True
+        speed = _parse_speed(tags.get("maxspeed")) or DRIVE_SPEEDS[highway]
+        rules["driving"] = (fwd, bwd, speed)
+    return rules
+
+
+# 流式解析 OSM XML：返回 (节点坐标 {id: (lat, lng)}, [(节点引用, 标签)])，只保留道路
+def parse_osm(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[List[int], Dict[str, str]]]]:
+    coords: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], Dict[str, str]]] = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if "highway" in tags:
+                ways.append(([int(nd.get("ref")) for nd in elem.iter("nd")], tags))
+            elem.clear()
+        elif elem.tag == "relation":
+            elem.clear()
+    return coords, ways
+
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    h = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _csr(n: int, src: np.ndarray, dst: np.ndarray, *weights: np.ndarray):
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return (indptr, dst[order].astype(np.int32), *(w[order] for w in weights))
+
+
+def _grid_key(lat, lng, cell: float):
+    iy = np.floor((np.asarray(lat) + 90.0) / cell).astype(np.int64)
+    ix = np.floor((np.asarray(lng) + 180.0) / cell).astype(np.int64)
+    return iy * (1 << 32) + ix
+
+
+# 由节点与道路构建路网文件；返回 meta
+def build(
+    coords: Dict[int, Tuple[float, float]],
+    ways: Iterable[Tuple[Sequence[int], Dict[str, str]]],
+    out_dir: str = ROADNET_DIR,
+    grid_deg: float = ROADNET_GRID_DEG,
+) -> Dict[str, Any]:
+    ids: Dict[int, int] = {}
+    edges: Dict[str, Tuple[List[int], List[int], List[float]]] = {m: ([], [], []) for m in MODES}
+    for refs, tags in ways:
+        rules = edge_rules(tags)
+        if not rules:
+            continue
+        refs = [r for r in refs if r in coords]
+        for a, b in itertools.pairwise(refs):
+            if a == b:
+                continue
+            ia = ids.setdefault(a, len(ids))
+            ib = ids.setdefault(b, len(ids))
+            for mode, (fwd, bwd, speed) in rules.items():
+                src, dst, spd = edges[mode]
+                for u, v, ok in ((ia, ib, fwd), (ib, ia, bwd)):
+                    if ok:
+                        src.append(u)
+                        dst.append(v)
+                        spd.append(speed)
+    if not ids:
+        raise ValueError("no routable ways found")
+
+    n = len(ids)
+    lat = np.empty(n, dtype=np.float64)
+    lng = np.empty(n, dtype=np.float64)
+    for osm_id, idx in ids.items():
+        lat[idx], lng[idx] = coords[osm_id]
+
+    os.makedirs(out_dir, exist_ok=True)
+    # meta.json 最后写入：构建中途的目录不会被加载
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(out_dir, "meta.json"))
+    phi, lam = np.radians(lat), np.radians(lng)
+    xyz = EARTH_RADIUS_M * np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+    arrays: Dict[str, np.ndarray] = {"lat": lat, "lng": lng, "xyz": xyz}
+    keys = _grid_key(lat, lng, grid_deg)
+    order = np.argsort(keys, kind="stable")
+    grid_keys, starts = np.unique(keys[order], return_index=True)
+    arrays["grid_keys"] = grid_keys
+    arrays["grid_ptr"] = np.append(starts, n).astype(np.int64)
+    arrays["grid_nodes"] = order.astype(np.int32)
+
+    edge_counts = {}
+    for mode in MODES:
+        src = np.asarray(edges[mode][0], dtype=np.int64)
+        dst = np.asarray(edges[mode][1], dtype=np.int64)
+        speed = np.asarray(edges[mode][2], dtype=np.float64)
+        meters = _haversine_m(lat[src], lng[src], lat[dst], lng[dst]) if len(src) else np.zeros(0)
+        seconds = meters / (speed / 3.6) if len(src) else np.zeros(0)
+        meters, seconds = meters.astype(np.float32), seconds.astype(np.float32)
+        fwd = _csr(n, src, dst, seconds, meters)
+        rev = _csr(n, dst, src, seconds, meters)
+        for prefix, (indptr, indices, sec, met) in (("", fwd), ("r", rev)):
+            arrays[f"{mode}_{prefix}indptr"] = indptr
+            arrays[f"{mode}_{prefix}indices"] = indices
+            arrays[f"{mode}_{prefix}seconds"] = sec
+            arrays[f"{mode}_{prefix}meters"] = met
+        edge_counts[mode] = int(len(src))
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+
+    meta = {
+        "version": ROADNET_VERSION,
+        "nodes": n,
+        "edges": edge_counts,
+        "bbox": [float(lat.min()), float(lng.min()), float(lat.max()), float(lng.max())],
+        "grid_deg": grid_deg,
+        "built_at": time.time(),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class RoadGraph:
+    def __init__(self, path: str = ROADNET_DIR):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != ROADNET_VERSION:
+            raise ValueError(f"roadnet format {self.meta.get('version')} != {ROADNET_VERSION}, rebuild required")
+        self.path = path
+        # np.asarray 去掉 memmap 子类的开销，底层仍是 mmap 映射，不复制数据
+        def load(name: str) -> np.ndarray:
+            return np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+        self.lat, self.lng, self.xyz = load("lat"), load("lng"), load("xyz")
+        self.grid_keys, self.grid_ptr, self.grid_nodes = load("grid_keys"), load("grid_ptr"), load("grid_nodes")
+        self.adj = {}
+        for mode in MODES:
+            self.adj[mode] = tuple(
+                tuple(load(f"{mode}_{prefix}{part}") for part in ("indptr", "indices", "seconds", "meters"))
+                for prefix in ("", "r")
+            )
+        # 各方式路网中的最快速度（m/s），用于 A* 的可采纳启发；按实际数据取值，启发越紧搜索范围越小
+        self.max_speed = {"walking": ROUTE_SPEED_KMH["walking"] / 3.6, "driving": max(DRIVE_SPEEDS.values()) / 3.6}
+        for mode in MODES:
+            sec, met = self.adj[mode][0][2], self.adj[mode][0][3]
+            if len(sec):
+                self.max_speed[mode] = float((met / np.maximum(sec, 1e-6)).max()) * 1.0001
+
+    @property
+    def key(self) -> str:
+        return f"{self.meta['version']}:{self.meta['built_at']}"
+
+    # 最近的可通行节点（在该方式下有出边或入边）；超出 max_m 返回 None
+    def nearest(self, lat: float, lng: float, mode: str, max_m: float = ROADNET_MAX_SNAP_M) -> Optional[int]:
+        cell = self.meta["grid_deg"]
+        (indptr, _, _, _), (rindptr, _, _, _) = self.adj[mode]
+        key = int(_grid_key(lat, lng, cell))
+        rings = max(1, math.ceil(max_m / (cell * 111320.0 * max(math.cos(math.radians(lat)), 0.01))))
+        best, best_d = None, max_m
+        for r in range(rings + 1):
+            cand = []
+            for dy in range(-r, r + 1):
+                for dx in range(-r, r + 1):
+                    if max(abs(dy), abs(dx)) != r:
+                        continue
+                    k = key + dy * (1 << 32) + dx
+                    i = int(np.searchsorted(self.grid_keys, k))
+                    if i < len(self.grid_keys) and self.grid_keys[i] == k:
+                        cand.append(self.grid_nodes[self.grid_ptr[i]:self.grid_ptr[i + 1]])
+            if cand:
+                nodes = np.concatenate(cand).astype(np.int64)
+                routable = (indptr[nodes + 1] > indptr[nodes]) | (rindptr[nodes + 1] > rindptr[nodes])
+                nodes = nodes[routable]
+                if len(nodes):
+                    d = _haversine_m(lat, lng, self.lat[nodes], self.lng[nodes])
+                    k = int(np.argmin(d))
+                    if d[k] < best_d:
+                        best, best_d = int(nodes[k]), float(d[k])
+            # 已找到的节点比下一圈格子更近时即可停止
+            if best is not None and best_d <= r * cell * 111320.0 * max(math.cos(math.radians(lat)), 0.01):
+                break
+        return best
+
+    # 双向 A*：返回 (节点序列, 秒, 米, 出堆节点数)；不可达返回 None
+    def search(self, s: int, t: int, mode: str, use_potential: bool = True):
+        if s == t:
+            return [s], 0.0, 0.0, 0
+        xyz = self.xyz
+        inv = 1.0 / (2 * self.max_speed[mode]) if use_potential else 0.0
+        sx, sy, sz = xyz[s].tolist()
+        tx, ty, tz = xyz[t].tolist()
+        # 平均势函数 p(v) = (h(v,t) - h(s,v)) / 2，h 为弦长 / 最快速度；正反两个方向的约化边权均非负
+        h_st = math.dist((sx, sy, sz), (tx, ty, tz)) * inv
+        potentials: Dict[int, float] = {s: h_st, t: -h_st}
+
+        graphs = self.adj[mode]
+        dist: Tuple[Dict[int, float], Dict[int, float]] = ({s: 0.0}, {t: 0.0})
+        parent: Tuple[Dict[int, int], Dict[int, int]] = ({s: -1}, {t: -1})
+        heaps = ([(0.0, s)], [(0.0, t)])
+        done: Tuple[set, set] = (set(), set())
+        best, meet = math.inf, -1
+        settled = 0
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            d, u = heapq.heappop(heaps[side])
+            if u in done[side]:
+                continue
+            done[side].add(u)
+            settled += 1
+            indptr, indices, seconds, _ = graphs[side]
+            sign = 1.0 if side == 0 else -1.0
+            pu = potentials[u]
+            mine, other, prev, heap = dist[side], dist[1 - side], parent[side], heaps[side]
+            lo, hi = indptr[u:u + 2].tolist()
+            for v, w in zip(indices[lo:hi].tolist(), seconds[lo:hi].tolist(), strict=True):
+                pv = potentials.get(v)
+                if pv is None:
+                    if inv:
+                        x, y, z = xyz[v].tolist()
+                        pv = (math.sqrt((x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2) - math.sqrt((x - sx) ** 2 + (y - sy) ** 2 + (z - sz) ** 2)) * inv
+                    else:
+                        pv = 0.0
+                    potentials[v] = pv
+                nd = d + w + sign * (pv - pu)
+                if nd < mine.get(v, math.inf):
+                    mine[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd, v))
+                    if v in other and nd + other[v] < best:
+                        best, meet = nd + other[v], v
+        if meet < 0:
+            return None
+
+        path = []
+        v = meet
+        while v >= 0:
+            path.append(v)
+            v = parent[0][v]
+        path.reverse()
+        v = parent[1][meet]
+        while v >= 0:
+            path.append(v)
+            v = parent[1][v]
+        seconds, meters = self._path_cost(path, mode)
+        return path, seconds, meters, settled
+
+    # 沿路径累加正向边的秒数与米数（相邻节点间取最快的一条边）
+    def _path_cost(self, path: List[int], mode: str) -> Tuple[float, float]:
+        indptr, indices, sec, met = self.adj[mode][0]
+        seconds = meters = 0.0
+        for a, b in itertools.pairwise(path):
+            lo, hi = int(indptr[a]), int(indptr[a + 1])
+            hits = np.nonzero(indices[lo:hi] == b)[0]
+            k = lo + int(hits[np.argmin(sec[lo + hits])])
+            seconds += float(sec[k])
+            meters += float(met[k])
+        return seconds, meters
+
+    # 两点间路网路线：含吸附段（站点到最近节点按步行/直线计）；无法吸附或不可达时返回 None
+    def route(self, a: Dict[str, float], b: Dict[str, float], mode: str) -> Optional[Dict[str, Any]]:
+        s = self.nearest(a["lat"], a["lng"], mode)
+        t = self.nearest(b["lat"], b["lng"], mode)
+        if s is None or t is None:
+            return None
+        found = self.search(s, t, mode)
+        if found is None:
+            return None
+        path, seconds, meters, _ = found
+        snap = float(_haversine_m(a["lat"], a["lng"], self.lat[s], self.lng[s])) + float(
+            _haversine_m(b["lat"], b["lng"], self.lat[t], self.lng[t])
+        )
+        walk = ROUTE_SPEED_KMH["walking"] / 3.6
+        geometry = [{"lat": float(a["lat"]), "lng": float(a["lng"])}]
+        geometry += [{"lat": float(self.lat[v]), "lng": float(self.lng[v])} for v in path]
+        geometry.append({"lat": float(b["lat"]), "lng": float(b["lng"])})
+        return {
+            "distance_km": round((meters + snap) / 1000.0, 3),
+            "duration_min": round((seconds + snap / walk) / 60.0, 1),
+            "path": geometry,
+        }
+
+
+_graph: Optional[RoadGraph] = None
+_graph_checked = False
+_graph_lock = threading.Lock()
+
+
+# 进程内共享的路网（首次调用时加载）；未构建路网时返回 None
+def get_graph() -> Optional[RoadGraph]:
+    global _graph, _graph_checked
+    if _graph_checked:
+        return _graph
+    with _graph_lock:
+        if not _graph_checked:
+            if os.path.exists(os.path.join(ROADNET_DIR, "meta.json")):
+                try:
+                    _graph = RoadGraph(ROADNET_DIR)
+                except (OSError, ValueError) as e:
+                    logger.warning("路网加载失败，退回直线估算：%s", e)
+            _graph_checked = True
+    return _graph
+
+
+def _cli(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(prog="python -m api.roadnet", description="离线路网工具")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="由 OSM XML（.osm）构建路网文件")
+    b.add_argument("--osm", required=True, help="OSM XML 文件（可用 osmium/osmconvert 从 .pbf 裁剪并转换）")
+    b.add_argument("--out", default=ROADNET_DIR)
+    b.add_argument("--grid-deg", type=float, default=ROADNET_GRID_DEG)
+    info = sub.add_parser("info", help="查看已构建的路网")
+    info.add_argument("--dir", default=ROADNET_DIR)
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        coords, ways = parse_osm(args.osm)
+        parsed = time.perf_counter()
+        meta = build(coords, ways, args.out, args.grid_deg)
+        print(f"解析 {parsed - start:.1f}s，构建 {time.perf_counter() - parsed:.1f}s")
+        print(json.dumps(meta, ensure_ascii=False))
+    else:
+        graph = RoadGraph(args.dir)
+        size = sum(os.path.getsize(os.path.join(args.dir, f)) for f in os.listdir(args.dir))
+        print(json.dumps({**graph.meta, "bytes": size}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    _cli()
@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import concurrent.futures
+import json
+import threading
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
-from sqlalchemy import select, func
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, select, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .db import get_db, init_db, User, Plan, PlanVersion, Favorite
-from .auth import hash_password, verify_password, create_access_token, get_current_user
+from . import exports, geo_index, geocode, jobs
+from .config import EXPORT_WAIT_SECONDS, GEOCODE_BATCH_MAX, GEOCODE_WAIT_SECONDS, PLAN_SAVE_RETRIES, PLAN_TIMEOUT, ROUTE_MAX_POINTS
+from .db import get_async_db, init_db, User, Plan, PlanVersion, Favorite
+from .plan_store import PatchError, is_retryable, load_version, load_versions, retry_delay, save_version
+from .replan import previous_request
+from .auth import Principal, shutdown_hash_pool, hash_password_async, verify_password_async, create_access_token, get_current_user
 
 # 创建API路由
 router = APIRouter(prefix="/api/v1", tags=["TripPlanner"])
@@ -27,31 +40,61 @@ class LoginReq(BaseModel):
 class TokenResp(BaseModel):
     token: str
 
-# 启动事件
+# 启动事件：后台预加载地理编码的离线城市库与城市前缀索引
 @router.on_event("startup")
 def _startup():
     init_db()
+    threading.Thread(target=geocode.warm, name="geocode-warm", daemon=True).start()
+    threading.Thread(target=geo_index.warm, name="geo-index-warm", daemon=True).start()
+
+# 关闭事件：回收口令哈希与导出渲染进程池
+@router.on_event("shutdown")
+def _shutdown():
+    shutdown_hash_pool()
+    exports.shutdown_pool()
 
 # 注册
 @router.post("/auth/register", response_model=TokenResp)
-def register(req: RegisterReq, db: Session = Depends(get_db)):
-    exists = db.scalar(select(func.count()).select_from(User).where(User.username == req.username))
+async def register(req: RegisterReq, db: AsyncSession = Depends(get_async_db)):
+    exists = await db.scalar(select(func.count()).select_from(User).where(User.username == req.username))
     if exists and int(exists) > 0:
         raise HTTPException(status_code=400, detail="用户名已存在")
-    user = User(username=req.username, password_hash=hash_password(req.password))
+    # 口令哈希是 CPU 密集操作，交给专用进程池，避免阻塞事件循环
+    user = User(username=req.username, password_hash=await hash_password_async(req.password))
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return TokenResp(token=create_access_token(user.id, user.username))
 
 # 登录
 @router.post("/auth/login", response_model=TokenResp)
-def login(req: LoginReq, db: Session = Depends(get_db)):
-    user: User | None = db.scalar(select(User).where(User.username == req.username))
-    if not user or not verify_password(req.password, user.password_hash):
+async def login(req: LoginReq, db: AsyncSession = Depends(get_async_db)):
+    user: User | None = await db.scalar(select(User).where(User.username == req.username))
+    if not user or not await verify_password_async(req.password, user.password_hash):
         raise HTTPException(status_code=401, detail="用户名或密码错误")
     return TokenResp(token=create_access_token(user.id, user.username))
 
+# 游标分页：游标为上一页最后一行排序键的 base64（对客户端不透明），下一页游标通过响应头 X-Next-Cursor 返回
+PAGE_LIMIT_DEFAULT = 50
+PAGE_LIMIT_MAX = 200
+
+
+def _encode_cursor(*parts: Any) -> str:
+    raw = json.dumps([p.isoformat() if isinstance(p, datetime) else p for p in parts], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(parts, list) or len(parts) != size:
+            raise ValueError(cursor)
+        return parts
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
 # 创建保存计划请求
 class SavePlanReq(BaseModel):
     title: str
@@ -64,44 +107,107 @@ class SavePlanResp(BaseModel):
     plan_id: int
     version: int
 
+# 单事务保存（查找/创建计划、分配版本号、写入版本行一次提交）。save 内不重试（retries=0），
+# 唯一约束冲突、死锁或锁等待超时在这里以 asyncio.sleep 退避后重试，不阻塞事件循环；重试耗尽时返回 409
+async def _save_or_409(db: AsyncSession, save: Any) -> Any:
+    for attempt in range(PLAN_SAVE_RETRIES + 1):
+        try:
+            return await _load_or_500(db, save)
+        except (IntegrityError, OperationalError) as e:
+            if not is_retryable(e):
+                raise
+            if attempt >= PLAN_SAVE_RETRIES:
+                raise HTTPException(status_code=409, detail="保存冲突，请重试")
+            await asyncio.sleep(retry_delay(attempt))
+    raise RuntimeError("unreachable")
+
 # 保存计划
 @router.post("/plans/save", response_model=SavePlanResp)
-def save_plan(
+async def save_plan(
     req: SavePlanReq,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    plan = db.scalar(select(Plan).where(Plan.user_id == user.id, Plan.title == req.title))
-    if plan is None:
-        plan = Plan(user_id=user.id, title=req.title)
-        db.add(plan)
-        db.commit()
-        db.refresh(plan)
+    user_id = user.id
+    plan_id, next_ver = await _save_or_409(
+        db, lambda s: save_version(s, user_id, req.title, req.data, notes=req.notes, rating=req.rating, retries=0)
+    )
+    return SavePlanResp(plan_id=plan_id, version=next_ver)
+
+# 单日地图编辑：站点与出行方式
+class MapDay(BaseModel):
+    date: str
+    stops: List[Dict[str, Any]] = []
+    mode: Optional[str] = None
+
+# 批量保存请求：多日地图编辑 + 计划正文作为一个版本；data 省略时以该计划的最新版本为基础
+class BulkSavePlanReq(BaseModel):
+    title: str
+    data: Optional[Dict[str, Any]] = None
+    map: List[MapDay] = []
+    notes: Optional[str] = None
+    rating: Optional[int] = None
 
-    current_max: int | None = db.scalar(select(func.max(PlanVersion.version)).where(PlanVersion.plan_id == plan.id))
-    next_ver = (current_max or 0) + 1
-    ver = PlanVersion(plan_id=plan.id, version=next_ver, data=req.data, notes=req.notes, rating=req.rating)
-    db.add(ver)
-    db.commit()
-    return SavePlanResp(plan_id=plan.id, version=next_ver)
+
+def _merge_map_days(days: List[MapDay]) -> Any:
+    def merge(doc: Dict[str, Any]) -> Dict[str, Any]:
+        map_data = doc.setdefault("map", {})
+        for day in days:
+            entry = map_data.setdefault(day.date, {})
+            entry["stops"] = day.stops
+            if day.mode is not None:
+                entry["mode"] = day.mode
+        return doc
+    return merge
+
+# 批量保存：多日站点/出行方式与计划正文合并为一个版本，一次请求、一次事务
+@router.post("/plans/save/bulk", response_model=SavePlanResp)
+async def save_plan_bulk(
+    req: BulkSavePlanReq,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    user_id = user.id
+    merge = _merge_map_days(req.map)
+    plan_id, next_ver = await _save_or_409(
+        db, lambda s: save_version(s, user_id, req.title, req.data, notes=req.notes, rating=req.rating, merge=merge, retries=0)
+    )
+    return SavePlanResp(plan_id=plan_id, version=next_ver)
 
 
 class PlanBrief(BaseModel):
     id: int
     title: str
     latest_version: int
+    updated_at: Optional[datetime] = None
 
-# 计划列表
+# 计划列表：按最近更新倒序，游标分页（limit/cursor），直接读取 plans 上的冗余字段
 @router.get("/plans", response_model=List[PlanBrief])
-def list_plans(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    rows = db.execute(
-        select(Plan.id, Plan.title, func.max(PlanVersion.version))
-        .join(PlanVersion, Plan.id == PlanVersion.plan_id)
-        .where(Plan.user_id == user.id)
-        .group_by(Plan.id, Plan.title)
-        .order_by(func.max(PlanVersion.version).desc())
-    ).all()
-    return [PlanBrief(id=r[0], title=r[1], latest_version=int(r[2] or 1)) for r in rows]
+async def list_plans(
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = select(Plan.id, Plan.title, Plan.latest_version, Plan.updated_at).where(
+        Plan.user_id == user.id, Plan.latest_version > 0
+    )
+    if cursor:
+        after_updated, after_id = _decode_cursor(cursor, 2)
+        try:
+            after_updated = datetime.fromisoformat(after_updated)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+        stmt = stmt.where(or_(
+            Plan.updated_at < after_updated,
+            and_(Plan.updated_at == after_updated, Plan.id < after_id),
+        ))
+    rows = (await db.execute(stmt.order_by(Plan.updated_at.desc(), Plan.id.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1][3], rows[-1][0])
+    return [PlanBrief(id=r[0], title=r[1], latest_version=int(r[2]), updated_at=r[3]) for r in rows]
 
 # 计划版本响应
 class PlanVersionResp(BaseModel):
@@ -111,81 +217,359 @@ class PlanVersionResp(BaseModel):
     notes: Optional[str] = None
     rating: Optional[int] = None
 
-# 计划版本列表
-@router.get("/plans/{plan_id}/versions", response_model=List[PlanVersionResp])
-def list_versions(plan_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    plan = db.get(Plan, plan_id)
+# 版本摘要（不含 data）
+class PlanVersionSummary(BaseModel):
+    id: int
+    version: int
+    rating: Optional[int] = None
+    created_at: Optional[datetime] = None
+    size: Optional[int] = None
+
+
+async def _get_own_plan(db: AsyncSession, plan_id: int, user: Principal) -> Plan:
+    plan = await db.get(Plan, plan_id)
     if not plan or plan.user_id != user.id:
         raise HTTPException(status_code=404, detail="计划不存在")
-    versions = db.execute(select(PlanVersion).where(PlanVersion.plan_id == plan_id).order_by(PlanVersion.version.desc())).scalars().all()
+    return plan
+
+
+# 按 (plan_id, version) 倒序的一页版本查询；columns 为要读取的列（摘要列表不读取 data）
+async def _versions_page(db: AsyncSession, plan_id: int, columns: List[Any], limit: int, cursor: Optional[str], response: Response) -> List[Any]:
+    stmt = select(*columns).where(PlanVersion.plan_id == plan_id)
+    if cursor:
+        (before_version,) = _decode_cursor(cursor, 1)
+        if not isinstance(before_version, int):
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+        stmt = stmt.where(PlanVersion.version < before_version)
+    rows = (await db.execute(stmt.order_by(PlanVersion.version.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].version)
+    return rows
+
+
+# 重建版本数据（同步的版本存储通过 run_sync 在异步会话上执行）；版本链损坏时返回 500 并给出原因
+async def _load_or_500(db: AsyncSession, load: Any) -> Any:
+    try:
+        return await db.run_sync(load)
+    except PatchError as e:
+        raise HTTPException(status_code=500, detail=f"版本数据损坏：{e}")
+
+
+# 字段投影：fields 为逗号分隔的 data 顶层键（如 days,map），未指定时返回完整数据
+def _project(data: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+    if not fields:
+        return data
+    keys = [f.strip() for f in fields.split(",") if f.strip()]
+    return {k: data[k] for k in keys if k in data}
+
+# 计划版本列表：按版本号倒序，游标分页（limit/cursor），走 (plan_id, version) 唯一索引；支持 ?fields= 投影
+@router.get("/plans/{plan_id}/versions", response_model=List[PlanVersionResp])
+async def list_versions(
+    plan_id: int,
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await _get_own_plan(db, plan_id, user)
+    columns = [PlanVersion.id, PlanVersion.version, PlanVersion.notes, PlanVersion.rating]
+    rows = await _versions_page(db, plan_id, columns, limit, cursor, response)
+    docs = await _load_or_500(db, lambda s: load_versions(s, plan_id, [v.version for v in rows]))
+    return [
+        PlanVersionResp(id=v.id, version=v.version, data=_project(docs[v.version], fields), notes=v.notes, rating=v.rating)
+        for v in rows
+    ]
+
+# 版本摘要列表：只读取摘要列（不加载 data），用于版本选择等轻量场景
+@router.get("/plans/{plan_id}/versions/summary", response_model=List[PlanVersionSummary])
+async def list_version_summaries(
+    plan_id: int,
+    response: Response,
+    limit: int = Query(PAGE_LIMIT_DEFAULT, ge=1, le=PAGE_LIMIT_MAX),
+    cursor: Optional[str] = None,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await _get_own_plan(db, plan_id, user)
+    columns = [PlanVersion.id, PlanVersion.version, PlanVersion.rating, PlanVersion.created_at, PlanVersion.size]
+    rows = await _versions_page(db, plan_id, columns, limit, cursor, response)
     return [
-        PlanVersionResp(id=v.id, version=v.version, data=v.data, notes=v.notes, rating=v.rating)
-        for v in versions
+        PlanVersionSummary(id=v.id, version=v.version, rating=v.rating, created_at=v.created_at, size=v.size)
+        for v in rows
     ]
 
+# 获取单个版本（按版本号），支持 ?fields= 投影
+@router.get("/plans/{plan_id}/versions/{version}", response_model=PlanVersionResp)
+async def get_version(
+    plan_id: int,
+    version: int,
+    fields: Optional[str] = None,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await _get_own_plan(db, plan_id, user)
+    v = (await db.execute(
+        select(PlanVersion.id, PlanVersion.version, PlanVersion.notes, PlanVersion.rating)
+        .where(PlanVersion.plan_id == plan_id, PlanVersion.version == version)
+    )).first()
+    if v is None:
+        raise HTTPException(status_code=404, detail="版本不存在")
+    data = await _load_or_500(db, lambda s: load_version(s, plan_id, version))
+    return PlanVersionResp(id=v.id, version=v.version, data=_project(data, fields), notes=v.notes, rating=v.rating)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(",")) or header.strip() == "*"
+
+# 导出计划版本（ics/md/html/pdf）：结果按内容哈希缓存为文件，以 ETag 支持条件请求（未变化返回 304）；
+# 渲染在后台进程池中进行，EXPORT_WAIT_SECONDS 内未完成时返回 202 与 Retry-After，客户端稍后重试即可取回
+@router.get("/plans/{plan_id}/versions/{version}/export/{fmt}")
+async def export_version(
+    plan_id: int,
+    version: int,
+    fmt: str,
+    request: Request,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if fmt not in exports.FORMATS:
+        raise HTTPException(status_code=404, detail=f"不支持的导出格式：{fmt}（可选 {', '.join(exports.FORMATS)}）")
+    if fmt == "pdf" and exports.pdf_font() is None:
+        raise HTTPException(status_code=501, detail=exports.PDF_FONT_MISSING)
+    await _get_own_plan(db, plan_id, user)
+    key = f"{plan_id}:{version}:{fmt}"
+    digest = exports.digest_cache.get(key)
+    data = None
+    if digest is None:
+        exists = await db.scalar(
+            select(PlanVersion.id).where(PlanVersion.plan_id == plan_id, PlanVersion.version == version)
+        )
+        if exists is None:
+            raise HTTPException(status_code=404, detail="版本不存在")
+        data = await _load_or_500(db, lambda s: load_version(s, plan_id, version))
+        digest = exports.content_hash(data, fmt)
+        exports.digest_cache.set(key, digest)
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = exports.cached_file(digest, fmt)
+    if path is None:
+        if data is None:
+            data = await _load_or_500(db, lambda s: load_version(s, plan_id, version))
+        future = exports.submit(fmt, data, digest)
+        try:
+            # shield：等待超时只放弃本次等待，不取消后台渲染
+            path = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), EXPORT_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            return JSONResponse(status_code=202, content={"status": "pending", "format": fmt}, headers={"Retry-After": "2"})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"导出失败: {type(e).__name__}: {e}")
+    ext, media_type = exports.FORMATS[fmt]
+    return FileResponse(path, media_type=media_type, filename=f"trip_plan_{plan_id}_v{version}.{ext}", headers=headers)
+
+
 # 收藏计划
 @router.post("/plans/{plan_id}/favorite")
-def toggle_favorite(plan_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    plan = db.get(Plan, plan_id)
-    if not plan or plan.user_id != user.id:
-        raise HTTPException(status_code=404, detail="计划不存在")
-    fav = db.scalar(select(Favorite).where(Favorite.user_id == user.id, Favorite.plan_id == plan_id))
+async def toggle_favorite(plan_id: int, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    await _get_own_plan(db, plan_id, user)
+    fav = await db.scalar(select(Favorite).where(Favorite.user_id == user.id, Favorite.plan_id == plan_id))
     if fav is None:
         fav = Favorite(user_id=user.id, plan_id=plan_id, active=True)
         db.add(fav)
     else:
         fav.active = not bool(fav.active)
-    db.commit()
+    await db.commit()
     return {"active": bool(fav.active)}
 
-# 创建重新规划请求
+# 创建重新规划请求；days 可指定只重写的日期，origin/cities/date_range/interests 可覆盖上一版本的规划输入
 class ReplanReq(BaseModel):
     plan_id: int
     version: int
     feedback: str
-
-# 重新规划
-@router.post("/plans/replan", response_model=SavePlanResp)
-def replan(req: ReplanReq, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    ver = db.get(PlanVersion, req.version)
+    days: Optional[List[str]] = None
+    origin: Optional[str] = None
+    cities: Optional[str] = None
+    date_range: Optional[str] = None
+    interests: Optional[str] = None
+
+# 再规划响应：mode 为实际的重跑范围（full/guide/plan/days）
+class ReplanResp(SavePlanResp):
+    mode: str
+    days: List[str] = []
+    job_id: str
+
+# 重新规划：复用基准版本保存的阶段产出，只重跑受反馈影响的阶段/日期（见 api/replan.py）；
+# 任务在共享规划线程池中执行并写入新版本，超时后仍可通过 /api/v1/plan/jobs/{job_id} 查询
+@router.post("/plans/replan", response_model=ReplanResp)
+async def replan(req: ReplanReq, user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    ver = await db.get(PlanVersion, req.version)
     if not ver:
         raise HTTPException(status_code=404, detail="版本不存在")
-    plan = db.get(Plan, ver.plan_id)
+    plan = await db.get(Plan, ver.plan_id)
     if not plan or plan.user_id != user.id:
         raise HTTPException(status_code=403, detail="无权限")
 
-    # 这里复用之前存储的结构化输入，结合反馈生成新版本（占位实现）
-    new_data = dict(ver.data)
-    new_data["feedback"] = req.feedback
-
-    current_max: int | None = db.scalar(select(func.max(PlanVersion.version)).where(PlanVersion.plan_id == plan.id))
-    next_ver = (current_max or 0) + 1
-    nv = PlanVersion(plan_id=plan.id, version=next_ver, data=new_data)
-    db.add(nv)
-    db.commit()
-    return SavePlanResp(plan_id=plan.id, version=next_ver)
+    plan_id, base_version = plan.id, ver.version
+    base = await _load_or_500(db, lambda s: load_version(s, plan_id, base_version))
+    overrides = {k: getattr(req, k) for k in ("origin", "cities", "date_range", "interests") if getattr(req, k)}
+    if previous_request(base) is None and not all(overrides.get(k) for k in ("origin", "cities", "date_range")):
+        raise HTTPException(status_code=400, detail="该版本缺少规划输入（出发地/城市/日期），请在请求中提供")
+
+    params = {"plan_id": plan_id, "version": base_version, "feedback": req.feedback, "days": req.days, "overrides": overrides}
+    try:
+        job = await run_in_threadpool(jobs.submit_job, "replan", params)
+    except jobs.JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        result = await run_in_threadpool(jobs.wait_job, job["job_id"], PLAN_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail=f"再规划超时，新版本生成后会自动保存，可通过 /api/v1/plan/jobs/{job['job_id']} 查询",
+        )
+    except PatchError as e:
+        raise HTTPException(status_code=500, detail=f"版本数据损坏：{e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"再规划失败: {type(e).__name__}: {e}")
+    return ReplanResp(**result, job_id=job["job_id"])
 
 
 # 地理编码与路线规划（占位：由前端提交站点与模式，后端返回路径序列）
 class RouteReq(BaseModel):
     points: List[Dict[str, float]]  # [{lat, lng}]
     mode: str  # walking, driving, transit
+    optimize: bool = False  # 是否优化站点顺序（默认按输入顺序）
+    fixed_start: bool = True  # 优化时第一个站点保持为起点
+    fixed_end: bool = False  # 优化时最后一个站点保持为终点
+
+
+class RouteLeg(BaseModel):
+    start: int  # 本段起止站点（请求中的下标）
+    end: int
+    distance_km: float
+    duration_min: float
 
 
 class RouteResp(BaseModel):
     distance_km: float
     duration_min: float
     path: List[Dict[str, float]]
+    order: List[int] = []  # 访问顺序（请求中站点的下标）
+    legs: List[RouteLeg] = []
+    engine: str = "haversine"  # roadnet：按离线路网道路计算；haversine：直线距离 x 绕行系数估算
+
+
+class RouteDayReq(RouteReq):
+    date: str
+
+
+class BatchRouteReq(BaseModel):
+    days: List[RouteDayReq]
+
+
+class RouteDayResp(RouteResp):
+    date: str
+
+
+class BatchRouteResp(BaseModel):
+    routes: List[RouteDayResp]
+    distance_km: float
+    duration_min: float
+
+
+# 校验站点并计算路线；站点少于两个时返回空路线。
+# 路线模块依赖 numpy（及离线路网），首次计算路线时才加载，不拖慢服务启动与其他接口
+def _route(req: RouteReq) -> Dict[str, Any]:
+    if len(req.points) > ROUTE_MAX_POINTS:
+        raise HTTPException(status_code=413, detail=f"站点过多（最多 {ROUTE_MAX_POINTS} 个）")
+    for p in req.points:
+        lat, lng = p.get("lat"), p.get("lng")
+        if lat is None or lng is None or not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+            raise HTTPException(status_code=422, detail="每个站点都需要有效的 lat 与 lng")
+    if len(req.points) < 2:
+        return {"distance_km": 0.0, "duration_min": 0.0, "path": req.points, "order": list(range(len(req.points))), "legs": []}
+    from . import routing
+    return routing.plan_route(req.points, req.mode, req.optimize, req.fixed_start, req.fixed_end)
 
 
+# 路线估算：有离线路网时步行/驾车按道路最短路径计算，否则按大圆距离 x 出行方式绕行系数估算；optimize 时重排站点顺序
 @router.post("/route", response_model=RouteResp)
 def compute_route(req: RouteReq):
-    # 简化：直接返回原路径，附上粗略里程/时间估算
-    n = max(1, len(req.points) - 1)
-    base_speed = {"walking": 4.5, "driving": 40.0, "transit": 25.0}.get(req.mode, 5.0)  # km/h
-    # 以 2km/段 粗略估计
-    distance_km = 2.0 * n
-    duration_min = distance_km / base_speed * 60.0
-    return RouteResp(distance_km=distance_km, duration_min=duration_min, path=req.points)
+    return RouteResp(**_route(req))
+
+
+# 批量路线：一次计算计划中所有日期的路线
+@router.post("/route/batch", response_model=BatchRouteResp)
+def compute_routes(req: BatchRouteReq):
+    routes = [RouteDayResp(date=day.date, **_route(day)) for day in req.days]
+    return BatchRouteResp(
+        routes=routes,
+        distance_km=round(sum(r.distance_km for r in routes), 3),
+        duration_min=round(sum(r.duration_min for r in routes), 1),
+    )
+
+
+class GeocodeBatchReq(BaseModel):
+    names: List[str]
+    hint: str = ""  # 城市提示（如 "杭州"），与名称一起发给上游
+    wait: Optional[float] = None  # 等待上游结果的秒数（不超过 GEOCODE_WAIT_SECONDS），0 表示不等待
+
+
+class GeocodeItem(BaseModel):
+    name: str
+    label: str  # 清洗后的地点名
+    status: str  # ok / not_found / pending / busy / error / empty
+    source: Optional[str] = None  # offline / cache / upstream
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    display_name: Optional[str] = None
+
+
+class GeocodeBatchResp(BaseModel):
+    items: List[GeocodeItem]
+    pending: int
+
+
+# 批量地理编码：缓存与离线命中立即返回；未命中的名称（批内去重）排入全局限速的上游队列，
+# 在 wait 秒内完成的一并返回，其余为 pending，客户端稍后重试即可命中缓存
+@router.post("/geocode/batch", response_model=GeocodeBatchResp)
+async def geocode_batch(req: GeocodeBatchReq):
+    if len(req.names) > GEOCODE_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"名称过多（最多 {GEOCODE_BATCH_MAX} 个）")
+    # 缓存读取（SQLite）与首次加载离线城市库都会阻塞，放到线程池执行
+    items, futures = await run_in_threadpool(geocode.resolve_batch, req.names, req.hint)
+    wait = GEOCODE_WAIT_SECONDS if req.wait is None else max(0.0, min(req.wait, GEOCODE_WAIT_SECONDS))
+    if futures and wait > 0:
+        await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()], timeout=wait)
+    items = geocode.fill_results(items, futures)
+    return GeocodeBatchResp(items=items, pending=sum(1 for i in items if i["status"] == "pending"))
+
+
+@router.get("/geocode/stats")
+def geocode_stats():
+    return geocode.stats()
+
+
+class CityItem(BaseModel):
+    name: str
+    zh: Optional[str] = None  # 中文名（无中文别名时为空）
+    lat: float
+    lng: float
+    population: int
+
+
+class CitySearchResp(BaseModel):
+    country: str
+    prefix: str
+    cities: List[CityItem]
 
 
+# 城市前缀补全：按英文名、中文名、拼音或拼音首字母前缀匹配，结果按人口降序；prefix 为空时返回该国人口最多的城市
+@router.get("/geo/cities", response_model=CitySearchResp)
+def geo_cities(country: str = Query(..., min_length=2, max_length=2), prefix: str = "", limit: int = Query(50, ge=1, le=200)):
+    return CitySearchResp(country=country.upper(), prefix=prefix, cities=geo_index.search(country, prefix, limit))
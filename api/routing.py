@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .cache import TieredCache, make_key
+from .config import ROUTE_CACHE_TTL, ROUTE_DETOUR_FACTOR, ROUTE_OPT_TIME_LIMIT, ROUTE_SPEED_KMH
+
+# 路线估算：向量化 haversine 距离矩阵 + 站点顺序优化（最近邻构造，2-opt / Or-opt 改进，带时间上限）。
+# 开放路径（起点/终点可固定）转化为带一个虚拟节点的闭合回路求解：
+# 虚拟节点到固定端点的距离为 0、到其他站点为足够大的惩罚值，最优回路中虚拟节点两侧必为指定端点。
+# walking/driving 在已构建离线路网（api/roadnet.py）时逐段走路网最短路径，返回道路几何；站点顺序仍按大圆距离矩阵优化。
+# 结果按站点集合哈希缓存：需要优化顺序时，除固定端点外的站点按坐标排序后再计算键，输入顺序不同也能命中。
+
+# 计算逻辑变化时递增，使旧的缓存结果失效
+ROUTE_VERSION = 2
+EARTH_RADIUS_KM = 6371.0088
+
+route_cache = TieredCache("routes", ttl=ROUTE_CACHE_TTL, max_entries=1024)
+
+_EPS = 1e-9
+# 可自由排列的站点不超过该数量时直接枚举求精确解
+_EXACT_MAX_FREE = 7
+
+
+# 大圆距离矩阵（km）；lat/lng 为角度
+def distance_matrix(lat: Sequence[float], lng: Sequence[float]) -> np.ndarray:
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lam = np.radians(np.asarray(lng, dtype=np.float64))
+    dphi = phi[:, None] - phi[None, :]
+    dlam = lam[:, None] - lam[None, :]
+    h = np.sin(dphi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+# 最近邻构造初始回路：从虚拟节点出发，固定终点留到最后
+def _initial_tour(dist: np.ndarray, n: int, start: Optional[int], end: Optional[int]) -> np.ndarray:
+    remaining = np.ones(n, dtype=bool)
+    tour = [n]
+    cur = 0 if start is None else start
+    if end is not None:
+        remaining[end] = False
+    tour.append(cur)
+    remaining[cur] = False
+    while remaining.any():
+        cur = int(np.argmin(np.where(remaining, dist[cur, :n], np.inf)))
+        tour.append(cur)
+        remaining[cur] = False
+    if end is not None:
+        tour.append(end)
+    return np.asarray(tour, dtype=np.int64)
+
+
+# 2-opt：对每条边一次性向量化计算与其后所有边交换的收益，取最优者反转区间；虚拟节点固定在下标 0
+def _two_opt(dist: np.ndarray, tour: np.ndarray, deadline: float) -> bool:
+    m = len(tour)
+    improved = False
+    for i in range(m - 2):
+        if time.monotonic() > deadline:
+            break
+        j = np.arange(i + 2, m if i > 0 else m - 1)
+        if not len(j):
+            continue
+        a, b = tour[i], tour[i + 1]
+        c, d = tour[j], tour[(j + 1) % m]
+        delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+        k = int(np.argmin(delta))
+        if delta[k] < -_EPS:
+            tour[i + 1:j[k] + 1] = tour[i + 1:j[k] + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+# Or-opt：把长度 1~max_len 的连续站点段（可反向）移到回路中收益最大的位置
+def _or_opt(dist: np.ndarray, tour: np.ndarray, deadline: float, max_len: int = 3):
+    m = len(tour)
+    improved = False
+    for length in range(1, max_len + 1):
+        if m - length < 3:
+            break
+        i = 1
+        while i + length <= m:
+            if time.monotonic() > deadline:
+                return tour, improved
+            seg = tour[i:i + length]
+            prev, nxt = tour[i - 1], tour[(i + length) % m]
+            gain = dist[prev, seg[0]] + dist[seg[-1], nxt] - dist[prev, nxt]
+            rest = np.concatenate((tour[:i], tour[i + length:]))
+            a, b = rest, np.roll(rest, -1)
+            base = dist[a, b]
+            fwd = dist[a, seg[0]] + dist[seg[-1], b] - base
+            rev = dist[a, seg[-1]] + dist[seg[0], b] - base
+            # 插回原处不算移动
+            fwd[i - 1] = rev[i - 1] = np.inf
+            kf, kr = int(np.argmin(fwd)), int(np.argmin(rev))
+            k, piece, cost = (kf, seg, fwd[kf]) if fwd[kf] <= rev[kr] else (kr, seg[::-1], rev[kr])
+            if cost < gain - _EPS:
+                tour = np.concatenate((rest[:k + 1], piece, rest[k + 1:]))
+                improved = True
+            i += 1
+    return tour, improved
+
+
+# 站点很少时枚举全部排列
+def _exact(dist: np.ndarray, start: Optional[int], end: Optional[int]) -> List[int]:
+    n = len(dist)
+    middle = [k for k in range(n) if k != start and k != end]
+    head = [start] if start is not None else []
+    tail = [end] if end is not None else []
+    best, best_cost = None, np.inf
+    for perm in itertools.permutations(middle):
+        path = head + list(perm) + tail
+        cost = float(dist[path[:-1], path[1:]].sum())
+        if cost < best_cost - _EPS:
+            best, best_cost = path, cost
+    return best
+
+
+# 站点访问顺序（返回下标列表）；fixed_start/fixed_end 为 True 时第一个/最后一个站点保持在首/尾
+def order_stops(
+    dist: np.ndarray,
+    fixed_start: bool = True,
+    fixed_end: bool = False,
+    time_limit: float = ROUTE_OPT_TIME_LIMIT,
+) -> List[int]:
+    n = len(dist)
+    start = 0 if fixed_start else None
+    end = n - 1 if fixed_end and n > 1 else None
+    free = n - (start is not None) - (end is not None)
+    if free <= 1:
+        return list(range(n))
+
+    if free <= _EXACT_MAX_FREE:
+        return _exact(dist, start, end)
+
+    full = np.zeros((n + 1, n + 1))
+    full[:n, :n] = dist
+    if start is not None or end is not None:
+        penalty = (float(dist.max()) + 1.0) * (n + 1)
+        link = np.full(n, penalty)
+        for k in (start, end):
+            if k is not None:
+                link[k] = 0.0
+        full[n, :n] = full[:n, n] = link
+
+    deadline = time.monotonic() + time_limit
+    tour = _initial_tour(full, n, start, end)
+    while time.monotonic() < deadline:
+        improved = _two_opt(full, tour, deadline)
+        tour, moved = _or_opt(full, tour, deadline)
+        if not (improved or moved):
+            break
+
+    path = [int(k) for k in tour[1:]]
+    if (start is not None and path[0] != start) or (start is None and end is not None and path[-1] != end):
+        path.reverse()
+    return path
+
+
+# 需要优化顺序时的规范站点顺序：固定端点保持原位，其余按坐标排序，使同一站点集合得到同一缓存键
+def _canonical(points: List[Dict[str, float]], optimize: bool, fixed_start: bool, fixed_end: bool) -> List[int]:
+    n = len(points)
+    if not optimize:
+        return list(range(n))
+    head = [0] if fixed_start else []
+    tail = [n - 1] if fixed_end and n - 1 not in head else []
+    middle = sorted(
+        (i for i in range(n) if i not in head and i not in tail),
+        key=lambda i: (points[i]["lat"], points[i]["lng"]),
+    )
+    return head + middle + tail
+
+
+def _compute(points: List[Dict[str, float]], mode: str, optimize: bool, fixed_start: bool, fixed_end: bool, graph) -> Dict[str, Any]:
+    dist = distance_matrix([p["lat"] for p in points], [p["lng"] for p in points])
+    order = order_stops(dist, fixed_start, fixed_end) if optimize else list(range(len(points)))
+    detour = ROUTE_DETOUR_FACTOR.get(mode, 1.3)
+    speed = ROUTE_SPEED_KMH.get(mode, 5.0)
+    legs = []
+    for a, b in itertools.pairwise(order):
+        # 有路网时按路网最短路径，无法吸附或不可达的路段退回直线估算
+        leg = graph.route(points[a], points[b], mode) if graph is not None else None
+        if leg is None:
+            km = round(float(dist[a, b]) * detour, 3)
+            leg = {"distance_km": km, "duration_min": round(km / speed * 60.0, 1), "path": None}
+        legs.append(leg)
+    return {"order": order, "legs": legs}
+
+
+# 计算一条路线：返回访问顺序（请求中的下标）、按顺序的路径（有路网时为道路几何）、逐段与总里程/时长
+def plan_route(
+    points: List[Dict[str, float]],
+    mode: str,
+    optimize: bool = False,
+    fixed_start: bool = True,
+    fixed_end: bool = False,
+) -> Dict[str, Any]:
+    from . import roadnet
+    graph = roadnet.get_graph() if mode in roadnet.MODES else None
+    perm = _canonical(points, optimize, fixed_start, fixed_end)
+    canon = [{"lat": round(float(points[i]["lat"]), 6), "lng": round(float(points[i]["lng"]), 6)} for i in perm]
+    key = make_key(
+        "route", ROUTE_VERSION, mode, optimize, fixed_start, fixed_end,
+        graph.key if graph is not None else None, [(p["lat"], p["lng"]) for p in canon],
+    )
+    cached = route_cache.get(key)
+    if cached is None:
+        cached = _compute(canon, mode, optimize, fixed_start, fixed_end, graph)
+        route_cache.set(key, cached)
+
+    order = [perm[i] for i in cached["order"]]
+    legs, path = [], [points[order[0]]] if order else []
+    for (a, b), leg in zip(itertools.pairwise(order), cached["legs"], strict=True):
+        legs.append({"start": a, "end": b, "distance_km": leg["distance_km"], "duration_min": leg["duration_min"]})
+        # 路网几何的首尾即两端站点，拼接时去掉重复的起点
+        path.extend(leg["path"][1:-1] if leg["path"] else [])
+        path.append(points[b])
+    return {
+        "distance_km": round(sum(leg["distance_km"] for leg in legs), 3),
+        "duration_min": round(sum(leg["duration_min"] for leg in legs), 1),
+        "path": path,
+        "order": order,
+        "legs": legs,
+        "engine": "roadnet" if any(leg["path"] for leg in cached["legs"]) else "haversine",
+    }
@@ -1,11 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any
-from agents.main import TripCrew
 import datetime as dt
 from .routes import router as api_router
+from .config import PLAN_TIMEOUT, PLAN_CACHE_TTL, PLAN_CACHE_MAX_ENTRIES, PREWARM_AGENTS
+from .cache import TieredCache, make_key
+from .db import Plan, SessionLocal
+from .plan_store import append_version, load_version
+from .itinerary_parser import ItineraryParser, budget_from_days
+from .replan import choose_mode, previous_request, splice_days, split_day_sections
+from . import exports, jobs, metrics
 import concurrent.futures
+import json
+import queue
+import re
+import sys
+import threading
 import time
 
 # 创建计划请求
@@ -20,6 +32,7 @@ class DayPlan(BaseModel):
   date: str
   activities: List[str]
   meals: List[str] | None = None
+  costs: List[Dict[str, Any]] | None = None  # [{item, amount, total?}]，amount 为识别出的金额（区间取上限），无法识别时为 None；total 标记合计/小计行（不计入预算）
   notes: str | None = None
 
 # 创建计划响应
@@ -28,6 +41,17 @@ class PlanResponse(BaseModel):
   days: List[DayPlan]
   budget_estimate: Dict[str, Any] | None = None
   raw_markdown: str
+  request: Dict[str, Any] | None = None  # 本次规划的输入（再规划时复用）
+  stages: Dict[str, str] | None = None  # identify/gather/plan 各阶段产出（再规划时复用，避免重跑调研）
+
+# 规划任务状态响应
+class PlanJobResponse(BaseModel):
+  job_id: str
+  status: str
+  error: str | None = None
+  created_at: dt.datetime | None = None
+  started_at: dt.datetime | None = None
+  finished_at: dt.datetime | None = None
 
 # 创建FastAPI应用
 app = FastAPI(title="Trip Planner API", version="1.0.0")
@@ -41,6 +65,20 @@ app.add_middleware(
 
 app.include_router(api_router)
 
+# 按路由模板记录请求耗时（未匹配的路径统一归为 <unmatched>，避免标签基数失控）
+@app.middleware("http")
+async def _observe_request(request: Request, call_next):
+  start = time.perf_counter()
+  status = 500
+  try:
+    response = await call_next(request)
+    status = response.status_code
+    return response
+  finally:
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "<unmatched>"
+    metrics.HTTP_REQUEST_SECONDS.labels(request.method, path, status).observe(time.perf_counter() - start)
+
 # 解析日期范围
 def parse_date_range(date_range: str) -> List[str]:
   # 兼容多种分隔与格式：优先正则提取 YYYY-MM-DD
@@ -77,74 +115,316 @@ def parse_date_range(date_range: str) -> List[str]:
     # 最后兜底：当天
     return [dt.date.today().isoformat()]
 
-# 将markdown文本转换为结构化数据
-def naive_markdown_to_struct(md_text: str, days: List[str]) -> PlanResponse:
-  # 简易解析：按日期标题或行分割，不保证完美，但可提供结构化导出
+# 将markdown文本转换为结构化数据：单遍解析（见 api/itinerary_parser.py），识别多种日期/天数标题写法，
+# 并把用餐、费用、备注归入对应字段；各天费用汇总为预算估计
+def markdown_to_struct(md_text: str, days: List[str]) -> PlanResponse:
   days = days or [dt.date.today().isoformat()]
-  day_blocks: Dict[str, List[str]] = {d: [] for d in days}
-  active_day: str | None = None
-  for line in md_text.splitlines():
-    t = line.strip()
-    if t.startswith("#") or t.startswith("##") or t.startswith("###"):
-      for d in days:
-        if d in t:
-          active_day = d
-          break
-      continue
-    if active_day and t:
-      day_blocks[active_day].append(t)
-
-  day_plans: List[DayPlan] = []
-  for d in days:
-    items = [s for s in day_blocks.get(d, []) if s]
-    day_plans.append(DayPlan(date=d, activities=items[:10]))
-
+  parsed = ItineraryParser(days).parse(md_text)
   summary = f"行程共 {len(days)} 天；出发至返回全流程涵盖交通、餐饮与景点。"
-  return PlanResponse(summary=summary, days=day_plans, budget_estimate=None, raw_markdown=md_text)
+  return PlanResponse(
+    summary=summary,
+    days=[DayPlan(**d) for d in parsed],
+    budget_estimate=budget_from_days(parsed),
+    raw_markdown=md_text,
+  )
 
-# 创建计划
-@app.post("/api/v1/plan", response_model=PlanResponse)
-def create_plan(req: PlanRequest):
+# 规划结果缓存：相同（规范化后）请求直接复用上次的行程
+plan_cache = TieredCache("plan_results", ttl=PLAN_CACHE_TTL, max_entries=PLAN_CACHE_MAX_ENTRIES)
+
+_SPLIT_CITIES = re.compile(r"[,，、;；]+")
+_SPLIT_INTERESTS = re.compile(r"[,，、;；/|\s]+")
+
+_ISO_DATE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}")
+
+# 规范化请求作为缓存键：城市去空白/去重/排序，日期按解析后的起止日，兴趣拆词去重排序
+# parse_date_range 解析不出日期时会回退到当天（如 2025/10/01、自由文本），此时改用规范化后的原始日期串，
+# 避免不同请求共用同一个键
+def plan_cache_key(req: PlanRequest) -> str:
+  cities = sorted({c.strip().casefold() for c in _SPLIT_CITIES.split(req.cities) if c.strip()})
+  if _ISO_DATE.search(req.date_range):
+    days = parse_date_range(req.date_range)
+    dates = [days[0], days[-1]]
+  else:
+    dates = ["raw", " ".join(req.date_range.split()).casefold()]
+  interests = sorted({t.casefold() for t in _SPLIT_INTERESTS.split(req.interests or "") if t})
+  return make_key("plan", req.origin.strip().casefold(), cities, *dates, interests)
+
+# 请求头 Cache-Control: no-cache 时跳过缓存读取（结果仍会回写缓存）
+def _cache_bypassed(request: Request) -> bool:
+  return "no-cache" in request.headers.get("cache-control", "").lower()
+
+# agent 技术栈（crewai、工具、LLM 客户端）导入开销大，且认证/计划 CRUD 用不到：
+# 首次规划请求时才加载，或通过 prewarm() 显式预热
+_agents_lock = threading.Lock()
+_agents_loaded_in: float | None = None
+
+def prewarm() -> float:
+  global _agents_loaded_in
+  with _agents_lock:
+    if _agents_loaded_in is None:
+      start = time.perf_counter()
+      import agents.main  # noqa: F401
+      import agents.progress  # noqa: F401
+      from agents.pool import agent_pool
+      agent_pool.fill(1)
+      _agents_loaded_in = time.perf_counter() - start
+    return _agents_loaded_in
+
+def _trip_crew_cls():
+  prewarm()
+  from agents.main import TripCrew
+  return TripCrew
+
+def _progress_sink(emit):
+  prewarm()
+  from agents.progress import ProgressSink
+  return ProgressSink(emit)
+
+# 可选：启动后在后台预热，不阻塞服务就绪
+@app.on_event("startup")
+def _prewarm_agents():
+  if PREWARM_AGENTS:
+    threading.Thread(target=prewarm, name="agents-prewarm", daemon=True).start()
+
+# 显式预热接口（例如部署后由健康检查调用），返回 agent 技术栈加载耗时
+@app.post("/api/v1/plan/prewarm")
+def prewarm_agents():
+  return {"loaded": True, "load_seconds": round(prewarm(), 3)}
+
+# 规划任务执行函数：在共享线程池中运行 crew 并解析为结构化结果
+def _run_plan_job(params: Dict[str, Any], progress: Any = None) -> Dict[str, Any]:
+  req = PlanRequest(**params)
+  crew = _trip_crew_cls()(req.origin, req.cities, req.date_range, req.interests or "")
+  try:
+    result = crew.run(progress_sink=progress)
+  except Exception as e:
+    if progress is not None:
+      progress.emit("error", detail=f"规划失败: {type(e).__name__}: {e}")
+    raise
+  days = parse_date_range(req.date_range)
+  data = markdown_to_struct(str(result), days).model_dump()
+  data.update(request=req.model_dump(), stages=dict(crew.stage_outputs))
+  plan_cache.set(plan_cache_key(req), data)
+  if progress is not None:
+    progress.emit("result", plan=data)
+  return data
+
+jobs.register_runner("plan", _run_plan_job)
+
+# 再规划任务：读取基准版本保存的规划输入与阶段产出，按反馈选择重跑范围（见 api/replan.py），结果保存为新版本
+# params: plan_id、version（基准版本号）、feedback、days（可选，指定重写的日期）、overrides（可选，覆盖规划输入）
+def _run_replan_job(params: Dict[str, Any], progress: Any = None) -> Dict[str, Any]:
+  plan_id, base_version = params["plan_id"], params["version"]
+  with SessionLocal() as db:
+    base = load_version(db, plan_id, base_version)
+  prev = previous_request(base)
+  overrides = {k: v for k, v in (params.get("overrides") or {}).items() if v}
+  if prev is None:
+    prev = overrides
+  req = PlanRequest(**{**prev, **overrides})
+  feedback = params.get("feedback") or ""
+  days = parse_date_range(req.date_range)
+  mode, affected = choose_mode(
+    prev, req.model_dump(), base.get("stages"), feedback, days, parse_date_range(prev["date_range"]), params.get("days"),
+  )
+  crew = _trip_crew_cls()(req.origin, req.cities, req.date_range, req.interests or "")
+  start = time.perf_counter()
+  try:
+    if mode == "full":
+      result = crew.run(progress_sink=progress)
+    else:
+      result = crew.replan(base["stages"], feedback, mode=mode, days=affected, progress_sink=progress)
+  except Exception as e:
+    if progress is not None:
+      progress.emit("error", detail=f"再规划失败: {type(e).__name__}: {e}")
+    raise
+  stages = dict(crew.stage_outputs)
+  markdown = str(result)
+  if mode == "days":
+    markdown = splice_days(base.get("raw_markdown") or base["stages"]["plan"], days, split_day_sections(markdown, affected))
+    stages["plan"] = markdown
+  data = markdown_to_struct(markdown, days).model_dump()
+  # 保留上一版本中与行程正文无关的字段（如 map 地图编辑、meta）；目的地或日期变化后地图编辑失效
+  kept = {k: v for k, v in base.items() if k not in data and not (mode == "full" and k == "map")}
+  new_data = {**kept, **data, "request": req.model_dump(), "stages": stages, "feedback": feedback}
+  new_data["replan"] = {
+    "mode": mode, "days": affected, "base_version": base_version, "seconds": round(time.perf_counter() - start, 3),
+  }
+  with SessionLocal() as db:
+    version = append_version(db, db.get(Plan, plan_id), new_data, notes=feedback or None)
+  if progress is not None:
+    progress.emit("result", plan=new_data)
+  return {"plan_id": plan_id, "version": version, "mode": mode, "days": affected}
+
+jobs.register_runner("replan", _run_replan_job)
+
+# 启动时恢复上次未完成的规划任务
+@app.on_event("startup")
+def _recover_plan_jobs():
+  jobs.recover_jobs()
+
+def _validate_plan_request(req: PlanRequest) -> None:
   if not req.origin or not req.cities or not req.date_range:
     raise HTTPException(status_code=400, detail="缺少必要参数")
-  crew = TripCrew(req.origin, req.cities, req.date_range, req.interests or "")
-  # 增加超时保护，避免前端长时间等待（默认 180s）
+
+def _submit_plan_job(req: PlanRequest, progress: Any = None) -> Dict[str, Any]:
+  try:
+    return jobs.submit_job("plan", req.model_dump(), progress=progress)
+  except jobs.JobQueueFullError as e:
+    raise HTTPException(status_code=503, detail=str(e))
+
+# 创建计划（同步等待）：任务交给共享线程池执行，超时后立即释放当前请求，任务结果仍可通过 job 接口取回
+@app.post("/api/v1/plan", response_model=PlanResponse)
+def create_plan(req: PlanRequest, request: Request, response: Response):
+  _validate_plan_request(req)
+  if _cache_bypassed(request):
+    response.headers["X-Cache"] = "BYPASS"
+  else:
+    cached = plan_cache.get(plan_cache_key(req))
+    if cached is not None:
+      response.headers["X-Cache"] = "HIT"
+      return PlanResponse(**cached)
+    response.headers["X-Cache"] = "MISS"
+  job = _submit_plan_job(req)
   try:
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-      future = executor.submit(crew.run)
-      result = future.result(timeout=180)
+    result = jobs.wait_job(job["job_id"], timeout=PLAN_TIMEOUT)
   except concurrent.futures.TimeoutError:
-    raise HTTPException(status_code=504, detail="规划超时，请稍后重试或减少联网搜索")
+    raise HTTPException(
+      status_code=504,
+      detail=f"规划超时，请稍后通过 /api/v1/plan/jobs/{job['job_id']}/result 获取结果，或减少联网搜索",
+    )
   except Exception as e:
     raise HTTPException(status_code=500, detail=f"规划失败: {type(e).__name__}: {e}")
+  return PlanResponse(**result)
+
+# 提交异步规划任务：立即返回 job_id
+@app.post("/api/v1/plan/jobs", response_model=PlanJobResponse, status_code=202)
+def create_plan_job(req: PlanRequest, request: Request):
+  _validate_plan_request(req)
+  if not _cache_bypassed(request):
+    cached = plan_cache.get(plan_cache_key(req))
+    if cached is not None:
+      return PlanJobResponse(**jobs.record_completed("plan", req.model_dump(), cached))
+  return PlanJobResponse(**_submit_plan_job(req))
+
+# 查询规划任务状态
+@app.get("/api/v1/plan/jobs/{job_id}", response_model=PlanJobResponse)
+def get_plan_job(job_id: str):
+  job = jobs.get_job(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="任务不存在")
+  return PlanJobResponse(**job)
+
+# 获取规划任务结果：完成返回 200，未完成返回 202
+@app.get("/api/v1/plan/jobs/{job_id}/result", response_model=PlanResponse)
+def get_plan_job_result(job_id: str):
+  job = jobs.get_job(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="任务不存在")
+  if job["status"] == "succeeded":
+    return PlanResponse(**job["result"])
+  if job["status"] in ("queued", "running"):
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
+  if job["status"] == "timeout":
+    raise HTTPException(status_code=504, detail=job["error"] or "规划超时")
+  raise HTTPException(status_code=500, detail=f"规划失败: {job['error']}")
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+  return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
 
-  md_text = str(result)
+# 流式规划（SSE）：推送任务开始/结束、工具调用、最终行程的 token 增量，以及每完成一天的 DayPlan
+@app.get("/api/v1/plan/stream")
+def stream_plan(request: Request, origin: str, cities: str, date_range: str, interests: str | None = None):
+  req = PlanRequest(origin=origin, cities=cities, date_range=date_range, interests=interests)
+  _validate_plan_request(req)
   days = parse_date_range(req.date_range)
-  return naive_markdown_to_struct(md_text, days)
+  cached = None if _cache_bypassed(request) else plan_cache.get(plan_cache_key(req))
+  events: queue.Queue = queue.Queue()
+  job = None
+  if cached is None:
+    job = _submit_plan_job(req, progress=_progress_sink(lambda event, data: events.put((event, data))))
 
-# 创建计划ICS
+  def gen():
+    if cached is not None:
+      yield _sse("cached", {})
+      for d in cached.get("days", []):
+        yield _sse("day", d)
+      yield _sse("result", cached)
+      return
+    yield _sse("job", {"job_id": job["job_id"]})
+    # 增量解析最终行程的 token 流：遇到下一天（或同级的非日期标题）即视为上一天完成
+    streamer = ItineraryParser(days)
+    deadline = time.monotonic() + PLAN_TIMEOUT
+    while True:
+      if time.monotonic() > deadline:
+        yield _sse("error", {"detail": f"规划超时，请稍后通过 /api/v1/plan/jobs/{job['job_id']}/result 获取结果"})
+        return
+      try:
+        event, data = events.get(timeout=15)
+      except queue.Empty:
+        # 心跳，防止代理断开空闲连接
+        yield ": keep-alive\n\n"
+        continue
+      if event == "token":
+        if data.get("stage") != "plan":
+          continue
+        yield _sse("token", {"delta": data.get("delta", "")})
+        for dp in streamer.feed(data.get("delta", "")):
+          yield _sse("day", DayPlan(**dp).model_dump())
+      elif event == "llm_started":
+        if data.get("stage") == "plan":
+          streamer.reset()
+      elif event == "result":
+        for dp in streamer.close():
+          yield _sse("day", DayPlan(**dp).model_dump())
+        yield _sse("result", data["plan"])
+        return
+      elif event == "error":
+        yield _sse("error", data)
+        return
+      else:
+        yield _sse(event, data)
+
+  return StreamingResponse(
+    gen(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
+# 规划结果缓存命中统计
+@app.get("/api/v1/plan/cache/stats")
+def get_plan_cache_stats():
+  return plan_cache.stats()
+
+# 网页抓取层按主机统计（延迟、缓存命中、再验证、失败）
+@app.get("/api/v1/tools/fetch/stats")
+def get_fetch_stats():
+  from tools.http_fetch import fetch_stats
+  return fetch_stats()
+
+# agent 模板池规模与健康度；agent 技术栈尚未加载时不触发加载
+@app.get("/api/v1/agents/pool")
+def get_agent_pool_stats():
+  pool_module = sys.modules.get("agents.pool")
+  if pool_module is None:
+    return {"loaded": False}
+  return {"loaded": True, **pool_module.agent_pool.stats()}
+
+# Prometheus 文本格式指标
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+  return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# 创建计划ICS：同一请求的规划结果仍在缓存中时按每日活动生成日程（见 api/exports.py），否则按日期生成占位日程；
+# 已保存的计划版本请使用 /api/v1/plans/{plan_id}/versions/{version}/export/ics
 @app.post("/api/v1/plan/ics")
 def create_plan_ics(req: PlanRequest):
-  if not req.origin or not req.cities or not req.date_range:
-    raise HTTPException(status_code=400, detail="缺少必要参数")
-  # ICS 仅按日期生成占位；不重复进行昂贵的规划
+  _validate_plan_request(req)
+  cached = plan_cache.get(plan_cache_key(req))
+  if cached is not None:
+    return {"ics": exports.render_ics(cached), "raw_markdown": cached.get("raw_markdown", "")}
+  # 不重复进行昂贵的规划
   md_text = "生成 ICS 占位：如需内容，请先调用 /api/v1/plan 获取 Markdown"
   days = parse_date_range(req.date_range)
-  # 生成极简 ICS，按天占位
-  ics_lines = [
-    "BEGIN:VCALENDAR",
-    "VERSION:2.0",
-    "PRODID:-//TripPlanner//CN",
-  ]
-  for d in days:
-    ics_lines += [
-      "BEGIN:VEVENT",
-      f"DTSTAMP:{d.replace('-', '')}T090000Z",
-      f"DTSTART;VALUE=DATE:{d.replace('-', '')}",
-      f"SUMMARY:旅行日程 {d}",
-      "END:VEVENT",
-    ]
-  ics_lines.append("END:VCALENDAR")
-  return {"ics": "\r\n".join(ics_lines), "raw_markdown": md_text}
-
-
+  placeholder = {"days": [{"date": d, "activities": [f"旅行日程 {d}"]} for d in days]}
+  return {"ics": exports.render_ics(placeholder), "raw_markdown": md_text}
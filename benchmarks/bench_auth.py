@@ -0,0 +1,128 @@
+"""登录与认证请求的负载基准：对比“主体缓存 + 口令哈希进程池”与旧路径（每次查库、线程内哈希）。
+
+每种模式在独立子进程中运行（配置在导入时读取），使用临时 SQLite 数据库与进程内 ASGI 传输，
+并发发起登录请求与带令牌的 GET /api/v1/plans 请求，输出吞吐与延迟分位：
+
+  python benchmarks/bench_auth.py
+  python benchmarks/bench_auth.py --logins 200 --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+  # 旧路径：每个认证请求查询 users 表，哈希在线程池中执行
+  "baseline": {"AUTH_PRINCIPAL_TTL": "0", "AUTH_HASH_WORKERS": "0"},
+  # 新路径：主体缓存 + 专用哈希进程池
+  "optimized": {"AUTH_PRINCIPAL_TTL": "60", "AUTH_HASH_WORKERS": str(max(1, (os.cpu_count() or 2) // 2))},
+}
+
+
+def _percentiles(samples):
+  if not samples:
+    return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+  ordered = sorted(samples)
+  pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+  return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+async def _drive(client, n, concurrency, make_request):
+  latencies = []
+  errors = 0
+  slots = asyncio.Semaphore(concurrency)
+
+  async def one(i):
+    nonlocal errors
+    async with slots:
+      start = time.perf_counter()
+      resp = await make_request(i)
+      latencies.append(time.perf_counter() - start)
+      if resp.status_code >= 400:
+        errors += 1
+
+  start = time.perf_counter()
+  await asyncio.gather(*(one(i) for i in range(n)))
+  elapsed = time.perf_counter() - start
+  return {"requests": n, "errors": errors, "seconds": round(elapsed, 3), "rps": round(n / elapsed, 1), **_percentiles(latencies)}
+
+
+async def _run(args):
+  import httpx
+  from api.db import init_db
+  from api.server import app
+
+  init_db()
+  transport = httpx.ASGITransport(app=app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+    creds = {"username": "bench", "password": "bench-password"}
+    resp = await client.post("/api/v1/auth/register", json=creds)
+    resp.raise_for_status()
+    token = resp.json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # 预热：进程池启动、连接池建立
+    await client.post("/api/v1/auth/login", json=creds)
+    await client.get("/api/v1/plans", headers=headers)
+
+    login = await _drive(client, args.logins, args.concurrency, lambda i: client.post("/api/v1/auth/login", json=creds))
+    authed = await _drive(client, args.requests, args.concurrency, lambda i: client.get("/api/v1/plans", headers=headers))
+  return {"login": login, "authenticated_get": authed}
+
+
+def run_mode(mode, args):
+  workdir = tempfile.mkdtemp(prefix="trip-bench-auth-")
+  env = dict(os.environ, **MODES[mode])
+  env.update({
+    "TRIP_DB_URL": f"sqlite:///{os.path.join(workdir, 'auth.db')}",
+    "TRIP_CACHE_DIR": os.path.join(workdir, "cache"),
+    "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+  })
+  cmd = [
+    sys.executable, os.path.abspath(__file__), "--child",
+    "--logins", str(args.logins), "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+  ]
+  proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+  for line in proc.stdout.splitlines():
+    if line.startswith("@@"):
+      return json.loads(line[2:])
+  raise RuntimeError(f"{mode} 运行失败：\n{proc.stderr[-2000:]}")
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--logins", type=int, default=100)
+  ap.add_argument("--requests", type=int, default=2000)
+  ap.add_argument("--concurrency", type=int, default=32)
+  ap.add_argument("--mode", choices=sorted(MODES), action="append", help="只运行指定模式，可重复")
+  ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+  args = ap.parse_args()
+
+  if args.child:
+    print("@@" + json.dumps(asyncio.run(_run(args))))
+    return
+
+  results = {}
+  for mode in args.mode or list(MODES):
+    results[mode] = run_mode(mode, args)
+    print(f"== {mode}: {json.dumps(results[mode], ensure_ascii=False)}")
+
+  if "baseline" in results and "optimized" in results:
+    print(f"\n{'scenario':<20}{'baseline rps':>14}{'optimized rps':>15}{'speedup':>10}{'p95 ms (base → opt)':>24}")
+    for scenario in ("login", "authenticated_get"):
+      base, opt = results["baseline"][scenario], results["optimized"][scenario]
+      speedup = opt["rps"] / base["rps"] if base["rps"] else 0.0
+      print(
+        f"{scenario:<20}{base['rps']:>14}{opt['rps']:>15}{speedup:>9.2f}x"
+        f"{str(base['p95_ms']) + ' → ' + str(opt['p95_ms']):>24}"
+      )
+
+
+if __name__ == "__main__":
+  main()
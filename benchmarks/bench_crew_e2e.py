@@ -0,0 +1,276 @@
+"""TripCrew / /api/v1/plan 端到端基准：使用本地替身服务，无需 DashScope、Serper 与 Browserless。
+
+按请求形态矩阵（候选城市数 × 天数）运行规划，记录：各阶段耗时（identify/gather/plan）、
+LLM 调用次数与 token 数、工具调用次数与峰值 RSS，结果写入 JSON，可与历史结果对比：
+
+  python benchmarks/bench_crew_e2e.py --cities 1,3,10 --days 1,7,30 --out bench.json
+  python benchmarks/bench_crew_e2e.py --target api --compare bench.json
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_servers import Counters, StubConfig, start_stubs  # noqa: E402
+
+CITY_POOL = ["杭州", "苏州", "成都", "西安", "厦门", "青岛", "大理", "桂林", "三亚", "重庆"]
+
+
+def _rss_mb():
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+  except OSError:
+    # 非 Linux：退化为进程生命周期内的峰值
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+# 运行期间后台采样 RSS，得到单次运行的峰值
+class RssSampler:
+
+  def __init__(self, interval=0.05):
+    self.interval = interval
+    self.peak = 0.0
+    self._stop = threading.Event()
+
+  def __enter__(self):
+    self.peak = _rss_mb()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      self.peak = max(self.peak, _rss_mb())
+
+  def __exit__(self, *exc):
+    self._stop.set()
+    self._thread.join()
+    self.peak = max(self.peak, _rss_mb())
+
+
+# 汇总进度事件：阶段耗时取该阶段首次开始到最后结束（并行调研时 identify 有多个任务）
+class EventLog:
+
+  def __init__(self):
+    self.t0 = time.perf_counter()
+    self.lock = threading.Lock()
+    self.stages = {}
+    self.tools = {}
+    self.first_token_s = None
+
+  def __call__(self, event, data):
+    now = time.perf_counter() - self.t0
+    with self.lock:
+      stage = data.get("stage")
+      if event == "task_started" and stage:
+        span = self.stages.setdefault(stage, [now, now])
+        span[0] = min(span[0], now)
+      elif event == "task_finished" and stage:
+        span = self.stages.setdefault(stage, [now, now])
+        span[1] = max(span[1], now)
+      elif event == "tool_started":
+        name = data.get("tool", "")
+        self.tools[name] = self.tools.get(name, 0) + 1
+      elif event == "token" and self.first_token_s is None:
+        self.first_token_s = now
+
+  def summary(self):
+    return {
+      "stages_s": {k: round(v[1] - v[0], 3) for k, v in self.stages.items()},
+      "tool_calls": dict(self.tools),
+      "first_token_s": round(self.first_token_s, 3) if self.first_token_s is not None else None,
+    }
+
+
+def request_shape(n_cities, n_days):
+  start = dt.date(2025, 10, 1)
+  end = start + dt.timedelta(days=n_days - 1)
+  return {
+    "origin": "上海",
+    "cities": ", ".join(CITY_POOL[i % len(CITY_POOL)] for i in range(n_cities)),
+    "date_range": f"{start.isoformat()} ~ {end.isoformat()}",
+    "interests": "美食, 博物馆, 漫步",
+  }
+
+
+def run_crew(payload, log):
+  from agents.main import TripCrew
+  from agents.progress import ProgressSink
+  crew = TripCrew(payload["origin"], payload["cities"], payload["date_range"], payload["interests"])
+  return str(crew.run(progress_sink=ProgressSink(log)))
+
+
+# 通过 SSE 接口驱动完整的 HTTP 路径（含任务池、解析与缓存旁路）
+def run_api(client, payload, log):
+  result = None
+  event = "message"
+  with client.stream("GET", "/api/v1/plan/stream", params=payload, headers={"cache-control": "no-cache"}) as resp:
+    resp.raise_for_status()
+    for line in resp.iter_lines():
+      if line.startswith("event:"):
+        event = line[len("event:"):].strip()
+      elif line.startswith("data:"):
+        data = json.loads(line[len("data:"):])
+        log(event, data)
+        if event == "result":
+          result = data.get("raw_markdown", "")
+        elif event == "error":
+          raise RuntimeError(data.get("detail"))
+  return result or ""
+
+
+def _git_rev():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+  except Exception:
+    return None
+
+
+def compare(current, baseline_path, threshold):
+  with open(baseline_path, encoding="utf-8") as f:
+    baseline = {r["shape"]: r for r in json.load(f)["results"]}
+  print(f"\n{'shape':<16}{'total_s':>18}{'llm_calls':>14}{'tokens':>20}{'peak_rss_mb':>18}")
+  regressions = 0
+  for row in current["results"]:
+    base = baseline.get(row["shape"])
+    if base is None:
+      continue
+    def fmt(cur, old):
+      delta = (cur - old) / old * 100 if old else 0.0
+      return f"{cur:.2f} ({delta:+.0f}%)"
+    tokens = row["llm"]["prompt_tokens"] + row["llm"]["completion_tokens"]
+    base_tokens = base["llm"]["prompt_tokens"] + base["llm"]["completion_tokens"]
+    print(
+      f"{row['shape']:<16}{fmt(row['total_s'], base['total_s']):>18}"
+      f"{fmt(row['llm']['llm_calls'], base['llm']['llm_calls']):>14}"
+      f"{fmt(tokens, base_tokens):>20}{fmt(row['peak_rss_mb'], base['peak_rss_mb']):>18}"
+    )
+    if base["total_s"] and (row["total_s"] - base["total_s"]) / base["total_s"] > threshold:
+      regressions += 1
+  return regressions
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--target", choices=["crew", "api"], default="crew")
+  ap.add_argument("--cities", default="1,3,5,10")
+  ap.add_argument("--days", default="1,7,30")
+  ap.add_argument("--first-token-latency", type=float, default=0.2, help="替身 LLM 首 token 延迟（秒）")
+  ap.add_argument("--tokens-per-sec", type=float, default=400.0, help="替身 LLM 生成速率")
+  ap.add_argument("--tool-calls-per-task", type=int, default=1)
+  ap.add_argument("--warm", action="store_true", help="保留搜索/抓取/LLM 缓存（默认每轮清空，测量冷启动）")
+  ap.add_argument("--out", default="bench_e2e.json")
+  ap.add_argument("--compare", help="与历史结果 JSON 对比")
+  ap.add_argument("--regression-threshold", type=float, default=0.2)
+  args = ap.parse_args()
+
+  config = StubConfig(args.first_token_latency, args.tokens_per_sec, args.tool_calls_per_task)
+  counters = Counters()
+  _, ports = start_stubs(config, counters)
+
+  # 必须在导入 api/agents 之前设置，配置在导入时读取
+  workdir = tempfile.mkdtemp(prefix="trip-bench-")
+  os.environ.update({
+    "LLM_API_BASE": f"http://127.0.0.1:{ports['llm']}/v1",
+    "ALI_APIKEY": "stub",
+    "SERPER_URL": f"http://127.0.0.1:{ports['search']}/search",
+    "SERPER_API_KEY": "stub",
+    "LLM_CACHE_MODE": "cache" if args.warm else "off",
+    "TRIP_CACHE_DIR": os.path.join(workdir, "cache"),
+    "TRIP_DB_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+    "CREWAI_DISABLE_TELEMETRY": "true",
+    "OTEL_SDK_DISABLED": "true",
+    "NO_PROXY": "127.0.0.1,localhost",
+  })
+  os.environ.pop("BROWSERLESS_API_KEY", None)
+
+  client = None
+  if args.target == "api":
+    from fastapi.testclient import TestClient
+    from api.server import app
+    client = TestClient(app)
+    client.__enter__()
+
+  results = []
+  for n_cities in [int(x) for x in args.cities.split(",")]:
+    for n_days in [int(x) for x in args.days.split(",")]:
+      payload = request_shape(n_cities, n_days)
+      if not args.warm:
+        for cache in list(_live_caches()):
+          cache.clear()
+      counters.reset()
+      log = EventLog()
+      start = time.perf_counter()
+      with RssSampler() as rss:
+        if client is not None:
+          markdown = run_api(client, payload, log)
+        else:
+          markdown = run_crew(payload, log)
+      total = time.perf_counter() - start
+      row = {
+        "shape": f"c{n_cities}-d{n_days}",
+        "cities": n_cities,
+        "days": n_days,
+        "total_s": round(total, 3),
+        **log.summary(),
+        "llm": {k: v for k, v in counters.snapshot().items() if k in ("llm_calls", "prompt_tokens", "completion_tokens")},
+        "stub_calls": {k: v for k, v in counters.snapshot().items() if k in ("search_calls", "page_fetches")},
+        "peak_rss_mb": round(rss.peak, 1),
+        "output_chars": len(markdown),
+      }
+      results.append(row)
+      print(json.dumps(row, ensure_ascii=False))
+
+  if client is not None:
+    client.__exit__(None, None, None)
+
+  report = {
+    "meta": {
+      "target": args.target,
+      "git_rev": _git_rev(),
+      "python": platform.python_version(),
+      "created_at": dt.datetime.now().isoformat(timespec="seconds"),
+      "stub": {
+        "first_token_latency": args.first_token_latency,
+        "tokens_per_sec": args.tokens_per_sec,
+        "tool_calls_per_task": args.tool_calls_per_task,
+        "warm": args.warm,
+      },
+    },
+    "results": results,
+  }
+  with open(args.out, "w", encoding="utf-8") as f:
+    json.dump(report, f, ensure_ascii=False, indent=2)
+  print(f"\n结果已写入 {args.out}")
+
+  if args.compare:
+    regressions = compare(report, args.compare, args.regression_threshold)
+    if regressions:
+      print(f"\n{regressions} 个形态的总耗时退化超过 {args.regression_threshold:.0%}")
+      sys.exit(1)
+
+
+# 已加载模块中的缓存实例（冷启动测量时逐轮清空）
+def _live_caches():
+  from api.cache import TieredCache
+  for module in list(sys.modules.values()):
+    for value in list(getattr(module, "__dict__", {}).values()):
+      if isinstance(value, TieredCache):
+        yield value
+
+
+if __name__ == "__main__":
+  main()
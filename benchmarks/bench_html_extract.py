@@ -0,0 +1,127 @@
+"""网页正文抽取基准：流式轻量解析（fast） vs unstructured.partition_html（partition）。
+
+用法：
+  # 先保存一批真实旅游网页到语料目录（只需一次）
+  python benchmarks/bench_html_extract.py --save https://en.wikivoyage.org/wiki/Hangzhou ...
+  # 对语料目录中的所有 *.html 运行基准
+  python benchmarks/bench_html_extract.py [--budget 16000] [--repeat 5] [--out result.json]
+
+语料目录为空时使用合成的重型页面（大量导航/脚本/正文），仅用于冒烟。
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.html_extract import extract_text  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+CHUNK = 16384
+
+
+def save_pages(urls):
+  import requests
+  from tools.http_fetch import USER_AGENT
+  os.makedirs(CORPUS_DIR, exist_ok=True)
+  for url in urls:
+    resp = requests.get(url, headers={"user-agent": USER_AGENT}, timeout=30)
+    resp.raise_for_status()
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12] + ".html"
+    with open(os.path.join(CORPUS_DIR, name), "wb") as f:
+      f.write(resp.content)
+    print(f"saved {url} -> {name} ({len(resp.content)} bytes)")
+
+
+def synthetic_page(paragraphs=4000):
+  nav = "<nav>" + "".join(f"<a href='/p{i}'>链接{i}</a>" for i in range(800)) + "</nav>"
+  scripts = "".join(f"<script>var x{i} = {'{'}a: '{'x' * 200}'{'}'};</script>" for i in range(200))
+  body = "".join(
+    f"<div class='section'><h2>景点 {i}</h2><p>这里是第 {i} 段景点介绍，包含交通、门票与开放时间等信息。</p></div>"
+    for i in range(paragraphs)
+  )
+  footer = "<footer>" + "版权所有 " * 500 + "</footer>"
+  return f"<html><head>{scripts}</head><body>{nav}<main>{body}</main>{footer}</body></html>".encode("utf-8")
+
+
+def load_corpus():
+  pages = []
+  if os.path.isdir(CORPUS_DIR):
+    for name in sorted(os.listdir(CORPUS_DIR)):
+      if name.endswith(".html"):
+        with open(os.path.join(CORPUS_DIR, name), "rb") as f:
+          pages.append((name, f.read()))
+  if not pages:
+    print("语料目录为空，使用合成页面（请用 --save 保存真实网页）", file=sys.stderr)
+    pages = [("synthetic.html", synthetic_page())]
+  return pages
+
+
+def run_fast(raw, budget):
+  chunks = (raw[i:i + CHUNK] for i in range(0, len(raw), CHUNK))
+  return extract_text(chunks, budget)
+
+
+def run_partition(raw, budget):
+  from tools.browser_tools import partition_to_text
+  return partition_to_text(raw.decode("utf-8", "replace"))[:budget]
+
+
+def measure(fn, raw, budget, repeat):
+  times = []
+  out = ""
+  for _ in range(repeat):
+    start = time.perf_counter()
+    out = fn(raw, budget)
+    times.append((time.perf_counter() - start) * 1000)
+  tracemalloc.start()
+  fn(raw, budget)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {
+    "median_ms": round(statistics.median(times), 2),
+    "min_ms": round(min(times), 2),
+    "peak_kb": round(peak / 1024, 1),
+    "chars": len(out),
+  }
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--save", nargs="*", help="抓取并保存这些 URL 到语料目录")
+  ap.add_argument("--budget", type=int, default=16000)
+  ap.add_argument("--repeat", type=int, default=5)
+  ap.add_argument("--out", help="结果写入 JSON 文件")
+  args = ap.parse_args()
+
+  if args.save:
+    save_pages(args.save)
+    return
+
+  try:
+    import unstructured  # noqa: F401
+    modes = {"fast": run_fast, "partition": run_partition}
+  except ImportError:
+    print("未安装 unstructured，仅测试 fast 模式", file=sys.stderr)
+    modes = {"fast": run_fast}
+
+  results = []
+  for name, raw in load_corpus():
+    row = {"page": name, "bytes": len(raw)}
+    for mode, fn in modes.items():
+      row[mode] = measure(fn, raw, args.budget, args.repeat)
+    results.append(row)
+    print(json.dumps(row, ensure_ascii=False))
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as f:
+      json.dump({"budget": args.budget, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
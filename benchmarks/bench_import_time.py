@@ -0,0 +1,93 @@
+"""API 服务启动开销报告：在干净的子进程中导入模块，统计导入耗时、最慢的模块与 RSS。
+
+基于 python -X importtime，默认对比 api.server（不含 agent 技术栈）与 agents.main（完整 crewai 栈）：
+
+  python benchmarks/bench_import_time.py
+  python benchmarks/bench_import_time.py --module api.server --top 30
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中执行：导入目标模块后输出耗时与 RSS
+_PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+with open("/proc/self/statm") as f:
+  rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+print("@@" + json.dumps({{"seconds": elapsed, "rss_mb": rss, "modules": len(sys.modules)}}))
+"""
+
+
+# -X importtime 的 stderr 行：import time: self [us] | cumulative | imported package
+def parse_importtime(stderr):
+  rows = []
+  for line in stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    parts = line[len("import time:"):].split("|")
+    if len(parts) != 3:
+      continue
+    name = parts[2].rstrip()
+    depth = (len(name) - len(name.lstrip())) // 2
+    rows.append({"module": name.strip(), "self_us": int(parts[0]), "cumulative_us": int(parts[1]), "depth": depth})
+  return rows
+
+
+def probe(module):
+  env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""), PREWARM_AGENTS="0")
+  proc = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+    cwd=ROOT, env=env, capture_output=True, text=True,
+  )
+  summary = None
+  for line in proc.stdout.splitlines():
+    if line.startswith("@@"):
+      summary = json.loads(line[2:])
+  if proc.returncode != 0 or summary is None:
+    tail = proc.stderr.strip().splitlines()[-5:]
+    raise RuntimeError(f"导入 {module} 失败：\n" + "\n".join(tail))
+  return summary, parse_importtime(proc.stderr)
+
+
+# 按顶层包汇总（只统计每个包的最外层导入，避免重复计入子模块）
+def by_package(rows):
+  totals = {}
+  for row in rows:
+    if row["depth"] == 1:
+      pkg = row["module"].split(".")[0]
+      totals[pkg] = totals.get(pkg, 0) + row["cumulative_us"]
+  return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--module", action="append", help="要测量的模块，可重复；默认 api.server 与 agents.main")
+  ap.add_argument("--top", type=int, default=15)
+  ap.add_argument("--json", help="结果写入 JSON 文件")
+  args = ap.parse_args()
+
+  report = {}
+  for module in args.module or ["api.server", "agents.main"]:
+    summary, rows = probe(module)
+    packages = by_package(rows)
+    report[module] = {**summary, "top_packages": packages[:args.top]}
+    print(f"\n== {module}: {summary['seconds']:.2f}s, RSS {summary['rss_mb']:.0f} MB, {summary['modules']} 个模块")
+    print(f"{'package':<32}{'cumulative_ms':>16}")
+    for pkg, us in packages[:args.top]:
+      print(f"{pkg:<32}{us / 1000:>16.1f}")
+
+  if args.json:
+    with open(args.json, "w", encoding="utf-8") as f:
+      json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,146 @@
+"""行程解析基准：单遍解析器（api/itinerary_parser.py） vs 旧版 naive_markdown_to_struct（逐标题比较所有日期）。
+
+用法：
+  python benchmarks/bench_itinerary_parser.py [--days 30,365] [--lines-per-day 60] [--subheadings 6] [--repeat 3] [--chunk 24] [--out result.json]
+
+使用合成的行程 Markdown：标题轮换多种写法（ISO 日期、10月1日、第N天、Day N、粗体行），每天含若干小节标题
+（上午/午餐/下午…）以及活动、用餐、费用与备注；
+365 天、每天 60 行时约 2~3 MB。输出每种实现的耗时、吞吐（MB/s）、识别出内容的天数与活动条数；
+stream 为按 --chunk 字符切块增量喂入（模拟 SSE token 流）。
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.itinerary_parser import ItineraryParser  # noqa: E402
+
+HEADING_STYLES = [
+  lambda _i, d: f"## {d.isoformat()} 行程",
+  lambda i, d: f"## 第{i}天：{d.month}月{d.day}日",
+  lambda i, _d: f"### Day {i} - 城市漫步",
+  lambda i, d: f"**第{i}天（{d.month}月{d.day}日）**",
+  lambda _i, d: f"## {d.year}年{d.month}月{d.day}日",
+]
+SUBHEADINGS = ["上午", "午餐", "下午", "晚餐", "晚上", "夜宵"]
+ACTIVITIES = ["参观博物馆", "漫步老街", "游船观光", "登山看日出", "逛夜市", "参观古寺", "骑行环湖", "品茶体验"]
+
+
+# 旧实现（保留用于对比）：每个标题逐一比较所有日期，只识别标题中的 ISO 日期，每天最多 10 条
+def naive_markdown_to_struct(md_text: str, days: List[str]) -> List[Dict]:
+  day_blocks: Dict[str, List[str]] = {d: [] for d in days}
+  active_day = None
+  for line in md_text.splitlines():
+    t = line.strip()
+    if t.startswith("#") or t.startswith("##") or t.startswith("###"):
+      for d in days:
+        if d in t:
+          active_day = d
+          break
+      continue
+    if active_day and t:
+      day_blocks[active_day].append(t)
+  return [{"date": d, "activities": [s for s in day_blocks.get(d, []) if s][:10]} for d in days]
+
+
+def make_plan(n_days: int, lines_per_day: int, subheadings: int = 6, seed: int = 7):
+  rng = random.Random(seed)
+  start = dt.date(2025, 1, 1)
+  days = [(start + dt.timedelta(days=i)).isoformat() for i in range(n_days)]
+  out = ["# 年度旅行计划", "", "本行程覆盖全年，每天包含活动、用餐与费用。", ""]
+  for i, d in enumerate(days, start=1):
+    date = dt.date.fromisoformat(d)
+    out.append(HEADING_STYLES[i % len(HEADING_STYLES)](i, date))
+    for k in range(lines_per_day):
+      hour = 8 + k * 12 // max(1, lines_per_day)
+      # 模型输出常见的当天小节标题（旧实现对每个标题都要比较全部日期）
+      if subheadings and k % (lines_per_day // subheadings or 1) == 0:
+        out.append(f"### {SUBHEADINGS[(k // max(1, lines_per_day // subheadings)) % len(SUBHEADINGS)]}")
+      kind = k % 6
+      if kind == 0:
+        out.append(f"- 午餐：当地特色餐厅 {rng.randint(1, 999)} 号店，人均 {rng.randint(40, 200)} 元")
+      elif kind == 1:
+        out.append(f"- 费用：交通 {rng.randint(10, 80)}-{rng.randint(80, 150)} 元")
+      elif kind == 2:
+        out.append(f"- 备注：注意天气变化，第 {k} 项活动可能需要提前预约")
+      else:
+        act = rng.choice(ACTIVITIES)
+        out.append(f"- {hour:02d}:{rng.randint(0, 59):02d} {act}（门票 ¥{rng.randint(0, 120)}），附近还有咖啡馆与书店可以顺路游览")
+    out.append("")
+  out += ["## 预算汇总", "- 全年预算约 30 万元"]
+  return "\n".join(out) + "\n", days
+
+
+def _timeit(fn, repeat):
+  samples = []
+  result = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    samples.append(time.perf_counter() - start)
+  return statistics.median(samples), result
+
+
+def _stream(text, days, chunk):
+  parser = ItineraryParser(days)
+  for i in range(0, len(text), chunk):
+    parser.feed(text[i:i + chunk])
+  parser.close()
+  return parser.result()
+
+
+def _summary(name, seconds, size, parsed):
+  return {
+    "impl": name,
+    "seconds": round(seconds, 4),
+    "mb_per_s": round(size / 1e6 / seconds, 2) if seconds else None,
+    "days_with_content": sum(1 for d in parsed if d.get("activities") or d.get("meals")),
+    "activities": sum(len(d.get("activities") or []) for d in parsed),
+    "meals": sum(len(d.get("meals") or []) for d in parsed),
+    "costs": sum(len(d.get("costs") or []) for d in parsed),
+  }
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--days", default="30,365", help="逗号分隔的行程天数")
+  ap.add_argument("--lines-per-day", type=int, default=60)
+  ap.add_argument("--subheadings", type=int, default=6, help="每天的小节标题数（如 上午/午餐/下午）")
+  ap.add_argument("--repeat", type=int, default=3)
+  ap.add_argument("--chunk", type=int, default=24, help="流式模式每次喂入的字符数")
+  ap.add_argument("--out", help="将结果写入 JSON 文件")
+  args = ap.parse_args()
+
+  results = []
+  for n_days in [int(x) for x in args.days.split(",") if x.strip()]:
+    text, days = make_plan(n_days, args.lines_per_day, args.subheadings)
+    size = len(text.encode("utf-8"))
+    print(f"\n== {n_days} 天，{size / 1e6:.2f} MB")
+    runs = [
+      ("naive", lambda text=text, days=days: naive_markdown_to_struct(text, days)),
+      ("single_pass", lambda text=text, days=days: ItineraryParser(days).parse(text)),
+      ("stream", lambda text=text, days=days: _stream(text, days, args.chunk)),
+    ]
+    for name, fn in runs:
+      seconds, parsed = _timeit(fn, args.repeat)
+      row = {"days": n_days, "bytes": size, **_summary(name, seconds, size, parsed)}
+      results.append(row)
+      print(
+        f"{name:<12}{row['seconds']:>9.3f}s{row['mb_per_s']:>9} MB/s"
+        f"  天数 {row['days_with_content']}/{n_days}  活动 {row['activities']}  用餐 {row['meals']}  费用 {row['costs']}"
+      )
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as f:
+      json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
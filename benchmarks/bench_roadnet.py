@@ -0,0 +1,170 @@
+"""离线路网基准：构建/加载耗时、双向 A* 与双向 Dijkstra（无势函数）的每秒查询数与延迟分位。
+
+用法：
+  python benchmarks/bench_roadnet.py                          # 合成城市路网（默认 300x300 网格，约 9 万节点）
+  python benchmarks/bench_roadnet.py --grid 500 --queries 500
+  python benchmarks/bench_roadnet.py --osm city.osm           # 由真实 OSM 裁剪构建（临时目录）
+  python benchmarks/bench_roadnet.py --graph .cache/roadnet   # 直接使用已构建的路网
+
+合成路网为约 100 米间距、带随机扰动的街道网格：每 10 条为主干道、每 5 条为次干道，其余为支路（部分单行），
+随机删去约 8% 的路段。查询起终点为随机节点附近的坐标；同时核对两种搜索得到的通行时间一致。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.roadnet import RoadGraph, build, parse_osm  # noqa: E402
+
+
+def make_city(size: int, spacing_m: float = 100.0, seed: int = 7):
+  rng = random.Random(seed)
+  lat0, lng0 = 30.25, 120.15
+  dlat = spacing_m / 111320.0
+  dlng = spacing_m / (111320.0 * 0.864)
+  coords = {}
+  for y in range(size):
+    for x in range(size):
+      coords[y * size + x] = (
+        lat0 + (y + rng.uniform(-0.2, 0.2)) * dlat,
+        lng0 + (x + rng.uniform(-0.2, 0.2)) * dlng,
+      )
+
+  def tags(k, horizontal):
+    if k % 10 == 0:
+      return {"highway": "primary"}
+    if k % 5 == 0:
+      return {"highway": "secondary"}
+    if k % 3 == 0:
+      # 支路单行，方向逐条交替
+      return {"highway": "residential", "oneway": "yes" if (k // 3) % 2 else "-1"}
+    return {"highway": "residential" if horizontal or k % 2 else "footway"}
+
+  ways = []
+  for y in range(size):
+    refs = [y * size + x for x in range(size)]
+    ways.extend(_split(refs, tags(y, True), rng))
+  for x in range(size):
+    refs = [y * size + x for y in range(size)]
+    ways.extend(_split(refs, tags(x, False), rng))
+  return coords, ways
+
+
+# 随机删去部分路段：把一条街拆成若干段
+def _split(refs, tags, rng, drop=0.08):
+  out, cur = [], [refs[0]]
+  for b in refs[1:]:
+    if tags["highway"] not in ("primary", "secondary") and rng.random() < drop:
+      if len(cur) > 1:
+        out.append((cur, tags))
+      cur = [b]
+    else:
+      cur.append(b)
+  if len(cur) > 1:
+    out.append((cur, tags))
+  return out
+
+
+def _percentiles(samples):
+  ordered = sorted(samples)
+
+  def pick(q):
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+  return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def _queries(graph, n, seed=11):
+  rng = random.Random(seed)
+  total = graph.meta["nodes"]
+  out = []
+
+  def jitter():
+    return rng.uniform(-0.0003, 0.0003)
+
+  for _ in range(n):
+    a, b = rng.randrange(total), rng.randrange(total)
+    out.append((
+      {"lat": float(graph.lat[a]) + jitter(), "lng": float(graph.lng[a]) + jitter()},
+      {"lat": float(graph.lat[b]) + jitter(), "lng": float(graph.lng[b]) + jitter()},
+    ))
+  return out
+
+
+def _run(graph, mode, queries, use_potential):
+  latencies, settled, found = [], [], []
+  start = time.perf_counter()
+  for a, b in queries:
+    t0 = time.perf_counter()
+    s = graph.nearest(a["lat"], a["lng"], mode)
+    t = graph.nearest(b["lat"], b["lng"], mode)
+    res = graph.search(s, t, mode, use_potential=use_potential) if s is not None and t is not None else None
+    latencies.append(time.perf_counter() - t0)
+    settled.append(res[3] if res else 0)
+    found.append(round(res[1], 2) if res else None)
+  elapsed = time.perf_counter() - start
+  row = {
+    "mode": mode,
+    "search": "bidirectional_astar" if use_potential else "bidirectional_dijkstra",
+    "queries": len(queries),
+    "qps": round(len(queries) / elapsed, 1),
+    "settled_avg": round(statistics.mean(settled), 1),
+    "found": sum(1 for f in found if f is not None),
+    **_percentiles(latencies),
+  }
+  return row, found
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--grid", type=int, default=300, help="合成网格边长（节点数 = grid^2）")
+  ap.add_argument("--osm", help="由 OSM XML 构建")
+  ap.add_argument("--graph", help="已构建的路网目录")
+  ap.add_argument("--queries", type=int, default=200)
+  ap.add_argument("--modes", default="walking,driving")
+  ap.add_argument("--out", help="将结果写入 JSON 文件")
+  args = ap.parse_args()
+
+  results = {"build": None, "runs": []}
+  with tempfile.TemporaryDirectory() as tmp:
+    path = args.graph
+    if not path:
+      path = tmp
+      t0 = time.perf_counter()
+      coords, ways = parse_osm(args.osm) if args.osm else make_city(args.grid)
+      t1 = time.perf_counter()
+      meta = build(coords, ways, path)
+      t2 = time.perf_counter()
+      size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+      results["build"] = {"source_s": round(t1 - t0, 2), "build_s": round(t2 - t1, 2), "bytes": size, **meta}
+      print(f"构建：节点 {meta['nodes']}，边 {meta['edges']}，{size / 1e6:.1f} MB，生成 {t1 - t0:.1f}s，构建 {t2 - t1:.1f}s")
+
+    t0 = time.perf_counter()
+    graph = RoadGraph(path)
+    print(f"加载（mmap）：{(time.perf_counter() - t0) * 1000:.1f} ms")
+    queries = _queries(graph, args.queries)
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+      astar, a_found = _run(graph, mode, queries, True)
+      dijkstra, d_found = _run(graph, mode, queries, False)
+      mismatched = sum(1 for x, y in zip(a_found, d_found, strict=True) if (x is None) != (y is None) or (x is not None and abs(x - y) > 0.05))
+      for row in (astar, dijkstra):
+        results["runs"].append(row)
+        print(
+          f"{mode:<8}{row['search']:<24}{row['qps']:>8} qps  p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms"
+          f"  出堆节点 {row['settled_avg']}  可达 {row['found']}/{row['queries']}"
+        )
+      print(f"{mode:<8}两种搜索结果不一致：{mismatched}")
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as f:
+      json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,273 @@
+"""端到端基准使用的本地替身服务：OpenAI 兼容对话接口、Serper 形态的搜索接口与静态网页服务。
+
+三个服务都基于标准库 http.server，在后台线程中运行，并统计调用次数与 token 数，
+供 benchmarks/bench_crew_e2e.py 使用；也可单独启动用于手工联调：
+
+  python benchmarks/stub_servers.py --llm-port 18001 --search-port 18002 --pages-port 18003
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+_TOOL_RE = re.compile(r"Tool Name: (.+?)\nTool Arguments: (\{.*?\})\n", re.S)
+_ARG_RE = re.compile(r"['\"](\w+)['\"]\s*:\s*\{")
+_DATES_RE = re.compile(r"出行日期：\s*(\d{4}-\d{1,2}-\d{1,2})\s*~\s*(\d{4}-\d{1,2}-\d{1,2})")
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+# 粗略 token 估算：中文按字、其余按 4 字符一个 token
+def approx_tokens(text):
+  cjk = len(_CJK_RE.findall(text))
+  return cjk + max(0, len(text) - cjk) // 4
+
+
+class Counters:
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.data = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "search_calls": 0, "page_fetches": 0}
+
+  def add(self, **kw):
+    with self.lock:
+      for k, v in kw.items():
+        self.data[k] += v
+
+  def snapshot(self):
+    with self.lock:
+      return dict(self.data)
+
+
+class StubConfig:
+
+  def __init__(self, first_token_latency=0.2, tokens_per_sec=200.0, tool_calls_per_task=1, answer_lines=6, pages_port=0):
+    self.first_token_latency = first_token_latency
+    self.tokens_per_sec = tokens_per_sec
+    self.tool_calls_per_task = tool_calls_per_task
+    self.answer_lines = answer_lines
+    self.pages_port = pages_port
+
+
+def _tool_action(prompt, used, config):
+  tools = _TOOL_RE.findall(prompt)
+  if not tools or used >= config.tool_calls_per_task:
+    return None
+  name, args_text = tools[used % len(tools)]
+  args = {}
+  for arg in _ARG_RE.findall(args_text):
+    if "query" in arg:
+      args[arg] = "杭州 旅游 景点 推荐"
+    elif arg in ("website", "url"):
+      args[arg] = f"http://127.0.0.1:{config.pages_port}/page/{used}.html"
+    elif arg in ("operation", "expression"):
+      args[arg] = "300*7+1200"
+    else:
+      args[arg] = "test"
+  return (
+    "Thought: 需要先查询相关信息\n"
+    f"Action: {name.strip()}\n"
+    f"Action Input: {json.dumps(args, ensure_ascii=False)}"
+  )
+
+
+# 生成最终答案：带日期区间的提示词生成按天的 Markdown 行程，否则生成报告文本
+def _final_answer(prompt, config):
+  m = _DATES_RE.search(prompt)
+  lines = ["Thought: I now can give a great answer", "Final Answer:"]
+  if m and "Markdown 行程" in prompt:
+    start = dt.date.fromisoformat(_iso(m.group(1)))
+    end = dt.date.fromisoformat(_iso(m.group(2)))
+    day = start
+    i = 1
+    lines.append("# 行程规划")
+    while day <= end:
+      lines.append(f"## 第{i}天 {day.isoformat()}")
+      for j in range(config.answer_lines):
+        lines.append(f"- {8 + j}:00 参观景点{j}，门票约 {50 + j * 10} 元")
+      lines.append("- 午餐：当地特色餐厅，人均 80 元")
+      day += dt.timedelta(days=1)
+      i += 1
+    lines.append("## 预算\n- 总计约 5000 元")
+  else:
+    lines.append("最终选择：杭州")
+    lines += [f"- 调研要点 {j}：天气晴朗，交通便利，费用适中。" for j in range(config.answer_lines)]
+  return "\n".join(lines)
+
+
+def _iso(s):
+  y, mth, d = s.split("-")
+  return f"{int(y):04d}-{int(mth):02d}-{int(d):02d}"
+
+
+def make_llm_handler(config, counters):
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+      pass
+
+    def do_POST(self):
+      body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+      messages = body.get("messages", [])
+      prompt = "\n".join(str(m.get("content", "")) for m in messages)
+      used = prompt.count("Observation:")
+      text = _tool_action(prompt, used, config) or _final_answer(prompt, config)
+      prompt_tokens = approx_tokens(prompt)
+      completion_tokens = approx_tokens(text)
+      counters.add(llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+      usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+      time.sleep(config.first_token_latency)
+      if body.get("stream"):
+        self._stream(body, text, usage)
+      else:
+        time.sleep(completion_tokens / config.tokens_per_sec)
+        self._json({
+          "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "stub"),
+          "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+          "usage": usage,
+        })
+
+    def _json(self, data):
+      raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+      self.send_response(200)
+      self.send_header("content-type", "application/json")
+      self.send_header("content-length", str(len(raw)))
+      self.end_headers()
+      self.wfile.write(raw)
+
+    def _stream(self, body, text, usage):
+      self.send_response(200)
+      self.send_header("content-type", "text/event-stream")
+      self.send_header("connection", "close")
+      self.end_headers()
+      step = 8
+      for i in range(0, len(text), step):
+        piece = text[i:i + step]
+        chunk = {
+          "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "stub"),
+          "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+        }
+        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+        time.sleep(approx_tokens(piece) / config.tokens_per_sec)
+      final = {
+        "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage,
+      }
+      self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+      self.wfile.flush()
+      self.close_connection = True
+
+  return Handler
+
+
+def make_search_handler(config, counters):
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+      pass
+
+    def do_POST(self):
+      body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+      counters.add(search_calls=1)
+      n = int(body.get("num", 8))
+      data = {
+        "searchParameters": {"q": body.get("q", "")},
+        "organic": [
+          {
+            "title": f"{body.get('q', '')} 攻略 {i}",
+            "link": f"http://127.0.0.1:{config.pages_port}/page/{i}.html",
+            "snippet": "本地替身搜索结果，包含景点、交通与美食信息。",
+          }
+          for i in range(n)
+        ],
+      }
+      raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+      self.send_response(200)
+      self.send_header("content-type", "application/json")
+      self.send_header("content-length", str(len(raw)))
+      self.end_headers()
+      self.wfile.write(raw)
+
+  return Handler
+
+
+def _page(name):
+  if os.path.isdir(CORPUS_DIR):
+    pages = sorted(p for p in os.listdir(CORPUS_DIR) if p.endswith(".html"))
+    if pages:
+      digits = "".join(ch for ch in name if ch.isdigit()) or "0"
+      with open(os.path.join(CORPUS_DIR, pages[int(digits) % len(pages)]), "rb") as f:
+        return f.read()
+  body = "".join(f"<p>景点 {i}：开放时间 9:00-17:00，门票 {40 + i} 元。</p>" for i in range(400))
+  return f"<html><body><nav>首页 攻略 酒店</nav><main>{body}</main><footer>版权</footer></body></html>".encode("utf-8")
+
+
+def make_pages_handler(config, counters):
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+      pass
+
+    def do_GET(self):
+      counters.add(page_fetches=1)
+      raw = _page(self.path)
+      self.send_response(200)
+      self.send_header("content-type", "text/html; charset=utf-8")
+      self.send_header("content-length", str(len(raw)))
+      self.send_header("etag", f'"{len(raw)}"')
+      self.end_headers()
+      self.wfile.write(raw)
+
+  return Handler
+
+
+# 启动三个替身服务，返回 (servers, ports)
+def start_stubs(config, counters, llm_port=0, search_port=0, pages_port=0):
+  pages = ThreadingHTTPServer(("127.0.0.1", pages_port), make_pages_handler(config, counters))
+  config.pages_port = pages.server_address[1]
+  llm = ThreadingHTTPServer(("127.0.0.1", llm_port), make_llm_handler(config, counters))
+  search = ThreadingHTTPServer(("127.0.0.1", search_port), make_search_handler(config, counters))
+  servers = {"llm": llm, "search": search, "pages": pages}
+  for server in servers.values():
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+  return servers, {name: s.server_address[1] for name, s in servers.items()}
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--llm-port", type=int, default=18001)
+  ap.add_argument("--search-port", type=int, default=18002)
+  ap.add_argument("--pages-port", type=int, default=18003)
+  ap.add_argument("--first-token-latency", type=float, default=0.2)
+  ap.add_argument("--tokens-per-sec", type=float, default=200.0)
+  args = ap.parse_args()
+  config = StubConfig(args.first_token_latency, args.tokens_per_sec)
+  _, ports = start_stubs(config, Counters(), args.llm_port, args.search_port, args.pages_port)
+  print(json.dumps(ports))
+  print(f"LLM_API_BASE=http://127.0.0.1:{ports['llm']}/v1  SERPER_URL=http://127.0.0.1:{ports['search']}/search")
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试使用临时目录中的 SQLite 与缓存目录；需在导入 api 之前设置
+_TMP = tempfile.mkdtemp(prefix="trip_agent_tests_")
+os.environ.setdefault("TRIP_DB_URL", f"sqlite:///{os.path.join(_TMP, 'test.db')}")
+os.environ.setdefault("TRIP_CACHE_DIR", os.path.join(_TMP, "cache"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# 每个测试使用重建的空库
+@pytest.fixture
+def db():
+    from api import plan_store
+    from api.db import Base, SessionLocal, engine, init_db
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    plan_store.version_cache.clear()
+    with SessionLocal() as session:
+        yield session
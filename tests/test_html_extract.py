@@ -0,0 +1,45 @@
+import pytest
+
+from tools.html_extract import extract_text
+
+
+# 被丢弃子树内未闭合的 li/p 等标签不能吞掉后面的正文
+@pytest.mark.parametrize("raw, expected", [
+    (b"<html><body><nav><ul><li>Home<li>About</ul></nav><main><p>West Lake is great.</p></main>", "West Lake is great."),
+    (b"<div class='menu'><p>Menu<div><p>Sub</div></div><p>Body text</p>", "Body text"),
+    (b"<footer><p>a<p>b</footer><article><p>One<p>Two</article>", "One\n\nTwo"),
+    (b"<nav><nav><li>x</nav><li>y</nav><p>After</p>", "After"),
+    (b"<aside><br><img src=x><p>side</aside><p>Main</p>", "Main"),
+])
+def test_unclosed_tags_inside_skipped_subtree(raw, expected):
+    assert extract_text([raw], 1000) == expected
+
+
+def test_script_and_boilerplate_dropped():
+    raw = (
+        b"<head><script>var a = '<p>not text</p>';</script><style>p{}</style></head>"
+        b"<body><div id='cookie-banner'>Accept cookies</div><h1>Hangzhou</h1><p>West Lake</p></body>"
+    )
+    assert extract_text([raw], 1000) == "Hangzhou\n\nWest Lake"
+
+
+def test_budget_stops_early():
+    raw = b"<p>" + b"x" * 50 + b"</p>"
+    consumed = []
+
+    def chunks():
+        for _ in range(100):
+            consumed.append(1)
+            yield raw
+
+    text = extract_text(chunks(), 120)
+    assert len(text) <= 120
+    assert len(consumed) < 100
+
+
+def test_chunk_boundaries_and_charset():
+    raw = "<meta charset='gbk'><p>杭州西湖</p><p>灵隐寺</p>".encode("gbk")
+    # 字符集从首个分块嗅探；其余分块切在多字节字符中间
+    head = raw.index(b"<p>")
+    chunks = [raw[:head]] + [raw[i:i + 3] for i in range(head, len(raw), 3)]
+    assert extract_text(chunks, 1000) == "杭州西湖\n\n灵隐寺"
@@ -0,0 +1,88 @@
+import pytest
+
+from api.itinerary_parser import DayMatcher, ItineraryParser, budget_from_days, parse_amount
+
+DAYS = ["2025-10-01", "2025-10-02", "2025-10-03"]
+
+# 第 1 天：活动行带价格，费用小节重复列出同样的明细并给出合计，实际花费 45+55+100+40+35 = 275
+SAMPLE = """# 杭州三日游
+
+## 第1天：西湖
+### 上午
+- 09:00 灵隐寺（门票 45元）
+- 11:00 西湖游船 55元
+### 下午
+- 午餐：知味观，人均 100 元
+- 15:00 雷峰塔 40元
+### 费用
+- 门票：45元
+- 游船：55元
+- 餐饮：100元
+- 雷峰塔：40元
+- 交通：35元
+- 合计：275元
+
+## 第2天
+- 上午 西溪湿地 门票80元
+- 晚餐：楼外楼 150元
+- 总计：230元
+
+## 第3天
+- 返程
+- 小计：约 120 元
+
+## 预算汇总
+- 总计：625元
+"""
+
+
+def test_budget_skips_totals_and_repeated_items():
+    days = ItineraryParser(DAYS).parse(SAMPLE)
+    budget = budget_from_days(days)
+    assert budget["per_day"] == {"2025-10-01": 275.0, "2025-10-02": 230.0, "2025-10-03": 120.0}
+    assert budget["total"] == 625.0
+
+
+def test_cost_section_replaces_activity_prices():
+    day = ItineraryParser(DAYS).parse(SAMPLE)[0]
+    items = [c["item"] for c in day["costs"]]
+    assert "11:00 西湖游船 55元" not in items
+    assert "餐饮：100元" in items
+    assert [c for c in day["costs"] if c.get("total")] == [{"item": "合计：275元", "amount": 275.0, "total": True}]
+    assert "知味观，人均 100 元" in day["meals"]
+
+
+def test_streaming_matches_single_pass():
+    parser = ItineraryParser(DAYS)
+    done = []
+    for i in range(0, len(SAMPLE), 7):
+        done.extend(parser.feed(SAMPLE[i:i + 7]))
+    done.extend(parser.close())
+    assert [d["date"] for d in done] == DAYS
+    assert done == ItineraryParser(DAYS).parse(SAMPLE)
+
+
+@pytest.mark.parametrize("heading, expected", [
+    ("2025-10-02 西溪", "2025-10-02"),
+    ("2025/10/03", "2025-10-03"),
+    ("2025年10月1日", "2025-10-01"),
+    ("10月2日 别太赶", "2025-10-02"),
+    ("10/03", "2025-10-03"),
+    ("第二天", "2025-10-02"),
+    ("Day 3", "2025-10-03"),
+    ("D1", "2025-10-01"),
+    ("第4天", None),
+    ("预算汇总", None),
+])
+def test_day_matcher(heading, expected):
+    assert DayMatcher(DAYS).match(heading) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("门票 45元", 45.0),
+    ("¥80-120", 120.0),
+    ("人均 100~150 块", 150.0),
+    ("步行 10 分钟", None),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
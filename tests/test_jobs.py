@@ -0,0 +1,66 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from api import jobs
+
+
+def _echo(params, **_):
+    return {"echo": params}
+
+
+@pytest.fixture
+def lost_claim(db, monkeypatch):  # noqa: ARG001
+    # 模拟抢占失败：任务已被其他 worker 置为 running，本进程的 Future 返回 None
+    def claim(job_id):
+        jobs._update(job_id, status="running")
+        return False
+
+    monkeypatch.setattr(jobs, "_claim", claim)
+    jobs.register_runner("echo", _echo)
+    job_id = jobs.submit_job("echo", {"x": 1})["job_id"]
+    # 等本进程的执行线程完成抢占，之后的状态变化都来自“其他 worker”
+    with jobs._lock:
+        future = jobs._futures.get(job_id)
+    if future is not None:
+        assert future.result(timeout=5) is None
+    return job_id
+
+
+def _finish_later(job_id, **fields):
+    timer = threading.Timer(0.2, jobs._update, args=(job_id,), kwargs=fields)
+    timer.start()
+    return timer
+
+
+@pytest.mark.usefixtures("db")
+def test_wait_job_runs_own_job():
+    jobs.register_runner("echo", _echo)
+    job_id = jobs.submit_job("echo", {"x": 1})["job_id"]
+    assert jobs.wait_job(job_id, timeout=5) == {"echo": {"x": 1}}
+    assert jobs.get_job(job_id)["status"] == "succeeded"
+
+
+def test_wait_job_follows_job_claimed_elsewhere(lost_claim):
+    _finish_later(lost_claim, status="succeeded", result={"from": "other worker"}).join()
+    assert jobs.wait_job(lost_claim, timeout=5, poll=0.05) == {"from": "other worker"}
+
+
+def test_wait_job_polls_until_other_worker_finishes(lost_claim):
+    timer = _finish_later(lost_claim, status="succeeded", result={"from": "other worker"})
+    try:
+        assert jobs.wait_job(lost_claim, timeout=5, poll=0.05) == {"from": "other worker"}
+    finally:
+        timer.join()
+
+
+def test_wait_job_reports_failure_elsewhere(lost_claim):
+    _finish_later(lost_claim, status="failed", error="ValueError: boom").join()
+    with pytest.raises(RuntimeError, match="boom"):
+        jobs.wait_job(lost_claim, timeout=5, poll=0.05)
+
+
+def test_wait_job_times_out_while_running_elsewhere(lost_claim):
+    with pytest.raises(concurrent.futures.TimeoutError):
+        jobs.wait_job(lost_claim, timeout=0.2, poll=0.05)
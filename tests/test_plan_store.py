@@ -0,0 +1,200 @@
+import copy
+import sqlite3
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from api import plan_store
+from api.db import PlanVersion, User
+from api.plan_store import apply_patch, diff, encode_version, load_version, migrate_plan, save_version
+
+
+def _plan_doc(days=12):
+    return {
+        "title": "杭州三日游",
+        "cities": ["杭州"],
+        "days": [
+            {"date": f"2025-10-{d:02d}", "items": [{"name": f"景点{d}-{i}", "cost": 50 + i, "note": "步行"} for i in range(6)]}
+            for d in range(1, days + 1)
+        ],
+    }
+
+
+def _rows(db, plan_id):
+    return db.execute(
+        select(PlanVersion.version, PlanVersion.kind, PlanVersion.base_version)
+        .where(PlanVersion.plan_id == plan_id)
+        .order_by(PlanVersion.version)
+    ).all()
+
+
+def _user(db):
+    user = User(username="tester", password_hash="x")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+@pytest.mark.parametrize("old, new", [
+    ({"a": 1}, {"a": True}),
+    ({"a": True}, {"a": 1}),
+    ({"a": 1}, {"a": 1.0}),
+    ({"a": [0, 1]}, {"a": [False, True]}),
+    ({"a": {"b": [1.0]}}, {"a": {"b": [1]}}),
+])
+def test_diff_keeps_json_types(old, new):
+    patch = diff(old, new)
+    assert patch
+    result = apply_patch(copy.deepcopy(old), patch)
+    assert result == new
+    assert repr(result) == repr(new)
+
+
+@pytest.mark.parametrize("old, new", [
+    (_plan_doc(), _plan_doc()),
+    (_plan_doc(), {**_plan_doc(), "title": "杭州四日游"}),
+    (_plan_doc(3), _plan_doc(5)),
+    (_plan_doc(5), _plan_doc(2)),
+    ({"a/b": 1, "c~d": {"e": [1, 2]}}, {"a/b": 2, "c~d": {"e": [1, 2, 3]}}),
+    ({"a": [1, 2, 3]}, {"a": {"0": 1}}),
+    ({"a": None}, {"a": "x", "b": None}),
+    ([1, 2], {"root": "replaced"}),
+])
+def test_diff_patch_round_trip(old, new):
+    result = apply_patch(copy.deepcopy(old), diff(old, new))
+    assert result == new
+    assert repr(result) == repr(new)
+    assert diff(new, new) == []
+
+
+def test_snapshot_boundary(db, monkeypatch):
+    monkeypatch.setattr(plan_store, "PLAN_SNAPSHOT_EVERY", 3)
+    user_id = _user(db)
+    saved = {}
+    for v in range(1, 9):
+        doc = _plan_doc()
+        doc["days"][v % 12]["items"][0]["cost"] = v
+        plan_id, version = save_version(db, user_id, "杭州", doc)
+        saved[version] = doc
+    rows = _rows(db, plan_id)
+    kinds = {version: kind for version, kind, _ in rows}
+    # 版本 1、4、7 为完整快照（(v - 1) % 3 == 0），其余为相对上一版本的补丁
+    assert [v for v, k in kinds.items() if k == "full"] == [1, 4, 7]
+    assert all(base == version - 1 for version, kind, base in rows if kind == "delta")
+
+    plan_store.version_cache.clear()
+    for version, doc in saved.items():
+        assert load_version(db, plan_id, version) == doc
+
+
+def test_encode_falls_back_to_full_when_base_missing(db):
+    user_id = _user(db)
+    plan_id, _ = save_version(db, user_id, "杭州", _plan_doc())
+    plan_store.version_cache.clear()
+    # 版本 2 不存在：版本 3 无法基于它生成补丁，退化为完整快照
+    kind, base_version, stored = encode_version(db, plan_id, 3, _plan_doc(), mode="delta")
+    assert (kind, base_version) == ("full", None)
+    assert stored == _plan_doc()
+
+
+def test_encode_uses_full_for_large_changes(db):
+    user_id = _user(db)
+    plan_id, _ = save_version(db, user_id, "杭州", _plan_doc())
+    kind, _, _ = encode_version(db, plan_id, 2, {"title": "完全不同的计划"}, mode="delta")
+    assert kind == "full"
+
+
+def test_migrate_delta_full_delta(db):
+    user_id = _user(db)
+    saved = {}
+    for v in range(1, 7):
+        doc = _plan_doc()
+        doc["days"][0]["items"][v % 6]["note"] = f"第 {v} 次修改"
+        doc["flag"] = v % 2 == 0
+        plan_id, version = save_version(db, user_id, "杭州", doc)
+        saved[version] = doc
+    assert [kind for _, kind, _ in _rows(db, plan_id)] == ["full"] + ["delta"] * 5
+
+    stats = migrate_plan(db, plan_id, "full")
+    assert stats["versions"] == 6
+    assert stats["bytes_after"] > stats["bytes_before"]
+    assert [kind for _, kind, _ in _rows(db, plan_id)] == ["full"] * 6
+    plan_store.version_cache.clear()
+    assert {v: load_version(db, plan_id, v) for v in saved} == saved
+
+    stats = migrate_plan(db, plan_id, "delta")
+    assert stats["bytes_after"] < stats["bytes_before"]
+    assert [kind for _, kind, _ in _rows(db, plan_id)] == ["full"] + ["delta"] * 5
+    plan_store.version_cache.clear()
+    for version, doc in saved.items():
+        loaded = load_version(db, plan_id, version)
+        assert loaded == doc
+        assert loaded["flag"] is doc["flag"]
+
+
+def test_migrate_dry_run_writes_nothing(db):
+    user_id = _user(db)
+    for v in range(1, 4):
+        doc = _plan_doc()
+        doc["title"] = f"v{v}"
+        plan_id, _ = save_version(db, user_id, "杭州", doc)
+    before = _rows(db, plan_id)
+    migrate_plan(db, plan_id, "full", dry_run=True)
+    db.expire_all()
+    assert _rows(db, plan_id) == before
+
+
+class _DBError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("exc", [
+    OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked")),
+    OperationalError("INSERT", {}, _DBError(1213, "Deadlock found when trying to get lock")),
+    OperationalError("INSERT", {}, _DBError(1205, "Lock wait timeout exceeded")),
+    IntegrityError("INSERT", {}, _DBError(1062, "Duplicate entry")),
+])
+def test_save_retries_lock_errors(db, monkeypatch, exc):
+    user_id = _user(db)
+    append = plan_store._append_in_txn
+    failures = [exc]
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return append(*args, **kwargs)
+
+    monkeypatch.setattr(plan_store, "_append_in_txn", flaky)
+    delays = []
+    plan_id, version = save_version(db, user_id, "杭州", _plan_doc(), sleep=delays.append)
+    assert version == 1
+    assert len(delays) == 1
+    plan_store.version_cache.clear()
+    assert load_version(db, plan_id, version) == _plan_doc()
+
+
+def test_save_does_not_retry_other_operational_errors(db, monkeypatch):
+    user_id = _user(db)
+
+    def broken(*_args, **_kwargs):
+        raise OperationalError("INSERT", {}, _DBError(2006, "MySQL server has gone away"))
+
+    monkeypatch.setattr(plan_store, "_append_in_txn", broken)
+    delays = []
+    with pytest.raises(OperationalError):
+        save_version(db, user_id, "杭州", _plan_doc(), sleep=delays.append)
+    assert delays == []
+
+
+def test_save_gives_up_after_retries(db, monkeypatch):
+    user_id = _user(db)
+
+    def locked(*_args, **_kwargs):
+        raise OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked"))
+
+    monkeypatch.setattr(plan_store, "_append_in_txn", locked)
+    delays = []
+    with pytest.raises(OperationalError):
+        save_version(db, user_id, "杭州", _plan_doc(), retries=2, sleep=delays.append)
+    assert len(delays) == 2
@@ -0,0 +1,41 @@
+import pytest
+
+from api.replan import choose_mode, mentioned_days
+
+DAYS = ["2025-10-01", "2025-10-02", "2025-10-03"]
+REQ = {"origin": "上海", "cities": "杭州", "date_range": "2025-10-01 - 2025-10-03", "interests": "美食,自然"}
+STAGES = {"identify": "x", "gather": "y", "plan": "z"}
+
+
+@pytest.mark.parametrize("feedback, expected", [
+    ("10月2日别太赶", ["2025-10-02"]),
+    ("2025-10-03 想吃火锅", ["2025-10-03"]),
+    ("2025/10/01 加个博物馆", ["2025-10-01"]),
+    ("10/02 少走路", ["2025-10-02"]),
+    ("第三天和Day 1 换个景点", ["2025-10-01", "2025-10-03"]),
+    ("第二天太累", ["2025-10-02"]),
+    ("第5天", []),
+    ("整体轻松一点", []),
+])
+def test_mentioned_days(feedback, expected):
+    assert mentioned_days(feedback, DAYS) == expected
+
+
+def test_choose_mode_rewrites_mentioned_days():
+    assert choose_mode(REQ, dict(REQ), STAGES, "10月2日别太赶", DAYS, DAYS) == ("days", ["2025-10-02"])
+
+
+@pytest.mark.parametrize("feedback, new, expected", [
+    ("整体轻松一点", {}, "plan"),
+    ("10月2日别太赶", {"interests": "自然、美食"}, "days"),
+    ("多吃点本地菜", {"interests": "美食,博物馆"}, "guide"),
+    ("换个城市", {}, "full"),
+    ("推迟一天出发", {}, "full"),
+    ("10月2日别太赶", {"cities": "苏州"}, "full"),
+])
+def test_choose_mode(feedback, new, expected):
+    assert choose_mode(REQ, {**REQ, **new}, STAGES, feedback, DAYS, DAYS)[0] == expected
+
+
+def test_choose_mode_without_stages_is_full():
+    assert choose_mode(REQ, dict(REQ), None, "10月2日别太赶", DAYS, DAYS) == ("full", [])
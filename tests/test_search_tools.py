@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("crewai")
+
+from tools.search_tools import _features, _jaccard, normalize_query  # noqa: E402
+
+
+def _sim(a, b):
+    return _jaccard(_features(normalize_query(a)), _features(normalize_query(b)))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("東京 ラーメン おすすめ", "東京 すし おすすめ"),
+    ("서울 맛집 추천", "서울 호텔 추천"),
+    ("crème brûlée paris", "crêpe paris"),
+    ("北京到上海 高铁", "上海到北京 高铁"),
+])
+def test_distinct_queries_not_merged(a, b):
+    assert _sim(a, b) < 0.8
+
+
+@pytest.mark.parametrize("a, b", [
+    ("杭州 西湖 门票", "杭州西湖门票"),
+    ("東京 ラーメン", "東京ラーメン"),
+    ("Hangzhou West-Lake", "hangzhou west lake"),
+])
+def test_spacing_and_punctuation_ignored(a, b):
+    assert _sim(a, b) == 1.0
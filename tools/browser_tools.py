@@ -1,9 +1,19 @@
-import json
 import os
 
-import requests
 from crewai.tools import BaseTool # 导入crewai内置的tools工具
-from unstructured.partition.html import partition_html
+
+from api.config import SCRAPE_EXTRACT_MODE, SCRAPE_MAX_CHARS
+from api.metrics import track_tool
+from tools.html_extract import consume_response
+from tools.http_fetch import fetch_page, fetch_rendered
+
+
+# 高保真模式：unstructured 解析完整 DOM（较慢、占内存，按需导入）
+def partition_to_text(html: str) -> str:
+  from unstructured.partition.html import partition_html
+  elements = partition_html(text=html)
+  return "\n\n".join([str(el) for el in elements])
+
 
 # 浏览器自动化工具
 class ScrapeWebsiteTool(BaseTool):
@@ -13,36 +23,31 @@ class ScrapeWebsiteTool(BaseTool):
   )
 
   def _run(self, website: str) -> str:
+    with track_tool("scrape") as outcome:
+      return self._scrape(website, outcome)
+
+  def _scrape(self, website: str, outcome: dict) -> str:
 
-    # 可以使用browserless的api来抓取网站内容
+    # 可以使用browserless的api来抓取网站内容；抓取走共享连接池与页面缓存（见 tools/http_fetch.py）
     api_key = os.environ.get('BROWSERLESS_API_KEY')
+    fetch = (lambda **kw: fetch_rendered(website, api_key, **kw)) if api_key else (lambda **kw: fetch_page(website, **kw))
     try:
-      if api_key:
-        url = f"https://chrome.browserless.io/content?token={api_key}"
-        payload = json.dumps({"url": website})
-        headers = {'cache-control': 'no-cache', 'content-type': 'application/json'}
-        response = requests.request("POST", url, headers=headers, data=payload, timeout=60)
-        response.raise_for_status()
-        html = response.text
-
-      # 如果api_key不存在，则使用默认的浏览器工具
-      else:
-        headers = {
-          'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
-        }
-        response = requests.get(website, headers=headers, timeout=30)
-        response.raise_for_status()
-        html = response.text
-    
-      # 获取到浏览器返回的内容
-      elements = partition_html(text=html)
-      content = "\n\n".join([str(el) for el in elements])
-
-      # 如果内容长度大于16000，则截取前16000个字符
-      if len(content) > 16000:
-        content = content[:16000]
+      # 默认：流式抽取正文，丢弃导航/脚本/页脚，字符数达到上限后停止下载与解析
+      if SCRAPE_EXTRACT_MODE != "partition":
+        return fetch(
+          consume=lambda resp: consume_response(resp, SCRAPE_MAX_CHARS),
+          variant=f"text:{SCRAPE_MAX_CHARS}",
+        )
+
+      # 高保真：获取完整 HTML 后交给 unstructured 解析
+      content = partition_to_text(fetch())
+
+      # 如果内容长度大于上限，则截取前 SCRAPE_MAX_CHARS 个字符
+      if len(content) > SCRAPE_MAX_CHARS:
+        content = content[:SCRAPE_MAX_CHARS]
       return content
     except Exception as e:
+      outcome["status"] = "error"
       return f"[BrowserTools] 抓取失败: {type(e).__name__}: {e}"
 
 
@@ -3,6 +3,8 @@ import ast
 import operator
 import re
 
+from api.metrics import track_tool
+
 # 计算器工具，方便进行预算开销的计算
 class CalculatorTool(BaseTool):
   name: str = "计算器工具"
@@ -12,6 +14,10 @@ class CalculatorTool(BaseTool):
   )
 
   def _run(self, operation: str):
+    with track_tool("calculator"):
+      return self._calculate(operation)
+
+  def _calculate(self, operation: str):
     try:
       allowed_operators = {
           ast.Add: operator.add,
@@ -0,0 +1,140 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Union
+
+# 整棵子树丢弃的标签：脚本、样式与常见的页面骨架（导航、页眉页脚、侧栏、表单）
+SKIP_TAGS = {
+  "script", "style", "noscript", "template", "svg", "canvas", "iframe",
+  "nav", "header", "footer", "aside", "form", "button", "select", "dialog",
+}
+# 块级标签：进入/离开时切分段落
+BLOCK_TAGS = {
+  "p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd",
+  "h1", "h2", "h3", "h4", "h5", "h6", "tr", "table", "thead", "tbody",
+  "blockquote", "pre", "figcaption", "br", "hr", "td", "th",
+}
+VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "area", "base", "col", "embed", "source", "track", "wbr", "param"}
+# class/id 命中这些关键词的元素视为样板内容（菜单、面包屑、cookie 提示、广告等）
+BOILERPLATE_RE = re.compile(
+  r"(^|[-_\s])(nav|navbar|menu|breadcrumbs?|footer|sidebar|cookie|banner|advert|ads?|share|social|related|comments?|popup|modal)($|[-_\s])",
+  re.I,
+)
+_WS_RE = re.compile(r"\s+")
+_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+
+# 增量 HTML 正文抽取：边 feed 边产出段落，丢弃样板内容，文本达到预算后停止
+class BoundedTextExtractor(HTMLParser):
+
+  def __init__(self, budget: int = 16000):
+    super().__init__(convert_charrefs=True)
+    self.budget = budget
+    self.parts: List[str] = []
+    self.size = 0
+    self._block: List[str] = []
+    # 被丢弃子树的根标签及其同名标签的嵌套深度；子树内只计同名标签，未闭合的 li/p 等不影响退出
+    self._skip_tag: Optional[str] = None
+    self._skip_depth = 0
+
+  @property
+  def done(self) -> bool:
+    return self.size >= self.budget
+
+  def feed(self, data: str) -> None:
+    if not self.done:
+      super().feed(data)
+
+  def handle_starttag(self, tag, attrs):
+    if self._skip_depth:
+      if tag == self._skip_tag:
+        self._skip_depth += 1
+      return
+    if tag in SKIP_TAGS or self._is_boilerplate(attrs):
+      if tag not in VOID_TAGS:
+        self._flush()
+        self._skip_tag = tag
+        self._skip_depth = 1
+      return
+    if tag in BLOCK_TAGS:
+      self._flush()
+
+  def handle_startendtag(self, tag, attrs):
+    if not self._skip_depth and tag in BLOCK_TAGS:
+      self._flush()
+
+  def handle_endtag(self, tag):
+    if self._skip_depth:
+      if tag == self._skip_tag:
+        self._skip_depth -= 1
+        if not self._skip_depth:
+          self._skip_tag = None
+      return
+    if tag in BLOCK_TAGS:
+      self._flush()
+
+  def handle_data(self, data):
+    if not self._skip_depth and not self.done:
+      self._block.append(data)
+
+  def _is_boilerplate(self, attrs) -> bool:
+    for name, value in attrs:
+      if name in ("class", "id", "role") and value and BOILERPLATE_RE.search(value):
+        return True
+    return False
+
+  def _flush(self) -> None:
+    if not self._block:
+      return
+    text = _WS_RE.sub(" ", "".join(self._block)).strip()
+    self._block = []
+    if not text or self.done:
+      return
+    remaining = self.budget - self.size
+    text = text[:remaining]
+    self.parts.append(text)
+    self.size += len(text) + 2
+
+  def text(self) -> str:
+    self._flush()
+    return "\n\n".join(self.parts)[:self.budget]
+
+
+# 从字节流中抽取正文：增量解码 + 增量解析，预算用尽立即停止读取
+def extract_text(
+  chunks: Iterable[Union[bytes, str]],
+  budget: int = 16000,
+  encoding: Optional[str] = None,
+) -> str:
+  parser = BoundedTextExtractor(budget)
+  decoder = None
+  for chunk in chunks:
+    if not chunk:
+      continue
+    if isinstance(chunk, bytes):
+      if decoder is None:
+        enc = encoding or _sniff_charset(chunk) or "utf-8"
+        try:
+          decoder = codecs.getincrementaldecoder(enc)(errors="replace")
+        except LookupError:
+          decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+      chunk = decoder.decode(chunk)
+    parser.feed(chunk)
+    if parser.done:
+      break
+  return parser.text()
+
+
+def _sniff_charset(head: bytes) -> Optional[str]:
+  m = _CHARSET_RE.search(head[:4096])
+  return m.group(1).decode("ascii", "ignore") if m else None
+
+
+# 供抓取层使用：以流式方式消费 HTTP 响应，达到预算后关闭连接不再下载剩余内容
+def consume_response(resp, budget: int = 16000) -> str:
+  # 仅采信响应头中显式声明的字符集；未声明时从 <meta charset> 嗅探，默认 utf-8
+  declared = "charset=" in resp.headers.get("content-type", "").lower()
+  try:
+    return extract_text(resp.iter_content(chunk_size=16384), budget, resp.encoding if declared else None)
+  finally:
+    resp.close()
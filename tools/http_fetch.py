@@ -0,0 +1,187 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api.cache import TieredCache, make_key
+from api.config import (
+  FETCH_CACHE_RETAIN,
+  FETCH_CACHE_TTL,
+  FETCH_NEGATIVE_TTL,
+  FETCH_POOL_MAXSIZE,
+  FETCH_TIMEOUT,
+)
+
+USER_AGENT = (
+  'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+)
+BROWSERLESS_URL = "https://chrome.browserless.io/content"
+
+
+# 抓取失败（含命中失败缓存）
+class FetchError(RuntimeError):
+  pass
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# 页面缓存：保留期内的条目都在磁盘上，新鲜期由 fetched_at 判断
+page_cache = TieredCache("scrape_pages", ttl=FETCH_CACHE_RETAIN, max_entries=128)
+# 失败缓存：短时间内不再重复请求失败的 URL
+failure_cache = TieredCache("scrape_failures", ttl=FETCH_NEGATIVE_TTL, max_entries=512)
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+# 进程内共享的 HTTP 会话：keep-alive 连接池，避免每次抓取都重新建立 TCP+TLS 连接
+def get_session() -> requests.Session:
+  global _session
+  with _session_lock:
+    if _session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=FETCH_POOL_MAXSIZE,
+        max_retries=Retry(total=1, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=None),
+      )
+      session.mount("http://", adapter)
+      session.mount("https://", adapter)
+      session.headers["user-agent"] = USER_AGENT
+      _session = session
+    return _session
+
+
+def _record(host: str, *, ms: Optional[float] = None, error: bool = False, **counters: bool) -> None:
+  with _stats_lock:
+    s = _stats.setdefault(host, {
+      "requests": 0, "errors": 0, "cache_hits": 0, "revalidated": 0, "negative_hits": 0,
+      "total_ms": 0.0, "max_ms": 0.0,
+    })
+    if ms is not None:
+      s["requests"] += 1
+      s["total_ms"] += ms
+      s["max_ms"] = max(s["max_ms"], ms)
+    if error:
+      s["errors"] += 1
+    for name, hit in counters.items():
+      if hit:
+        s[name] += 1
+
+
+# 按主机汇总的抓取统计：请求数、错误数、缓存命中、再验证次数与网络延迟
+def fetch_stats() -> Dict[str, Dict[str, Any]]:
+  with _stats_lock:
+    out = {}
+    for host, s in _stats.items():
+      item: Dict[str, Any] = dict(s)
+      item["avg_ms"] = round(s["total_ms"] / s["requests"], 1) if s["requests"] else 0.0
+      item["total_ms"] = round(s["total_ms"], 1)
+      item["max_ms"] = round(s["max_ms"], 1)
+      out[host] = item
+    return out
+
+
+# 带缓存的抓取：新鲜期内直接返回缓存；过期后条件请求（304 复用缓存）；失败进入失败缓存，
+# 若有过期副本则兜底返回。consume 负责把（流式）响应转换为要缓存的文本，默认读取完整 HTML
+def _cached_fetch(
+  key: str,
+  host: str,
+  send: Callable[[Dict[str, str]], requests.Response],
+  conditional: bool,
+  consume: Optional[Callable[[requests.Response], str]] = None,
+) -> str:
+  entry = page_cache.get(key)
+  now = time.time()
+  if entry is not None and now - entry["fetched_at"] < FETCH_CACHE_TTL:
+    _record(host, cache_hits=True)
+    return entry["text"]
+
+  # 近期失败过：有旧副本时继续返回旧副本，没有才报错
+  failed = failure_cache.get(key)
+  if failed is not None:
+    _record(host, negative_hits=True)
+    if entry is not None:
+      return entry["text"]
+    raise FetchError(f"近期抓取失败，暂不重试: {failed}")
+
+  headers: Dict[str, str] = {}
+  if entry is not None and conditional:
+    if entry.get("etag"):
+      headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+      headers["If-Modified-Since"] = entry["last_modified"]
+
+  start = time.perf_counter()
+  try:
+    resp = send(headers)
+    ms = (time.perf_counter() - start) * 1000
+    if resp.status_code == 304 and entry is not None:
+      resp.close()
+      entry["fetched_at"] = now
+      page_cache.set(key, entry)
+      _record(host, ms=ms, revalidated=True)
+      return entry["text"]
+    resp.raise_for_status()
+    text = consume(resp) if consume is not None else resp.text
+    ms = (time.perf_counter() - start) * 1000
+  except Exception as e:
+    _record(host, ms=(time.perf_counter() - start) * 1000, error=True)
+    failure_cache.set(key, f"{type(e).__name__}: {e}")
+    if entry is not None:
+      return entry["text"]
+    raise
+
+  page_cache.set(key, {
+    "text": text,
+    "etag": resp.headers.get("ETag"),
+    "last_modified": resp.headers.get("Last-Modified"),
+    "fetched_at": now,
+  })
+  _record(host, ms=ms)
+  return text
+
+
+# 直接抓取网页（支持 ETag/If-Modified-Since 再验证）；variant 区分不同 consume 的缓存结果
+def fetch_page(
+  url: str,
+  timeout: float = FETCH_TIMEOUT,
+  consume: Optional[Callable[[requests.Response], str]] = None,
+  variant: str = "html",
+) -> str:
+  return _cached_fetch(
+    make_key("fetch", "direct", variant, url),
+    urlsplit(url).netloc,
+    lambda headers: get_session().get(url, headers=headers, timeout=timeout, stream=True),
+    conditional=True,
+    consume=consume,
+  )
+
+
+# 通过 Browserless 渲染后抓取（渲染结果无校验头，只按 TTL 缓存）
+def fetch_rendered(
+  url: str,
+  api_key: str,
+  timeout: float = 60,
+  consume: Optional[Callable[[requests.Response], str]] = None,
+  variant: str = "html",
+) -> str:
+  return _cached_fetch(
+    make_key("fetch", "browserless", variant, url),
+    urlsplit(BROWSERLESS_URL).netloc,
+    lambda headers: get_session().post(
+      BROWSERLESS_URL,
+      params={"token": api_key},
+      json={"url": url},
+      headers={"cache-control": "no-cache", **headers},
+      timeout=timeout,
+      stream=True,
+    ),
+    conditional=False,
+    consume=consume,
+  )
@@ -1,9 +1,166 @@
-from crewai_tools import SerperDevTool
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Type
+
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from api.cache import TieredCache, make_key
+from api.metrics import track_tool
+from api.config import (
+  SEARCH_CACHE_TTL,
+  SEARCH_DEDUP_THRESHOLD,
+  SERPER_MAX_CALLS,
+  SERPER_MIN_INTERVAL,
+  SERPER_TIMEOUT,
+  SERPER_URL,
+)
+from tools.http_fetch import get_session
+
+# 搜索结果持久缓存（多 worker 共享）
+search_cache = TieredCache("serper_queries", ttl=SEARCH_CACHE_TTL, max_entries=512)
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+# 逐字切分的文字：汉字（含扩展 A 与兼容区）、平假名/片假名、韩文音节与字母
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\u31f0-\u31ff\uac00-\ud7af\u1100-\u11ff\u3130-\u318f"
+_TOKEN_RE = re.compile(rf"[{_CJK}]|[^\W{_CJK}]+")
+
+
+# 规范化查询：全半角统一、小写、去标点、合并空白（保留词序："杭州到上海" 与 "上海到杭州" 是不同的查询）
+def normalize_query(query: str) -> str:
+  q = unicodedata.normalize("NFKC", query or "").casefold()
+  q = _PUNCT_RE.sub(" ", q)
+  return " ".join(q.split())
+
+
+# 相似度用的特征：相邻单元组成的二元组（拉丁字母/数字等以词为单元，汉字、假名、韩文以字为单元，
+# 这些文字的查询中空格不影响结果）。二元组保留方向与相邻关系，"北京到上海" 与 "上海到北京"、
+# "十月" 与 "十一月"、"東京 ラーメン" 与 "東京 すし" 的特征明显不同
+def _features(normalized: str) -> set:
+  units = _TOKEN_RE.findall(normalized)
+  if len(units) < 2:
+    return set(units)
+  return set(zip(units, units[1:]))
+
+
+def _jaccard(a: set, b: set) -> float:
+  if not a or not b:
+    return 0.0
+  return len(a & b) / len(a | b)
+
+
+# 单次规划内的搜索会话：调用次数预算、相邻调用最小间隔，以及近似重复查询的去重
+class SearchSession:
+
+  def __init__(self, max_calls: int = SERPER_MAX_CALLS, min_interval: float = SERPER_MIN_INTERVAL, _shared=None):
+    self.max_calls = max_calls
+    self.min_interval = min_interval
+    self.calls = 0
+    # 间隔时钟与去重记录在同一次规划的所有子会话之间共享
+    self._shared = _shared or {"lock": threading.Lock(), "last_call": 0.0, "memo": []}
+
+  # 为另一个 crew（例如并行评估的单城调研）派生一个独立预算、共享去重与限速的会话
+  def child(self) -> "SearchSession":
+    return SearchSession(self.max_calls, self.min_interval, _shared=self._shared)
+
+  # 查找本次规划中已执行过的近似查询
+  def find_similar(self, normalized: str) -> Optional[str]:
+    feats = _features(normalized)
+    with self._shared["lock"]:
+      for other_feats, result in self._shared["memo"]:
+        if _jaccard(feats, other_feats) >= SEARCH_DEDUP_THRESHOLD:
+          return result
+    return None
+
+  def remember(self, normalized: str, result: str) -> None:
+    with self._shared["lock"]:
+      self._shared["memo"].append((_features(normalized), result))
+
+  # 占用一次调用额度；额度用尽返回 False。满足最小间隔前阻塞等待
+  def acquire(self) -> bool:
+    lock = self._shared["lock"]
+    with lock:
+      if self.calls >= self.max_calls:
+        return False
+      self.calls += 1
+      wait = self._shared["last_call"] + self.min_interval - time.monotonic()
+      self._shared["last_call"] = time.monotonic() + max(0.0, wait)
+    if wait > 0:
+      time.sleep(wait)
+    return True
+
+
+class SearchInput(BaseModel):
+  search_query: str = Field(..., description="要在互联网上搜索的查询词")
+
+
+# Serper 搜索工具：持久缓存 + 规划内去重 + 调用预算/限速 + 单次超时
+class SerperSearchTool(BaseTool):
+  name: str = "搜索互联网"
+  description: str = "使用搜索引擎检索互联网信息，输入为查询词，返回标题、链接与摘要。"
+  args_schema: Type[BaseModel] = SearchInput
+  session: Any = None
+  n_results: int = 8
+
+  def _run(self, search_query: str) -> str:
+    with track_tool("search") as outcome:
+      return self._search(search_query, outcome)
+
+  def _search(self, search_query: str, outcome: Dict[str, str]) -> str:
+    normalized = normalize_query(search_query)
+    key = make_key("serper", normalized, self.n_results)
+    cached = search_cache.get(key)
+    if cached is not None:
+      outcome["status"] = "cache"
+      return cached
+
+    session = self.session
+    if session is not None:
+      similar = session.find_similar(normalized)
+      if similar is not None:
+        outcome["status"] = "dedup"
+        return similar
+      if not session.acquire():
+        outcome["status"] = "budget_exhausted"
+        return f"[SearchTools] 本次规划的搜索次数已用完（{session.max_calls} 次），请基于已有信息继续。"
+
+    api_key = os.environ.get("SERPER_API_KEY", "")
+    try:
+      resp = get_session().post(
+        SERPER_URL,
+        headers={"X-API-KEY": api_key, "content-type": "application/json"},
+        json={"q": search_query, "num": self.n_results},
+        timeout=SERPER_TIMEOUT,
+      )
+      resp.raise_for_status()
+      result = self._format(resp.json())
+    except Exception as e:
+      outcome["status"] = "error"
+      return f"[SearchTools] 搜索失败: {type(e).__name__}: {e}"
+
+    search_cache.set(key, result)
+    if session is not None:
+      session.remember(normalized, result)
+    return result
+
+  def _format(self, data: Dict[str, Any]) -> str:
+    lines: List[str] = []
+    answer = data.get("answerBox") or {}
+    if answer.get("answer") or answer.get("snippet"):
+      lines.append(f"直接答案: {answer.get('answer') or answer.get('snippet')}\n---")
+    for item in (data.get("organic") or [])[:self.n_results]:
+      lines.append(
+        f"标题: {item.get('title', '')}\n链接: {item.get('link', '')}\n摘要: {item.get('snippet', '')}\n---"
+      )
+    return "\n".join(lines) if lines else "未找到相关结果"
 
 
 class SearchTools():
 
   @staticmethod
-  # 使用内置的serper工具
-  def search_tool():
-    return SerperDevTool()
+  # 带缓存、去重与预算控制的 Serper 搜索；session 为同一次规划共享的搜索会话
+  def search_tool(session: Optional[SearchSession] = None):
+    return SerperSearchTool(session=session)